@@ -0,0 +1,109 @@
+import asyncio
+import inspect
+import logging
+
+from backend.hotel_catalog import HotelCatalog
+from backend.models import CustomerProfile
+from backend.pilot_engine import _LOAD_PROFILE, _PROFILE, _READ, Pilot
+from backend.storage import FirestoreStorage, firestore_storage
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPilot(Pilot):
+    """
+    Asyncio version of the Pilot running on the Firestore async client.
+
+    The stages of a request are Pilot's; only the Firestore I/O they yield is run
+    asynchronously. The customer profile is fetched while the query is being
+    triaged, and up to `max_in_flight` requests are processed concurrently.
+    """
+
+    def __init__(self, storage=None, write_batcher=None, profile_cache=None, hotel_catalog=None, metrics=None, task_rules=None,
+                 idempotency=None, dispatcher=None, ledger=None, preferences=None, preload_hotels=False,
+                 max_in_flight=100):
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        # `storage` must be a FirestoreStorage over the async client; the catalog's
+        # snapshot listener needs a sync client to the same database, and so do the storage
+        # of a `ledger` and of a `dispatcher`.
+        storage = storage or firestore_storage(use_async=True)
+        if hotel_catalog is None:
+            hotel_catalog = HotelCatalog(storage.sync_storage() if isinstance(storage, FirestoreStorage) else storage)
+        super().__init__(storage=storage, write_batcher=write_batcher,
+                         profile_cache=profile_cache, hotel_catalog=hotel_catalog, metrics=metrics,
+                         task_rules=task_rules, idempotency=idempotency, dispatcher=dispatcher, ledger=ledger,
+                         preferences=preferences, preload_hotels=preload_hotels)
+
+    async def _ensure_hotels(self):
+        # Load the catalog off the event loop; later lookups are plain dict reads.
+        if not self.hotels.loaded:
+            await asyncio.to_thread(self.hotels.load)
+
+    async def process_request(self, customer_id, request_details):
+        """
+        Main function to process a customer's request and trigger task allocation.
+        Waits for a free slot when `max_in_flight` requests are already being processed.
+        """
+        async with self._semaphore:
+            await self._ensure_hotels()
+            timer = self.metrics.start_request()
+            # Set in this request's task, so the profile load started below counts towards it too.
+            request_log = self._start_request_log(customer_id, request_details)
+            steps = self._pipeline(timer, customer_id, request_details)
+            send, value = steps.send, None
+            outcome = 'error'
+            try:
+                while True:
+                    try:
+                        step, arg = send(value)
+                    except StopIteration:
+                        outcome = 'ok'
+                        return
+                    try:
+                        if step is _LOAD_PROFILE:
+                            # Start the profile read and let it go out on the wire before triaging.
+                            value = asyncio.create_task(self._get_customer_profile_async(arg))
+                            await asyncio.sleep(0)
+                        elif step is _PROFILE:
+                            # Only the part of the fetch that triage did not hide is counted.
+                            value = await arg
+                            timer.mark('profile_fetch')
+                        elif step is _READ:
+                            value = arg()
+                            if inspect.isawaitable(value):
+                                value = await value
+                            self.metrics.count('reads')
+                        else:
+                            if request_log is not None:
+                                request_log.writes += arg.size
+                            value = await arg.commit_async()
+                        send = steps.send
+                    except Exception as error:
+                        send, value = steps.throw, error
+            finally:
+                if request_log is not None:
+                    request_log.close(logger, outcome)
+
+    async def process_requests(self, requests):
+        """Processes (customer_id, request_details) pairs concurrently, bounded by `max_in_flight`."""
+        await asyncio.gather(*(self.process_request(customer_id, request_details) for customer_id, request_details in requests))
+
+    async def _get_customer_profile_async(self, customer_id):
+        """Retrieves a customer profile from the profile cache, loading it from Firestore on a miss."""
+        return await self.profiles.get_or_load_async(customer_id, self._load_customer_profile_async)
+
+    async def _load_customer_profile_async(self, customer_id):
+        """Retrieves or creates a customer profile from Firestore."""
+        doc_ref = self.db.collection('customers').document(customer_id)
+        doc = await doc_ref.get()
+        self.metrics.count('reads')
+        if doc.exists:
+            return self._with_pending_tokens(CustomerProfile.from_firestore(doc.to_dict(), customer_id))
+        new_profile = self._new_customer_profile(customer_id)
+        try:
+            self.metrics.count('writes')
+            await doc_ref.create(new_profile.to_firestore())
+        except self.db.AlreadyExists:
+            self.metrics.count('reads')
+            return self._with_pending_tokens(CustomerProfile.from_firestore((await doc_ref.get()).to_dict(), customer_id))
+        return self._with_pending_tokens(new_profile)
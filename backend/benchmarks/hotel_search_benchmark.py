@@ -0,0 +1,85 @@
+"""
+Benchmarks HotelSearch query and update latency as the catalog grows.
+
+Builds synthetic catalogs shaped like firebase-admin-project's generated hotels
+(location, amenities, rating) plus a class and management style, then times a fixed
+mix of filter and top-k queries and single-hotel updates at each catalog size.
+
+    python -m backend.benchmarks.hotel_search_benchmark --sizes 1000 10000 50000
+"""
+import argparse
+import random
+import time
+
+from backend.benchmarks.pilot_benchmark import percentile
+from backend.hotel_search import HotelSearch
+
+LOCATIONS = ["New York, USA", "London, UK", "Paris, France", "Tokyo, Japan", "Sydney, Australia", "Rome, Italy", "Dubai, UAE",
+             "Rio de Janeiro, Brazil"]
+AMENITIES = ["Wi-Fi", "Pool", "Gym", "Restaurant", "Bar", "Spa", "Lounge", "Conference Room", "Room Service", "Laundry"]
+STYLES = ['Eco-Friendly & Sustainable', 'Luxury & High-End', 'Business & Corporate', 'Family & Group-Oriented', 'Guest Experience-Centric']
+
+QUERIES = [
+    {'location': 'Tokyo', 'amenities': ['Spa', 'Pool'], 'style': 'eco-friendly', 'min_rating': 4.2},
+    {'location': 'Paris, France', 'hotel_class': 'high', 'limit': 20},
+    {'amenities': ['Gym'], 'min_rating': 3.5, 'max_rating': 4.5},
+    {'style': 'luxury', 'amenities': ['Spa', 'Bar', 'Lounge']},
+    {'limit': 10},
+]
+
+
+def generate_hotels(count, rng):
+    return {f'hotel_{i}': {
+        'hotel_id': f'hotel_{i}',
+        'name': f'Hotel Excellence #{i}',
+        'location': rng.choice(LOCATIONS),
+        'rating': round(rng.uniform(3.0, 5.0), 1),
+        'rooms': rng.randint(50, 500),
+        'amenities': rng.sample(AMENITIES, rng.randint(2, 6)),
+        'class': rng.choice(['low', 'mid', 'high']),
+        'management_system': rng.choice(STYLES)
+    } for i in range(1, count + 1)}
+
+
+def run(size, rounds, rng):
+    hotels = generate_hotels(size, rng)
+    search = HotelSearch()
+    start = time.perf_counter()
+    search.apply_diff(hotels)
+    build = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            search.search(**query)
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    updates = []
+    for i in range(min(rounds, size)):
+        hotel_id = f'hotel_{rng.randint(1, size)}'
+        changed = dict(hotels[hotel_id], rating=round(rng.uniform(3.0, 5.0), 1), amenities=rng.sample(AMENITIES, 3))
+        start = time.perf_counter()
+        search.apply_diff({hotel_id: changed})
+        updates.append(time.perf_counter() - start)
+    updates.sort()
+    return build, latencies, updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='catalog sizes to benchmark')
+    parser.add_argument('--rounds', type=int, default=200, help='passes over the query mix per size')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for size in args.sizes:
+        build, latencies, updates = run(size, args.rounds, rng)
+        print(f"{size:>7} hotels: build {build * 1000:.0f} ms, query p50 {percentile(latencies, 50) * 1e6:.1f} us, "
+              f"p99 {percentile(latencies, 99) * 1e6:.1f} us, update p50 {percentile(updates, 50) * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Benchmarks the Pilot request pipeline against a local storage backend.
+
+Runs a synthetic guest workload through Pilot.process_request and through the
+triage, intent, task generation and reward stages on their own, then reports
+p50/p95/p99 latency, requests per second and allocations per request, and times
+Pilot.triage_batch against the single-query path. Results are written as JSON so
+runs from different versions can be compared with --compare.
+
+    python -m backend.benchmarks.pilot_benchmark --requests 5000 --output bench.json
+    python -m backend.benchmarks.pilot_benchmark --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+from backend.models import GuestRequest
+from backend.pilot_engine import Pilot
+from backend.storage import MemoryStorage, SQLiteStorage
+
+# Default query mix: (weight, request) pairs modelled on the client simulator.
+DEFAULT_MIX = [
+    (3, {'type': 'query', 'query': 'Could you please help with a wi-fi issue?'}),
+    (2, {'type': 'review', 'query': 'The housekeeping service was excellent, thank you!'}),
+    (1, {'type': 'query', 'query': 'I need a diabetic-friendly meal plan for my stay.'}),
+    (2, {'type': 'query', 'query': 'I would like to opt out of daily linen changes for 3 days.', 'duration_days': 3}),
+    (1, {'type': 'query', 'query': 'I am an asthmatic. I need a room away from allergens.'}),
+    (2, {'type': 'buzzer_request', 'query': 'Can I get some fresh towels?'}),
+    (2, {'type': 'review', 'query': 'The service was terribly slow.'}),
+    (1, {'type': 'query', 'query': 'Please turn off lights and keep the ac down while I am out.'}),
+    (1, {'type': 'query', 'query': 'Is there a bike rental or bus pass for guests?'}),
+    (1, {'type': 'query', 'query': 'What are the romantic activities available?'}),
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, elapsed):
+    """Returns latency percentiles (milliseconds) and throughput for a run."""
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'requests_per_sec': len(ordered) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0
+    }
+
+
+def build_workload(num_requests, num_hotels, num_customers, mix, seed):
+    """Returns a reproducible list of (customer_id, request_details) pairs."""
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in mix]
+    templates = [request for _, request in mix]
+    workload = []
+    for _ in range(num_requests):
+        request = dict(rng.choices(templates, weights)[0])
+        request['hotel_id'] = f'hotel_{rng.randint(1, num_hotels)}'
+        workload.append((f'customer_{rng.randint(1, num_customers):06d}', request))
+    return workload
+
+
+def build_storage(kind, num_hotels, sqlite_path):
+    """Creates a storage backend seeded with `num_hotels` hotels."""
+    if kind == 'sqlite':
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+        storage = SQLiteStorage(sqlite_path)
+    else:
+        storage = MemoryStorage()
+    batch = storage.batch()
+    for i in range(1, num_hotels + 1):
+        batch.set(storage.collection('hotels').document(f'hotel_{i}'), {'hotel_id': f'hotel_{i}', 'name': f'Benchmark Hotel #{i}', 'class': 'mid'})
+    batch.commit()
+    return storage
+
+
+def run_pipeline(pilot, workload, rate):
+    """Runs the workload through process_request; with `rate` > 0 requests are sent open-loop at that rate."""
+    latencies = []
+    start = time.perf_counter()
+    for i, (customer_id, request_details) in enumerate(workload):
+        scheduled = start + i / rate if rate else time.perf_counter()
+        now = time.perf_counter()
+        if now < scheduled:
+            time.sleep(scheduled - now)
+        pilot.process_request(customer_id, dict(request_details))
+        # Latency counts from the scheduled send time, so falling behind shows up as queueing.
+        latencies.append(time.perf_counter() - scheduled)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_stages(pilot, workload):
+    """Times the pipeline stages on their own over the same workload."""
+    profile = pilot._new_customer_profile('benchmark_customer')
+    hotel = {'hotel_id': 'hotel_1'}
+    timings = {'triage': [], 'intent': [], 'generate_tasks': [], 'allocate_rewards': []}
+    for _, request_details in workload:
+        request = GuestRequest.from_dict(request_details)
+        query = request.query
+
+        t0 = time.perf_counter()
+        category, sentiment = pilot._triage_request(request)
+        t1 = time.perf_counter()
+        intent, entities = pilot._recognize_intent(query, category)
+        t2 = time.perf_counter()
+        tasks = pilot._generate_tasks(category, intent, entities, profile, hotel, sentiment)
+        t3 = time.perf_counter()
+        # The batch is never committed; storage cost is measured by the pipeline run.
+        pilot._allocate_rewards(profile, request, tasks, sentiment, writes=pilot.writes.begin())
+        t4 = time.perf_counter()
+
+        timings['triage'].append(t1 - t0)
+        timings['intent'].append(t2 - t1)
+        timings['generate_tasks'].append(t3 - t2)
+        timings['allocate_rewards'].append(t4 - t3)
+    return {stage: summarize(values, sum(values)) for stage, values in timings.items()}
+
+
+def run_triage_batch(pilot, workload, num_queries):
+    """
+    Times Pilot.triage_batch against the single-query path (one scan and the same
+    rules per query) on `num_queries` distinct queries drawn from the workload.
+    """
+    queries = [f'{workload[i % len(workload)][1].get("query", "")} #{i}' for i in range(num_queries)]
+    start = time.perf_counter()
+    for query in queries:
+        matches = pilot._match_keywords(query)
+        category, _ = pilot._triage_request(GuestRequest(query=query), matches)
+        pilot._recognize_intent(query, category, matches)
+        matches.first('reward')
+        matches.has('politeness')
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    pilot.triage_batch(queries)
+    batch = time.perf_counter() - start
+    return {
+        'queries': num_queries,
+        'single_sec': single,
+        'batch_sec': batch,
+        'speedup': single / batch if batch else 0.0
+    }
+
+
+def measure_allocations(pilot, workload):
+    """Returns traced allocation peak and retained blocks per request (run separately, tracing is slow)."""
+    tracemalloc.start()
+    try:
+        peaks = []
+        blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        for customer_id, request_details in workload:
+            current_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            pilot.process_request(customer_id, dict(request_details))
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current_before)
+        blocks_after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    return {
+        'alloc_peak_bytes_per_request': sum(peaks) / len(peaks) if peaks else 0.0,
+        'retained_blocks_per_request': (blocks_after - blocks_before) / len(peaks) if peaks else 0.0
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous, current):
+    """Prints the change of each headline metric relative to a previous result file."""
+    print(f"\nComparison against {previous.get('version', 'unknown')}:")
+    rows = [('pipeline', key) for key in ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms')]
+    rows += [(f'stages.{stage}', 'p50_ms') for stage in current['stages']]
+    rows.append(('triage_batch', 'speedup'))
+    for section, key in rows:
+        old, new = previous, current
+        for part in section.split('.'):
+            old, new = old.get(part, {}), new.get(part, {})
+        if key in old and key in new and old[key]:
+            print(f"  {section}.{key}: {old[key]:.4f} -> {new[key]:.4f} ({(new[key] - old[key]) / old[key] * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='number of requests in the workload')
+    parser.add_argument('--hotels', type=int, default=50, help='number of hotels in the catalog')
+    parser.add_argument('--customers', type=int, default=500, help='number of distinct customers')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second (0 = as fast as possible)')
+    parser.add_argument('--mix', help='JSON file with [[weight, request], ...] to replace the default query mix')
+    parser.add_argument('--storage', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--sqlite-path', default='pilot_benchmark.db')
+    parser.add_argument('--alloc-requests', type=int, default=200, help='requests traced for allocation stats (0 to skip)')
+    parser.add_argument('--triage-queries', type=int, default=200000, help='distinct queries for the triage_batch comparison (0 to skip)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='previous results JSON file to compare against')
+    args = parser.parse_args()
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        with open(args.mix, 'r', encoding='utf-8') as f:
+            mix = [tuple(entry) for entry in json.load(f)]
+    workload = build_workload(args.requests, args.hotels, args.customers, mix, args.seed)
+
+    pilot = Pilot(storage=build_storage(args.storage, args.hotels, args.sqlite_path))
+    pilot.hotels.load()
+    pipeline = run_pipeline(pilot, workload, args.rate)
+    stages = run_stages(pilot, workload)
+    allocations = measure_allocations(pilot, workload[:args.alloc_requests]) if args.alloc_requests else {}
+    triage_batch = run_triage_batch(pilot, workload, args.triage_queries) if args.triage_queries and workload else {}
+
+    results = {
+        'version': git_version(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'pipeline': pipeline | allocations | {'storage_reads': pilot.db.reads, 'storage_writes': pilot.db.writes},
+        'stages': stages,
+        'triage_batch': triage_batch,
+        'profile_cache': pilot.profiles.stats()
+    }
+
+    print(f"Pipeline: {pipeline['requests_per_sec']:.0f} req/s, p50 {pipeline['p50_ms']:.3f} ms, "
+          f"p95 {pipeline['p95_ms']:.3f} ms, p99 {pipeline['p99_ms']:.3f} ms")
+    for stage, stats in stages.items():
+        print(f"  {stage:<17} p50 {stats['p50_ms'] * 1000:.1f} us, p99 {stats['p99_ms'] * 1000:.1f} us")
+    if allocations:
+        print(f"Allocations: {allocations['alloc_peak_bytes_per_request']:.0f} bytes peak, "
+              f"{allocations['retained_blocks_per_request']:.1f} retained blocks per request")
+    if triage_batch:
+        print(f"Triage batch: {triage_batch['queries']} distinct queries in {triage_batch['batch_sec']:.2f} s, "
+              f"single-query path {triage_batch['single_sec']:.2f} s ({triage_batch['speedup']:.1f}x)")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
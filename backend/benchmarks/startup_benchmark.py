@@ -0,0 +1,70 @@
+"""
+Benchmarks cold-start time of the pilot engine in fresh interpreters.
+
+Each run starts a new Python process, so nothing is cached between runs except
+the OS page cache. Reports the median wall time of a bare interpreter, of
+`python -c "import backend.pilot_engine"`, and, split into phases, of importing
+the engine, constructing a Pilot over a seeded MemoryStorage and processing the
+first request.
+
+    python -m backend.benchmarks.startup_benchmark --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs in the child process; prints the phase timings as JSON.
+FIRST_REQUEST = """
+import json, time
+start = time.perf_counter()
+from backend.pilot_engine import Pilot
+from backend.benchmarks.pilot_benchmark import build_storage
+imported = time.perf_counter()
+storage = build_storage('memory', {hotels}, None)
+seeded = time.perf_counter()
+pilot = Pilot(storage=storage)
+constructed = time.perf_counter()
+pilot.process_request('customer_000001', {{'type': 'query', 'query': 'Could you please help with a wi-fi issue?', 'hotel_id': 'hotel_1'}})
+done = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'construct': constructed - seeded, 'first_request': done - constructed}}))
+"""
+
+
+def wall_time(code):
+    """Returns the wall time of `python -c code` in a fresh interpreter, and its output."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters started per measurement')
+    parser.add_argument('--hotels', type=int, default=50, help='number of hotels in the catalog')
+    args = parser.parse_args()
+
+    interpreter = statistics.median(wall_time('pass')[0] for _ in range(args.runs))
+    engine_import = statistics.median(wall_time('import backend.pilot_engine')[0] for _ in range(args.runs))
+    phases = {}
+    totals = []
+    for _ in range(args.runs):
+        total, output = wall_time(FIRST_REQUEST.format(hotels=args.hotels))
+        totals.append(total)
+        for phase, seconds in json.loads(output).items():
+            phases.setdefault(phase, []).append(seconds)
+
+    print(f"interpreter startup:        {interpreter * 1000:.1f} ms")
+    print(f"import backend.pilot_engine: {engine_import * 1000:.1f} ms ({(engine_import - interpreter) * 1000:.1f} ms over startup)")
+    print(f"first request, end to end:  {statistics.median(totals) * 1000:.1f} ms")
+    for phase, values in phases.items():
+        print(f"  {phase:<14} {statistics.median(values) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
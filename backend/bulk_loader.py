@@ -0,0 +1,404 @@
+"""
+Bulk loader for the hotel and scenario catalogs.
+
+Records are streamed from the source file rather than read with `json.load`, grouped
+into write batches of at most 500 documents (Firestore's limit), and several batches
+are committed concurrently, each retried with exponential backoff. Progress is
+checkpointed per batch, so an interrupted import of an unmodified source resumes with
+the first batch that had not been committed. Every write is a `set`, so replaying a batch is harmless.
+
+A manifest next to the source file keeps a content hash of every document written,
+so a re-run only writes the records that are new or changed since the last complete
+load (and, with `prune`, deletes the ones no longer in the source). A source whose
+size and modification time match the manifest is not read at all. The manifest is
+only used for the database it was built against, and not when the collection there
+has since been emptied.
+
+    python -m backend.bulk_loader data/hotels_data.json --collection hotels --id-field hotel_id
+    python -m backend.bulk_loader Hotel_Eco_Scenarios.md --collection scenarios --id-field id
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backend.storage import SQLiteStorage, firestore_storage
+from backend.write_batcher import MAX_BATCH_OPS
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_records(path, chunk_size=1 << 16):
+    """
+    Yields the elements of a top-level JSON array one at a time, reading `chunk_size`
+    characters at a time. JSON-lines files (one object per line) are read the same way.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+        while True:
+            # Skip whitespace and the array punctuation between elements.
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]':
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+                continue
+            try:
+                record, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element runs past the end of the buffer; read more and retry.
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield record
+            pos = end
+
+
+_HOTEL_HEADER = re.compile(r'\*\*Hotel: (.+?) \((.+?)\)\*\*')
+_SCENARIO_LINE = re.compile(r'^(\d+)\. \*\*Scenario #(\d+):(.+?)earning \*\*(.+?) tokens\*\*')
+_CLIENT = re.compile(r'Client (.+?) \(Budget: (.+?)\)')
+
+
+def iter_markdown_scenarios(path):
+    """Yields scenario dictionaries from the eco scenarios Markdown file, line by line."""
+    current_hotel = ''
+    current_hotel_budget = ''
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # Hotel headers and scenario lines are both bold; most other lines are skipped here.
+            if '**' not in line:
+                continue
+            line = line.rstrip('\n')
+            hotel_match = _HOTEL_HEADER.search(line)
+            if hotel_match:
+                current_hotel = hotel_match.group(1).strip()
+                current_hotel_budget = hotel_match.group(2).replace('-End', '').strip()
+                continue
+
+            scenario_match = _SCENARIO_LINE.search(line)
+            if scenario_match:
+                description = scenario_match.group(3).strip()
+                client_match = _CLIENT.search(description)
+                yield {
+                    "id": int(scenario_match.group(1)),
+                    "hotel_name": current_hotel,
+                    "hotel_budget": current_hotel_budget,
+                    "client_name": client_match.group(1) if client_match else 'Unknown',
+                    "client_budget": client_match.group(2) if client_match else 'Unknown',
+                    "description": description,
+                    "tokens": int(scenario_match.group(4).replace(',', ''))
+                }
+
+
+def iter_records(path):
+    """Streams records from a JSON array, JSON-lines or scenarios Markdown file."""
+    if path.endswith('.md'):
+        return iter_markdown_scenarios(path)
+    return iter_json_records(path)
+
+
+def fingerprint(record):
+    """Returns a content hash of a record that does not depend on its key order."""
+    data = json.dumps(record, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class Manifest:
+    """
+    Content hashes of the documents last loaded into a collection, stored as a JSON file.
+
+    The file also records the size and modification time of the source it was built
+    from, and is keyed by the `destination` database's identity, collection and ID
+    field. It is only written after a load completes, so an interrupted load sees the
+    same manifest, and therefore the same batches, when it resumes.
+    """
+
+    def __init__(self, path, collection, doc_id_field, destination=None):
+        self.path = path
+        self.key = {'destination': destination, 'collection': collection, 'doc_id_field': doc_id_field}
+        self.hashes = {}
+        self.source_stat = None
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("ignoring unreadable manifest path=%s: %s", path, e)
+            return
+        if manifest.get('key') != self.key:
+            logger.warning("ignoring manifest for a different destination or collection path=%s", path)
+            return
+        self.hashes = manifest['hashes']
+        self.source_stat = manifest.get('source_stat')
+
+    def reset(self):
+        """Forgets the loaded documents, so every record is written again."""
+        self.hashes = {}
+        self.source_stat = None
+
+    def save(self, source_stat=None):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': self.key, 'source_stat': source_stat, 'hashes': self.hashes}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+class BulkLoader:
+    """
+    Writes a stream of records to one collection in concurrent, retried batches.
+
+    With `checkpoint_path` set, the indices of committed batches are saved after each
+    commit and skipped on the next run over the same, unmodified source (as told by
+    `source_stat`); the checkpoint is removed
+    once the whole source has been loaded. With `manifest_path` set, records whose
+    content hash matches the manifest are not written, and with `prune` documents
+    in the manifest that the source no longer has are deleted. A manifest is ignored
+    if the collection turns out to be empty.
+    """
+
+    def __init__(self, db, collection, doc_id_field, batch_size=MAX_BATCH_OPS, max_concurrent=4,
+                 max_retries=5, backoff=0.5, checkpoint_path=None, manifest_path=None, prune=False):
+        if not 0 < batch_size <= MAX_BATCH_OPS:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_OPS}, got {batch_size}")
+        self.db = db
+        self.collection = collection
+        self.doc_id_field = doc_id_field
+        self.batch_size = batch_size
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.checkpoint_path = checkpoint_path
+        self.manifest = Manifest(manifest_path, collection, doc_id_field, db.identity) if manifest_path else None
+        self.prune = prune
+        self._target_checked = False
+
+    def check_target(self):
+        """Drops the manifest's hashes if the collection is empty, e.g. after the database was reset."""
+        if self._target_checked or self.manifest is None or not self.manifest.hashes:
+            return
+        self._target_checked = True
+        collection = self.db.collection(self.collection)
+        query = collection.limit(1) if hasattr(collection, 'limit') else collection
+        if next(iter(query.stream()), None) is None:
+            logger.warning("collection is empty, writing every record collection=%s manifest=%s", self.collection, self.manifest.path)
+            self.manifest.reset()
+
+    def load(self, records, source=None, source_stat=None):
+        """Loads `records` and returns counts of written, skipped, resumed, unchanged and removed documents."""
+        self.check_target()
+        checkpoint_key = self._checkpoint_key(source, source_stat)
+        done = self._read_checkpoint(checkpoint_key)
+        stats = {'written': 0, 'skipped': 0, 'resumed': 0, 'unchanged': 0, 'removed': 0, 'batches': 0, 'retries': 0}
+        # doc_id -> hash of every record in the source, and of those known to be in the collection, for the manifest.
+        seen = {} if self.manifest is not None else None
+        loaded = {} if self.manifest is not None else None
+        with ThreadPoolExecutor(self.max_concurrent) as executor:
+            pending = {}
+            for index, chunk in enumerate(self._chunks(records, stats, seen, loaded)):
+                if index in done:
+                    stats['resumed'] += len(chunk)
+                    if source_stat is not None:
+                        # Committed by an earlier run over this same unmodified source.
+                        self._loaded(chunk, seen, loaded)
+                    continue
+                if len(pending) >= self.max_concurrent:
+                    self._collect(pending, wait(pending, return_when=FIRST_COMPLETED).done, done, checkpoint_key, stats, seen, loaded)
+                # Deletions are counted as removed when the chunks are built.
+                pending[executor.submit(self._commit, chunk)] = (index, chunk)
+            self._collect(pending, list(pending), done, checkpoint_key, stats, seen, loaded)
+        if self.manifest is not None:
+            if not self.prune:
+                # Documents missing from the source stay in the collection, so they stay in the manifest.
+                loaded.update((doc_id, digest) for doc_id, digest in self.manifest.hashes.items() if doc_id not in seen)
+            self.manifest.hashes = loaded
+            self.manifest.save(source_stat)
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return stats
+
+    def _chunks(self, records, stats, seen, loaded):
+        chunk = []
+        known = self.manifest.hashes if self.manifest is not None else None
+        for record in records:
+            doc_id = record.get(self.doc_id_field)
+            if doc_id is None or doc_id == '':
+                logger.warning("skipping record without %s collection=%s", self.doc_id_field, self.collection)
+                stats['skipped'] += 1
+                continue
+            doc_id = str(doc_id)
+            if seen is not None:
+                digest = seen[doc_id] = fingerprint(record)
+                if known.get(doc_id) == digest:
+                    loaded[doc_id] = digest
+                    stats['unchanged'] += 1
+                    continue
+            chunk.append((doc_id, record))
+            if len(chunk) == self.batch_size:
+                yield chunk
+                chunk = []
+        if self.prune and seen is not None:
+            for doc_id in known:
+                if doc_id not in seen:
+                    # A None record deletes the document.
+                    chunk.append((doc_id, None))
+                    stats['removed'] += 1
+                    if len(chunk) == self.batch_size:
+                        yield chunk
+                        chunk = []
+        if chunk:
+            yield chunk
+
+    def _collect(self, pending, finished, done, checkpoint_key, stats, seen, loaded):
+        error = None
+        for future in finished:
+            index, chunk = pending.pop(future)
+            try:
+                stats['retries'] += future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            size = sum(record is not None for _, record in chunk)
+            self._loaded(chunk, seen, loaded)
+            stats['written'] += size
+            stats['batches'] += 1
+            done.add(index)
+            self._write_checkpoint(checkpoint_key, done)
+            logger.info("committed batch collection=%s batch=%d documents=%d", self.collection, index, size)
+        if error is not None:
+            # A batch used up its retries; the batches committed so far stay checkpointed.
+            raise error
+
+    def _loaded(self, chunk, seen, loaded):
+        # Only records known to be in the collection go into the manifest.
+        if loaded is None:
+            return
+        for doc_id, record in chunk:
+            if record is None:
+                loaded.pop(doc_id, None)
+            else:
+                loaded[doc_id] = seen[doc_id]
+
+    def _commit(self, chunk):
+        collection = self.db.collection(self.collection)
+        for attempt in range(self.max_retries + 1):
+            batch = self.db.batch()
+            for doc_id, record in chunk:
+                if record is None:
+                    batch.delete(collection.document(doc_id))
+                else:
+                    batch.set(collection.document(doc_id), record)
+            try:
+                batch.commit()
+                return attempt
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning("batch commit failed, retrying in %.1fs collection=%s error=%s", delay, self.collection, e)
+                time.sleep(delay)
+
+    # --- Checkpoint ---
+
+    def _checkpoint_key(self, source, source_stat):
+        # The manifest decides which records are batched, so only a run that uses it can resume one that did.
+        # A source edited since the checkpoint was written may have changed the records of committed batches.
+        return {'source': source, 'source_stat': source_stat, 'collection': self.collection, 'batch_size': self.batch_size,
+                'incremental': self.manifest is not None, 'prune': self.prune}
+
+    def _read_checkpoint(self, checkpoint_key):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("ignoring unreadable checkpoint path=%s: %s", self.checkpoint_path, e)
+            return set()
+        if checkpoint.get('key') != checkpoint_key:
+            # Batch boundaries only line up with a run over the same unmodified source and batch size.
+            logger.warning("ignoring checkpoint for a different load path=%s", self.checkpoint_path)
+            return set()
+        done = set(checkpoint['done'])
+        logger.info("resuming load collection=%s committed_batches=%d", self.collection, len(done))
+        return done
+
+    def _write_checkpoint(self, checkpoint_key, done):
+        if not self.checkpoint_path:
+            return
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': checkpoint_key, 'done': sorted(done)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def load_file(db, path, collection, doc_id_field, checkpoint_path=None, manifest_path=None, full=False, **options):
+    """
+    Streams `path` into `collection`, checkpointing to `<path>.<collection>.checkpoint`
+    and writing only new or changed records according to `<path>.<collection>.manifest`
+    by default. With `full`, every record is written and the manifest rebuilt.
+    """
+    if checkpoint_path is None:
+        checkpoint_path = f"{path}.{collection}.checkpoint"
+    if manifest_path is None:
+        manifest_path = f"{path}.{collection}.manifest"
+    if full and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    loader = BulkLoader(db, collection, doc_id_field, checkpoint_path=checkpoint_path, manifest_path=manifest_path, **options)
+    stat = os.stat(path)
+    source_stat = [stat.st_size, stat.st_mtime_ns]
+    loader.check_target()
+    if loader.manifest.source_stat == source_stat and not os.path.exists(checkpoint_path):
+        logger.info("source unchanged since the last load path=%s collection=%s", path, collection)
+        return {'written': 0, 'skipped': 0, 'resumed': 0, 'unchanged': len(loader.manifest.hashes), 'removed': 0,
+                'batches': 0, 'retries': 0}
+    stats = loader.load(iter_records(path), source=os.path.abspath(path), source_stat=source_stat)
+    logger.info("loaded %s into %s written=%d unchanged=%d removed=%d skipped=%d resumed=%d retries=%d", path, collection,
+                stats['written'], stats['unchanged'], stats['removed'], stats['skipped'], stats['resumed'], stats['retries'])
+    return stats
+
+
+def main():
+    from backend.metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description='Stream a hotel or scenario catalog into storage in resumable batches.')
+    parser.add_argument('path', help='JSON array, JSON-lines or scenarios Markdown file')
+    parser.add_argument('--collection', required=True)
+    parser.add_argument('--id-field', required=True, help='record field used as the document ID')
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_OPS)
+    parser.add_argument('--concurrency', type=int, default=4, help='batches committed at the same time')
+    parser.add_argument('--retries', type=int, default=5)
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <path>.<collection>.checkpoint)')
+    parser.add_argument('--manifest', help='content hash manifest (default: <path>.<collection>.manifest)')
+    parser.add_argument('--full', action='store_true', help='write every record, not only new or changed ones')
+    parser.add_argument('--prune', action='store_true', help='delete documents whose records were removed from the source')
+    parser.add_argument('--storage', choices=['firestore', 'sqlite'], default='firestore')
+    parser.add_argument('--sqlite-path', default='pilot.db')
+    parser.add_argument('--credentials', help='service account key file (default: ECO_PILOT_CREDENTIALS)')
+    args = parser.parse_args()
+
+    configure_logging()
+    db = SQLiteStorage(args.sqlite_path) if args.storage == 'sqlite' else firestore_storage(args.credentials)
+    stats = load_file(db, args.path, args.collection, args.id_field, checkpoint_path=args.checkpoint, manifest_path=args.manifest,
+                      full=args.full, prune=args.prune, batch_size=args.batch_size, max_concurrent=args.concurrency,
+                      max_retries=args.retries)
+    print(f"Uploaded {stats['written']} documents to '{args.collection}' in {stats['batches']} batches "
+          f"({stats['unchanged']} unchanged, {stats['removed']} removed, {stats['resumed']} already loaded, {stats['skipped']} skipped).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+from backend.models import Priority, TaskStatus
+from backend.storage import SERVER_TIMESTAMP
+from backend.write_batcher import WriteBatcher
+
+logger = logging.getLogger(__name__)
+
+# Seconds from submission until a task of each priority must be done.
+DEFAULT_SLA = {
+    Priority.CRITICAL: 15 * 60,
+    Priority.HIGH: 60 * 60,
+    Priority.MEDIUM: 4 * 3600,
+    Priority.LOW: 24 * 3600
+}
+_LEVELS = tuple(Priority)
+
+
+class _Dispatch:
+    """Scheduler state of one open task."""
+    __slots__ = ('task', 'level', 'deadline', 'seq', 'staff_id', 'submitted_at', 'assigned_at', 'escalations')
+
+    def __init__(self, task, level, deadline, seq, submitted_at):
+        self.task = task
+        self.level = level
+        self.deadline = deadline
+        self.seq = seq
+        self.staff_id = None
+        self.submitted_at = submitted_at
+        self.assigned_at = None
+        self.escalations = 0
+
+
+class DispatchScheduler:
+    """
+    Assigns staff tasks to available staff, most urgent first, and escalates overdue ones.
+
+    Each (hotel_id, role) has a heap of waiting tasks ordered by priority, then SLA
+    deadline, and a heap of its staff ordered by how many tasks they hold; a staff
+    member holds at most `capacity` tasks at once. Submitting a task, completing one
+    or adding staff assigns waiting tasks in O(log n) each. A task's deadline is its
+    submission time plus the `sla` of its priority. `tick` escalates waiting tasks
+    past their deadline by one priority level (with a new deadline at that level) and
+    reports assigned tasks past their deadline once, through `on_escalate(task, staff_id)`.
+
+    Staff are added with `add_staff`, or, with `staff_per_role`, seeded the first time
+    a task for a (hotel_id, role) without staff arrives: `staff_per_role` members named
+    "<role> #<n>" for each of `roles` (the Pilot sets its `staff_roles`).
+
+    Assignments and escalations are written to the task documents through the
+    scheduler's own WriteBatcher `writes`, so `db` must be a sync client. A task the
+    Pilot submits while processing a request only enters the scheduler once the
+    request's batch has committed its document; a failed or duplicate request leaves
+    no task holding a staff member, and nothing for `tick` to update.
+    """
+
+    def __init__(self, db, sla=None, capacity=1, writes=None, collection='tasks', on_escalate=None, clock=time.time,
+                 roles=None, staff_per_role=0):
+        self.db = db
+        self.sla = {**DEFAULT_SLA, **(sla or {})}
+        self.capacity = capacity
+        self.writes = writes or WriteBatcher(db)
+        self.roles = roles
+        self.staff_per_role = staff_per_role
+        self.collection = collection
+        self.on_escalate = on_escalate
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._open = {}
+        # (hotel_id, role) -> heap of (level, deadline, seq, task_id) for waiting tasks.
+        self._waiting = {}
+        self._depth = {}
+        # (hotel_id, role) -> heap of (tasks held, seq, staff_id) for staff with spare capacity.
+        self._available = {}
+        self._held = {}
+        # Heap of (deadline, seq, task_id) over all open tasks.
+        self._deadlines = []
+        self._assignment_seconds = deque(maxlen=10000)
+        self.assigned = 0
+        self.completed = 0
+        self.escalated = 0
+
+    # --- Staff ---
+
+    def add_staff(self, hotel_id, role, staff_id, capacity=None):
+        """Makes a staff member available for tasks of `role` at `hotel_id` and assigns waiting tasks."""
+        key = (hotel_id, role)
+        writes = self._begin()
+        with self._lock:
+            self._held.setdefault(key, {}).setdefault(staff_id, [0, capacity or self.capacity])
+            self._offer(key, staff_id)
+            self._assign(key, self._clock(), writes)
+        writes.commit()
+
+    def _seed(self, key):
+        # Called with the lock held, for a (hotel_id, role) that has never had staff.
+        role = key[1]
+        if self.staff_per_role and (self.roles is None or role in self.roles):
+            staff = self._held[key] = {}
+            for n in range(1, self.staff_per_role + 1):
+                staff[f'{role} #{n}'] = [0, self.capacity]
+                self._offer(key, f'{role} #{n}')
+            logger.debug("staff seeded hotel_id=%s role=%s staff=%d", key[0], role, self.staff_per_role)
+
+    def remove_staff(self, hotel_id, role, staff_id):
+        """Stops assigning tasks to a staff member; tasks they hold stay assigned until completed."""
+        with self._lock:
+            self._held.get((hotel_id, role), {}).pop(staff_id, None)
+
+    def _offer(self, key, staff_id):
+        held, capacity = self._held[key][staff_id]
+        if held < capacity:
+            heapq.heappush(self._available.setdefault(key, []), (held, next(self._seq), staff_id))
+
+    def _next_staff(self, key):
+        available = self._available.get(key)
+        while available:
+            held, _, staff_id = heapq.heappop(available)
+            state = self._held[key].get(staff_id)
+            # Entries are not removed when staff leave or take tasks; skip stale ones.
+            if state is not None and state[0] == held and held < state[1]:
+                return staff_id
+        return None
+
+    # --- Tasks ---
+
+    def submit(self, task, now=None, writes=None):
+        """
+        Queues a StaffTask (with `id` and `hotel_id` set) and assigns it if someone is
+        free, committing the assignment. Given `writes` (the RequestBatch creating the
+        task's document), this happens once that batch has committed, with the task's
+        deadline still counted from `now`.
+        """
+        now = now or self._clock()
+        if writes is not None:
+            writes.after_commit(lambda: self._submit_committed(task, now))
+            return
+        level = _LEVELS.index(task.priority) if task.priority in _LEVELS else len(_LEVELS) - 1
+        key = (task.hotel_id, task.role)
+        batch = self._begin()
+        with self._lock:
+            dispatch = _Dispatch(task, level, now + self.sla[_LEVELS[level]], next(self._seq), now)
+            self._open[task.id] = dispatch
+            self._enqueue(key, dispatch)
+            heapq.heappush(self._deadlines, (dispatch.deadline, dispatch.seq, task.id))
+            if key not in self._held:
+                self._seed(key)
+            self._assign(key, now, batch)
+        batch.commit()
+
+    def _submit_committed(self, task, now):
+        # Runs after the request's writes are committed, so a failure here must not fail the request.
+        try:
+            self.submit(task, now)
+        except Exception as e:
+            logger.error("task assignment not written task_id=%s error=%s", task.id, e)
+
+    def _enqueue(self, key, dispatch):
+        heapq.heappush(self._waiting.setdefault(key, []), (dispatch.level, dispatch.deadline, dispatch.seq, dispatch.task.id))
+        self._depth[key] = self._depth.get(key, 0) + 1
+
+    def _assign(self, key, now, writes):
+        waiting = self._waiting.get(key)
+        while waiting and self._depth[key]:
+            staff_id = self._next_staff(key)
+            if staff_id is None:
+                return
+            while True:
+                _, _, seq, task_id = heapq.heappop(waiting)
+                dispatch = self._open.get(task_id)
+                if dispatch is not None and dispatch.seq == seq and dispatch.staff_id is None:
+                    break
+            self._depth[key] -= 1
+            state = self._held[key][staff_id]
+            state[0] += 1
+            self._offer(key, staff_id)
+            dispatch.staff_id = staff_id
+            dispatch.assigned_at = now
+            dispatch.task.status = TaskStatus.CLAIMED
+            dispatch.task.assigned_to = staff_id
+            self.assigned += 1
+            self._assignment_seconds.append(now - dispatch.submitted_at)
+            self._write(writes, task_id, {'status': TaskStatus.CLAIMED.value, 'assigned_to': staff_id, 'assigned_at': SERVER_TIMESTAMP})
+            logger.debug("task assigned task_id=%s staff_id=%s wait=%.1fs", task_id, staff_id, now - dispatch.submitted_at)
+
+    def complete(self, task_id, now=None):
+        """Marks a task done, frees its staff member and assigns them the next task; returns False if unknown."""
+        now = now or self._clock()
+        writes = self._begin()
+        with self._lock:
+            dispatch = self._open.pop(task_id, None)
+            if dispatch is None:
+                return False
+            key = (dispatch.task.hotel_id, dispatch.task.role)
+            if dispatch.staff_id is None:
+                self._depth[key] -= 1
+            else:
+                state = self._held.get(key, {}).get(dispatch.staff_id)
+                if state is not None:
+                    state[0] -= 1
+                    self._offer(key, dispatch.staff_id)
+            dispatch.task.status = TaskStatus.COMPLETED
+            self.completed += 1
+            self._write(writes, task_id, {'status': TaskStatus.COMPLETED.value, 'completed_at': SERVER_TIMESTAMP})
+            self._assign(key, now, writes)
+        writes.commit()
+        return True
+
+    # --- Escalation ---
+
+    def tick(self, now=None):
+        """Escalates tasks past their deadline; returns how many were escalated."""
+        now = now or self._clock()
+        overdue = []
+        writes = self._begin()
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, seq, task_id = heapq.heappop(self._deadlines)
+                dispatch = self._open.get(task_id)
+                if dispatch is None or dispatch.seq != seq:
+                    continue
+                dispatch.escalations += 1
+                self.escalated += 1
+                overdue.append((dispatch.task, dispatch.staff_id))
+                if dispatch.staff_id is not None:
+                    # Already with someone; reported once.
+                    self._write(writes, task_id, {'overdue': True})
+                    continue
+                key = (dispatch.task.hotel_id, dispatch.task.role)
+                dispatch.level = max(dispatch.level - 1, 0)
+                dispatch.task.priority = _LEVELS[dispatch.level]
+                dispatch.deadline = now + self.sla[_LEVELS[dispatch.level]]
+                dispatch.seq = next(self._seq)
+                # The old heap entry goes stale with the seq change; depth counts the task once.
+                self._depth[key] -= 1
+                self._enqueue(key, dispatch)
+                heapq.heappush(self._deadlines, (dispatch.deadline, dispatch.seq, task_id))
+                self._write(writes, task_id, {'priority': _LEVELS[dispatch.level].value, 'escalations': dispatch.escalations})
+            self._compact()
+        writes.commit()
+        if overdue:
+            logger.warning("tasks past their SLA deadline count=%d", len(overdue))
+        for task, staff_id in overdue:
+            logger.debug("task overdue task_id=%s hotel_id=%s role=%s staff_id=%s", task.id, task.hotel_id, task.role, staff_id)
+            if self.on_escalate is not None:
+                self.on_escalate(task, staff_id)
+        return len(overdue)
+
+    def _is_current(self, task_id, seq):
+        dispatch = self._open.get(task_id)
+        return dispatch is not None and dispatch.seq == seq
+
+    def _compact(self):
+        # Rebuild heaps that are mostly stale entries, so they stay O(open tasks).
+        for key, waiting in self._waiting.items():
+            if len(waiting) > 64 and len(waiting) > 2 * self._depth[key]:
+                waiting[:] = [entry for entry in waiting if self._is_current(entry[3], entry[2]) and self._open[entry[3]].staff_id is None]
+                heapq.heapify(waiting)
+        if len(self._deadlines) > 64 and len(self._deadlines) > 2 * len(self._open):
+            self._deadlines[:] = [entry for entry in self._deadlines if self._is_current(entry[2], entry[1])]
+            heapq.heapify(self._deadlines)
+
+    def start(self, interval=30):
+        """Calls `tick` every `interval` seconds from a background thread; returns an Event that stops it."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.tick()
+                except Exception:
+                    logger.exception("error escalating overdue tasks")
+
+        threading.Thread(target=run, name='dispatch-scheduler', daemon=True).start()
+        return stop
+
+    # --- Storage ---
+
+    def _begin(self):
+        return self.writes.begin()
+
+    def _write(self, writes, task_id, updates):
+        writes.update(self.db.collection(self.collection).document(task_id), updates)
+
+    # --- Reporting ---
+
+    def stats(self):
+        """Returns waiting tasks per (hotel_id, role), counters and time-to-assignment percentiles (seconds)."""
+        with self._lock:
+            waits = sorted(self._assignment_seconds)
+            depth = {key: count for key, count in self._depth.items() if count}
+        percentile = lambda pct: waits[min(len(waits) - 1, int(pct / 100 * len(waits)))] if waits else 0.0
+        return {
+            'queue_depth': depth,
+            'open': len(self._open),
+            'assigned': self.assigned,
+            'completed': self.completed,
+            'escalated': self.escalated,
+            'time_to_assignment_p50': percentile(50),
+            'time_to_assignment_p95': percentile(95)
+        }
+
+    def collect_metrics(self):
+        """Metrics for PilotMetrics.add_collector."""
+        stats = self.stats()
+        return {
+            'pilot_dispatch_waiting_tasks': ('gauge', 'Tasks waiting for staff.', sum(stats['queue_depth'].values())),
+            'pilot_dispatch_assigned_total': ('counter', 'Tasks assigned to staff.', stats['assigned']),
+            'pilot_dispatch_escalated_total': ('counter', 'Tasks escalated past their SLA deadline.', stats['escalated']),
+            'pilot_dispatch_time_to_assignment_p95_seconds': ('gauge', 'p95 wait from submission to assignment (last 10000 tasks).',
+                                                              stats['time_to_assignment_p95'])
+        }
@@ -1,22 +1,17 @@
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-import json
 import os
 import logging
 
-# Enable detailed logging for the Firebase Admin SDK
-logging.basicConfig(level=logging.DEBUG)
+from backend.storage import firestore_client
+
 
 def initialize_firebase():
     """Initializes the Firebase Admin SDK using the downloaded credentials."""
     try:
         # Load credentials from the JSON file
         cred_path = os.path.join(os.path.dirname(__file__), 'eco-pilot-realtime-firebase-adminsdk.json')
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
+        client = firestore_client(cred_path)
         print("Firebase Admin SDK initialized successfully.")
-        return firestore.client()
+        return client
     except Exception as e:
         print(f"Error initializing Firebase: {e}")
         return None
@@ -47,6 +42,8 @@ def get_data(db, collection_name, document_id):
         return None
 
 if __name__ == '__main__':
+    # Enable detailed logging for the Firebase Admin SDK
+    logging.basicConfig(level=logging.DEBUG)
     db = initialize_firebase()
     if db:
         # Example Usage: Save some sample data
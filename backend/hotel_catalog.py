@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class HotelCatalog:
+    """
+    Hotel lookup table kept current with the Firestore 'hotels' collection.
+
+    Hotels are loaded on the first lookup, from `snapshot_path` when that file exists
+    and otherwise from Firestore. After that a Firestore `on_snapshot` listener (or,
+    when listening is unavailable, a thread polling every `poll_interval` seconds)
+    applies added, modified and removed hotels as diffs. Every change swaps in a new
+    dict, so lookups are plain O(1) dict reads and never take a lock, and is then
+    passed to the listeners registered with `add_listener`. With
+    `hotel_filter` set, only the hotels it accepts are kept (e.g. a shard's slice).
+    """
+
+    def __init__(self, db, collection='hotels', snapshot_path=None, live=True, poll_interval=300, load_timeout=30, hotel_filter=None):
+        self.db = db
+        self.hotel_filter = hotel_filter
+        self.collection = collection
+        self.snapshot_path = snapshot_path
+        self.live = live
+        self.poll_interval = poll_interval
+        self.load_timeout = load_timeout
+        self._hotels = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._watch = None
+        self._poller = None
+        self._listeners = []
+
+    # --- Lookups (lock-free) ---
+
+    def _current(self):
+        hotels = self._hotels
+        if hotels is None:
+            self.load()
+            hotels = self._hotels
+        return hotels
+
+    def get(self, hotel_id, default=None):
+        """Returns the hotel document for `hotel_id`, or `default`."""
+        return self._current().get(hotel_id, default)
+
+    def __getitem__(self, hotel_id):
+        return self._current()[hotel_id]
+
+    def __contains__(self, hotel_id):
+        return hotel_id in self._current()
+
+    def __len__(self):
+        return len(self._current())
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def items(self):
+        return self._current().items()
+
+    @property
+    def loaded(self):
+        return self._hotels is not None
+
+    # --- Loading and synchronization ---
+
+    def load(self):
+        """Loads the catalog if it has not been loaded yet, then starts keeping it current."""
+        with self._load_lock:
+            if self._hotels is not None:
+                return
+            hotels = self._read_snapshot()
+            if hotels is not None and self.hotel_filter is not None:
+                hotels = {hotel_id: hotel for hotel_id, hotel in hotels.items() if self.hotel_filter(hotel_id)}
+            if hotels is not None:
+                # Serve the on-disk copy right away; the listener catches up in the background.
+                self._hotels = hotels
+                logger.info("loaded hotels from snapshot count=%d path=%s", len(hotels), self.snapshot_path)
+                if self.live:
+                    self._start_listener()
+            else:
+                if not (self.live and self._start_listener() and self._synced.wait(self.load_timeout)):
+                    self.refresh()
+                self._save_snapshot()
+            if self.live and self._watch is None:
+                self._start_poller()
+
+    def preload(self):
+        """Starts loading the catalog in a background thread; lookups made meanwhile wait for it to finish."""
+        if self._hotels is not None:
+            return
+
+        def run():
+            try:
+                self.load()
+            except Exception:
+                logger.exception("error preloading hotels")
+
+        threading.Thread(target=run, name='hotel-catalog-preload', daemon=True).start()
+
+    def refresh(self):
+        """Re-reads the whole collection and applies the differences to the catalog."""
+        try:
+            latest = {doc.id: doc.to_dict() for doc in self.db.collection(self.collection).stream()
+                      if self.hotel_filter is None or self.hotel_filter(doc.id)}
+        except Exception as e:
+            logger.error("error fetching hotel data: %s", e)
+            if self._hotels is None:
+                self._hotels = {}
+            return
+        current = self._hotels or {}
+        upserts = {hotel_id: data for hotel_id, data in latest.items() if current.get(hotel_id) != data}
+        removed = [hotel_id for hotel_id in current if hotel_id not in latest]
+        self.apply_diff(upserts, removed)
+
+    def apply_diff(self, upserts=None, removed=()):
+        """Adds or replaces the hotels in `upserts` and drops the IDs in `removed`."""
+        if upserts and self.hotel_filter is not None:
+            upserts = {hotel_id: hotel for hotel_id, hotel in upserts.items() if self.hotel_filter(hotel_id)}
+        with self._lock:
+            hotels = dict(self._hotels or {})
+            hotels.update(upserts or {})
+            for hotel_id in removed:
+                hotels.pop(hotel_id, None)
+            self._hotels = hotels
+        self._synced.set()
+        for listener in self._listeners:
+            listener(upserts or {}, removed)
+
+    def add_listener(self, listener):
+        """Calls `listener(upserts, removed)` after every change applied to the catalog."""
+        self._listeners.append(listener)
+
+    def set_filter(self, hotel_filter):
+        """Replaces `hotel_filter`; a loaded catalog is re-read to drop and add hotels accordingly."""
+        self.hotel_filter = hotel_filter
+        if self._hotels is not None:
+            self.refresh()
+
+    def _start_listener(self):
+        collection = self.db.collection(self.collection)
+        if not hasattr(collection, 'on_snapshot'):
+            # Local storage backends have no listeners; poll them instead.
+            return False
+        try:
+            self._watch = collection.on_snapshot(self._on_snapshot)
+            return True
+        except Exception as e:
+            logger.warning("hotel listener unavailable, falling back to polling: %s", e)
+            self._watch = None
+            return False
+
+    def _on_snapshot(self, docs, changes, read_time):
+        if not self._synced.is_set():
+            # The first callback carries the full collection; reconcile it with the snapshot file.
+            latest = {doc.id: doc.to_dict() for doc in docs}
+            current = self._hotels or {}
+            self.apply_diff(latest, [hotel_id for hotel_id in current if hotel_id not in latest])
+            self._save_snapshot()
+            return
+        upserts, removed = {}, []
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                removed.append(change.document.id)
+            else:
+                upserts[change.document.id] = change.document.to_dict()
+        self.apply_diff(upserts, removed)
+
+    def _start_poller(self):
+        if self._poller is None and self.poll_interval:
+            self._poller = threading.Thread(target=self._poll, name='hotel-catalog-poller', daemon=True)
+            self._poller.start()
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            self.refresh()
+
+    def close(self):
+        """Stops live updates and writes the current catalog to the snapshot file."""
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self._save_snapshot()
+
+    # --- On-disk snapshot ---
+
+    def _read_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("ignoring unreadable hotel snapshot path=%s: %s", self.snapshot_path, e)
+            return None
+        if isinstance(data, dict):
+            return data
+        # Same list form as data/hotels_data.json and backend/hotels_data.json.
+        return {hotel.get('hotel_id') or hotel.get('id'): hotel for hotel in data if hotel.get('hotel_id') or hotel.get('id')}
+
+    def _save_snapshot(self):
+        if not self.snapshot_path or self._hotels is None:
+            return
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._hotels, f, default=str)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.error("error writing hotel snapshot path=%s: %s", self.snapshot_path, e)
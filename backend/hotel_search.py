@@ -0,0 +1,274 @@
+"""
+Hotel discovery over the hotel catalog, e.g. "eco-friendly hotels in Tokyo with a
+spa and a pool rated 4.2 or better".
+
+Every hotel gets a slot number, and every searchable term gets a bitmap of the
+slots of the hotels that have it, held as a Python int: one per location (the full
+"Tokyo, Japan" and each of its parts), amenity, class and management style (the
+full "Eco-Friendly & Sustainable" and each of its parts). Ratings are indexed to one
+decimal place, as the catalog stores them, with a bitmap per rating. A query ANDs
+a handful of bitmaps, one C-level pass over a bit per hotel each. Top-k ranking
+sorts small matches outright and otherwise walks the rating bitmaps from the best
+rating down, stopping once k hotels are found, so latency stays in the tens of
+microseconds as the catalog grows.
+"""
+import bisect
+import math
+import threading
+
+RATING_SCALE = 10
+# Matches with at most this many hotels are ranked by sorting them all instead of walking the ratings.
+SORT_THRESHOLD = 256
+
+
+def _terms(hotel):
+    """Returns the (facet, term) keys a hotel is indexed under."""
+    terms = set()
+    location = hotel.get('location')
+    if isinstance(location, str) and location.strip():
+        terms.add(('location', location.strip().casefold()))
+        terms.update(('location', part.strip().casefold()) for part in location.split(',') if part.strip())
+    for amenity in hotel.get('amenities') or ():
+        if isinstance(amenity, str):
+            terms.add(('amenity', amenity.strip().casefold()))
+    if hotel.get('class'):
+        terms.add(('class', str(hotel['class']).casefold()))
+    style = hotel.get('management_system')
+    if isinstance(style, str) and style.strip():
+        terms.add(('style', style.strip().casefold()))
+        terms.update(('style', part.strip().casefold()) for part in style.replace('&', ',').split(',') if part.strip())
+    return terms
+
+
+def _rating_key(value):
+    """Returns a rating in tenths, or None for hotels without one."""
+    try:
+        return round(float(value) * RATING_SCALE)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _slots(bitmap, limit=None):
+    """Returns the slot numbers set in `bitmap` in ascending order, at most `limit` of them."""
+    import numpy as np
+    data = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    nonzero = np.flatnonzero(data)
+    if limit is not None:
+        # A nonzero byte holds at least one slot.
+        nonzero = nonzero[:limit]
+    bits = np.unpackbits(data[nonzero], bitorder='little').reshape(-1, 8).astype(bool)
+    slots = ((nonzero[:, None] << 3) + np.arange(8))[bits].tolist()
+    return slots if limit is None else slots[:limit]
+
+
+class HotelSearch:
+    """
+    Inverted index over a HotelCatalog (or over hotels given to `apply_diff`).
+
+    The index is built on the first query, then kept current by the catalog's change
+    listener: added, modified and removed hotels update only their own bits. Queries
+    and updates take a lock, so the index is consistent for every query.
+    """
+
+    def __init__(self, catalog=None):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._built = False
+        self._slots = {}
+        # Per slot: hotel ID, hotel document, indexed terms and rating in tenths.
+        self._hotel_ids = []
+        self._hotels = []
+        self._indexed = []
+        self._rating_keys = []
+        self._free = []
+        self._bitmaps = {}
+        # Rating in tenths -> bitmap of the hotels with that rating, and the ratings in use, sorted.
+        self._by_rating = {}
+        self._ratings = []
+        self._unrated = 0
+        self._all = 0
+
+    # --- Queries ---
+
+    def search(self, location=None, amenities=(), hotel_class=None, style=None, min_rating=None, max_rating=None, limit=10):
+        """
+        Returns up to `limit` (hotel_id, hotel) pairs matching every given filter, best
+        rated first (equal ratings in catalog order); hotels without a rating come last.
+        Text filters are case-insensitive and `amenities` must all be present.
+        """
+        self.load()
+        with self._lock:
+            mask = self._match(location, amenities, hotel_class, style, min_rating, max_rating)
+            slots = self._top(mask, limit) if mask and limit > 0 else []
+            return [(self._hotel_ids[slot], self._hotels[slot]) for slot in slots]
+
+    def count(self, location=None, amenities=(), hotel_class=None, style=None, min_rating=None, max_rating=None):
+        """Returns the number of hotels matching every given filter."""
+        self.load()
+        with self._lock:
+            return self._match(location, amenities, hotel_class, style, min_rating, max_rating).bit_count()
+
+    def _match(self, location, amenities, hotel_class, style, min_rating, max_rating):
+        terms = [('amenity', amenity) for amenity in amenities]
+        for facet, value in (('location', location), ('class', hotel_class), ('style', style)):
+            if value is not None:
+                terms.append((facet, value))
+        bitmaps = [self._bitmaps.get((facet, str(value).strip().casefold()), 0) for facet, value in terms]
+        if min_rating is not None or max_rating is not None:
+            # Ratings are in tenths, so a range over them holds a few dozen bitmaps at most.
+            low = 0 if min_rating is None else bisect.bisect_left(self._ratings, math.ceil(round(min_rating * RATING_SCALE, 6)))
+            high = len(self._ratings) if max_rating is None else bisect.bisect_right(self._ratings, math.floor(round(max_rating * RATING_SCALE, 6)))
+            rated = 0
+            for rating in self._ratings[low:high]:
+                rated |= self._by_rating[rating]
+            bitmaps.append(rated)
+        mask = self._all
+        for bitmap in bitmaps:
+            mask &= bitmap
+            if not mask:
+                break
+        return mask
+
+    def _top(self, mask, limit):
+        if mask.bit_count() <= SORT_THRESHOLD:
+            rating_keys = self._rating_keys
+            return sorted(_slots(mask), key=lambda slot: (rating_keys[slot] is None, -(rating_keys[slot] or 0), slot))[:limit]
+        slots = []
+        for rating in reversed(self._ratings):
+            hits = mask & self._by_rating[rating]
+            if hits:
+                slots.extend(_slots(hits, limit - len(slots)))
+                if len(slots) >= limit:
+                    return slots
+        unrated = mask & self._unrated
+        if unrated:
+            slots.extend(_slots(unrated, limit - len(slots)))
+        return slots
+
+    # --- Index maintenance ---
+
+    def load(self):
+        """Builds the index from the catalog if it has not been built yet."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            if self.catalog is not None:
+                # Load the catalog first: its first load reports changes, and the listener would wait on the lock.
+                self.catalog.items()
+                self.catalog.add_listener(self._on_change)
+                with self._lock:
+                    # Changes swapped in before this read are in it; the listener applies the later ones.
+                    self._build(dict(self.catalog.items()))
+                    self._built = True
+            self._loaded = True
+
+    def _on_change(self, upserts, removed):
+        with self._lock:
+            if self._built:
+                self._apply(upserts, removed)
+
+    def apply_diff(self, upserts=None, removed=()):
+        """Indexes added or modified hotels ({hotel_id: hotel}) and drops removed hotel IDs."""
+        self.load()
+        with self._lock:
+            if not self._slots and not self._free:
+                self._build(upserts or {})
+            else:
+                self._apply(upserts or {}, removed)
+
+    def _build(self, hotels):
+        # Bitmaps are assembled in bytearrays, since setting bits one at a time in an int copies it each time.
+        size = (len(hotels) + 7) // 8
+        postings = {}
+        ratings = {}
+        for slot, (hotel_id, hotel) in enumerate(hotels.items()):
+            terms = _terms(hotel)
+            rating = _rating_key(hotel.get('rating'))
+            self._slots[hotel_id] = slot
+            self._hotel_ids.append(hotel_id)
+            self._hotels.append(hotel)
+            self._indexed.append(terms)
+            self._rating_keys.append(rating)
+            for term in terms:
+                postings.setdefault(term, []).append(slot)
+            ratings.setdefault(rating, []).append(slot)
+
+        def bitmap(slots):
+            data = bytearray(size)
+            for slot in slots:
+                data[slot >> 3] |= 1 << (slot & 7)
+            return int.from_bytes(data, 'little')
+
+        self._bitmaps = {term: bitmap(slots) for term, slots in postings.items()}
+        self._all = (1 << len(hotels)) - 1
+        self._unrated = bitmap(ratings.pop(None, ()))
+        self._by_rating = {rating: bitmap(slots) for rating, slots in ratings.items()}
+        self._ratings = sorted(self._by_rating)
+
+    def _apply(self, upserts, removed):
+        for hotel_id in removed:
+            slot = self._slots.pop(hotel_id, None)
+            if slot is not None:
+                self._unindex(slot)
+                self._hotel_ids[slot] = self._hotels[slot] = None
+                self._free.append(slot)
+        for hotel_id, hotel in upserts.items():
+            slot = self._slots.get(hotel_id)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot = len(self._hotel_ids)
+                    self._hotel_ids.append(None)
+                    self._hotels.append(None)
+                    self._indexed.append(set())
+                    self._rating_keys.append(None)
+                self._slots[hotel_id] = slot
+                self._hotel_ids[slot] = hotel_id
+            else:
+                self._unindex(slot)
+            self._hotels[slot] = hotel
+            self._index(slot, _terms(hotel), _rating_key(hotel.get('rating')))
+
+    def _index(self, slot, terms, rating):
+        bit = 1 << slot
+        for term in terms:
+            self._bitmaps[term] = self._bitmaps.get(term, 0) | bit
+        self._indexed[slot] = terms
+        self._rating_keys[slot] = rating
+        if rating is None:
+            self._unrated |= bit
+        else:
+            if rating not in self._by_rating:
+                bisect.insort(self._ratings, rating)
+            self._by_rating[rating] = self._by_rating.get(rating, 0) | bit
+        self._all |= bit
+
+    def _unindex(self, slot):
+        clear = ~(1 << slot)
+        for term in self._indexed[slot]:
+            bitmap = self._bitmaps[term] & clear
+            if bitmap:
+                self._bitmaps[term] = bitmap
+            else:
+                del self._bitmaps[term]
+        self._indexed[slot] = set()
+        rating = self._rating_keys[slot]
+        if rating is None:
+            self._unrated &= clear
+        else:
+            bitmap = self._by_rating[rating] & clear
+            if bitmap:
+                self._by_rating[rating] = bitmap
+            else:
+                del self._by_rating[rating]
+                self._ratings.remove(rating)
+        self._all &= clear
+
+    def stats(self):
+        with self._lock:
+            return {'hotels': len(self._slots), 'terms': len(self._bitmaps), 'free_slots': len(self._free)}
@@ -0,0 +1,108 @@
+import datetime
+import hashlib
+import threading
+from collections import OrderedDict
+
+from backend.storage import SERVER_TIMESTAMP
+
+
+class IdempotencyIndex:
+    """
+    Remembers which idempotency keys have been processed, so repeated deliveries of a
+    request can be skipped.
+
+    Recently processed keys are held in an in-process LRU of up to `max_size` keys;
+    a key found there is a duplicate at the cost of a dict lookup. Every processed key
+    also gets a marker document in `collection`, written in the same batch as the
+    request's other writes. The marker is queued as a `create`, so if another process
+    (or this one before a restart) already processed the key, the whole batch is
+    rejected with AlreadyExists and none of the request's writes are applied twice.
+    Markers carry an `expires_at` timestamp `retention` seconds ahead, for use as a
+    Firestore TTL field.
+
+    A key is only remembered once the request's writes are committed. While they wait
+    in a write window, the key is held with `hold`, so another delivery in the same
+    window is a duplicate too.
+    """
+
+    def __init__(self, db, collection='processed_requests', max_size=100000, retention=7 * 24 * 3600):
+        if max_size <= 0:
+            raise ValueError(f"max_size must be positive, got {max_size}")
+        self.db = db
+        self.collection = collection
+        self.max_size = max_size
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+        self._held = set()
+        self.duplicates = 0
+
+    def marker(self, key):
+        """Returns the marker document for `key`; keys come from clients, so they are hashed into a valid ID."""
+        return self.db.collection(self.collection).document(hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest())
+
+    def seen(self, key):
+        """Returns True (and counts a duplicate) if `key` is among the recently processed keys."""
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            self.duplicates += 1
+            return True
+
+    def stored(self, key, snapshot=None):
+        """
+        Returns True (and counts a duplicate) if a marker for `key` exists in storage.
+        Costs one read, unless the marker's `snapshot` was already fetched.
+        """
+        if snapshot is None:
+            snapshot = self.marker(key).get()
+        if not snapshot.exists:
+            return False
+        self.remember(key, duplicate=True)
+        return True
+
+    def hold(self, key):
+        """
+        Holds `key` for a request whose writes wait in a window, until `remember`; returns
+        False (and counts a duplicate) if the key is already held or processed.
+        """
+        with self._lock:
+            if key in self._held or key in self._keys:
+                self.duplicates += 1
+                return False
+            self._held.add(key)
+            return True
+
+    def remember(self, key, duplicate=False):
+        """Adds `key` to the recently processed keys, evicting the oldest beyond `max_size`."""
+        with self._lock:
+            if duplicate:
+                self.duplicates += 1
+            self._held.discard(key)
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def queue_marker(self, writes, key, customer_id, hotel_id, exclusive=True):
+        """
+        Queues the marker for `key` on a WriteBatcher. With `exclusive`, the marker is a
+        create that fails the batch if the key was already processed; otherwise it is a
+        plain set.
+        """
+        data = {
+            'key': key,
+            'customer_id': customer_id,
+            'hotel_id': hotel_id,
+            'processed_at': SERVER_TIMESTAMP,
+            'expires_at': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.retention)
+        }
+        if exclusive:
+            writes.create(self.marker(key), data)
+        else:
+            writes.set(self.marker(key), data)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._keys), 'max_size': self.max_size, 'held': len(self._held), 'duplicates': self.duplicates}
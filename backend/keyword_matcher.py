@@ -0,0 +1,321 @@
+from collections import deque
+
+
+def _distinct(sorted_rows):
+    import numpy as np
+    if not len(sorted_rows):
+        return sorted_rows
+    return sorted_rows[np.concatenate(([True], sorted_rows[1:] != sorted_rows[:-1]))]
+
+
+# Bytes of a batch whose byte pair frequencies choose each keyword's lookup pair.
+_PAIR_SAMPLE = 1 << 20
+
+
+class KeywordMatches:
+    """Keyword hits for a single query, grouped by the tables they belong to."""
+
+    def __init__(self, hits, exact_hits):
+        # {table: [(group_rank, keyword_rank, label, keyword), ...]}
+        self._hits = hits
+        self._exact_hits = exact_hits
+
+    def _table(self, table, exact):
+        return (self._exact_hits if exact else self._hits).get(table, ())
+
+    def first(self, table, exact=False):
+        """Returns the label of the earliest group in `table` with a hit, or None."""
+        best = None
+        for hit in self._table(table, exact):
+            if best is None or hit[0] < best[0]:
+                best = hit
+        return best[2] if best else None
+
+    def has(self, table, label=None, exact=False):
+        """Returns True if any keyword of `table` (optionally of group `label`) was found."""
+        if label is None:
+            return bool(self._table(table, exact))
+        return any(hit[2] == label for hit in self._table(table, exact))
+
+    def keywords(self, table, exact=False):
+        """Returns the matched keywords of `table` in table order."""
+        return [hit[3] for hit in sorted(self._table(table, exact))]
+
+
+class KeywordMatrix:
+    """
+    Keyword hits for a batch of queries as a sparse query x keyword matrix.
+
+    The matrix is kept in coordinate form: `rows[i]` contains keyword `cols[i]`
+    (an index into `matcher.keywords`). Table lookups mirror KeywordMatches but
+    return one value per query as NumPy arrays.
+    """
+
+    def __init__(self, matcher, num_rows, rows, cols, exact_rows, exact_cols):
+        self.matcher = matcher
+        self.num_rows = num_rows
+        self.rows, self.cols = rows, cols
+        self.exact_rows, self.exact_cols = exact_rows, exact_cols
+
+    def _coords(self, exact):
+        return (self.exact_rows, self.exact_cols) if exact else (self.rows, self.cols)
+
+    def first(self, table, exact=False):
+        """Returns the rank of the earliest group in `table` with a hit per query, -1 where none matched."""
+        import numpy as np
+        rows, cols = self._coords(exact)
+        group_ranks = self.matcher._table_index(table)[0][cols]
+        in_table = group_ranks >= 0
+        best = np.full(self.num_rows, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(best, rows[in_table], group_ranks[in_table])
+        best[best == np.iinfo(np.int64).max] = -1
+        return best
+
+    def has(self, table, exact=False):
+        """Returns a boolean array marking the queries with a hit in `table`."""
+        import numpy as np
+        rows, cols = self._coords(exact)
+        found = np.zeros(self.num_rows, dtype=bool)
+        found[rows[self.matcher._table_index(table)[0][cols] >= 0]] = True
+        return found
+
+    def keywords(self, table, exact=False):
+        """Returns {row: [matched keywords of `table` in table order]} for the queries with a hit."""
+        import numpy as np
+        rows, cols = self._coords(exact)
+        _, entry_starts, entry_counts, entry_order, entry_keywords = self.matcher._table_index(table)
+        # One hit per (query, table entry); a keyword can sit in several groups of a table.
+        counts = entry_counts[cols]
+        hits = np.repeat(np.arange(len(cols)), counts)
+        entries = np.repeat(entry_starts[cols], counts) + np.arange(len(hits)) - np.repeat(np.cumsum(counts) - counts, counts)
+        hit_rows = rows[hits]
+        order = np.lexsort((entry_order[entries], hit_rows))
+        hit_rows, keywords = hit_rows[order], [entry_keywords[entry] for entry in entries[order].tolist()]
+        if not keywords:
+            return {}
+        row_starts = np.flatnonzero(np.concatenate(([True], hit_rows[1:] != hit_rows[:-1]))).tolist()
+        row_ends = row_starts[1:] + [len(keywords)]
+        return {row: keywords[start:end] for row, start, end in zip(hit_rows[row_starts].tolist(), row_starts, row_ends)}
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over ordered keyword tables.
+
+    A table is a list of (label, keywords) groups. One scan of the lowercased query
+    finds every keyword of every table, including overlapping ones, so the order in
+    which groups are declared is what decides "first match" and not the scan itself.
+    """
+
+    def __init__(self, tables):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._tags = {}
+        for table, groups in tables.items():
+            for group_rank, (label, keywords) in enumerate(groups):
+                for keyword_rank, keyword in enumerate(keywords):
+                    keyword = keyword.lower()
+                    if keyword not in self._tags:
+                        self._tags[keyword] = []
+                        self._insert(keyword)
+                    self._tags[keyword].append((table, (group_rank, keyword_rank, label, keyword)))
+        self._build_failure_links()
+        self.keywords = list(self._tags)
+        self.tables = tables
+        self._table_indexes = {}
+        self._encoded = [keyword.encode('utf-8') for keyword in self.keywords]
+
+    def _insert(self, keyword):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(keyword)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def iter_matches(self, text):
+        """Yields (end_index, keyword) for every keyword occurrence in `text`."""
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for keyword in output[node]:
+                yield index, keyword
+
+    def iter_phrases(self, text):
+        """
+        Yields (table, label) for every keyword occurrence in `text` that is a whole word
+        or phrase, i.e. not directly preceded or followed by a letter or digit.
+        """
+        for end, keyword in self.iter_matches(text):
+            start = end - len(keyword) + 1
+            if (start and text[start - 1].isalnum()) or (end + 1 < len(text) and text[end + 1].isalnum()):
+                continue
+            for table, hit in self._tags[keyword]:
+                yield table, hit[2]
+
+    def scan(self, query):
+        """
+        Scans `query` once and returns its KeywordMatches.
+
+        Hits are recorded against the lowercased query, and separately against the
+        query as written for callers that need case-sensitive `keyword in query` checks.
+        """
+        lowered = query.lower()
+        # Lowercasing a few non-ASCII characters changes the string length, in which
+        # case positions no longer line up and the exact hits need their own pass.
+        aligned = len(lowered) == len(query)
+        found, exact_found = set(), set()
+        for end, keyword in self.iter_matches(lowered):
+            found.add(keyword)
+            if aligned and keyword not in exact_found and query[end - len(keyword) + 1:end + 1] == keyword:
+                exact_found.add(keyword)
+        if not aligned:
+            exact_found = {keyword for _, keyword in self.iter_matches(query)}
+        return KeywordMatches(self._group(found), self._group(exact_found))
+
+    def _group(self, keywords):
+        grouped = {}
+        for keyword in keywords:
+            for table, hit in self._tags[keyword]:
+                grouped.setdefault(table, []).append(hit)
+        return grouped
+
+    def labels(self, table):
+        """Returns the group labels of `table` in rank order."""
+        return [label for label, _ in self.tables[table]]
+
+    def _table_index(self, table):
+        """
+        Returns per-table arrays for KeywordMatrix, built once per table: each keyword's
+        best group rank (-1 outside the table), and the table's (keyword, hit) entries
+        grouped by keyword as start/count per keyword, table order and keyword text.
+        """
+        index = self._table_indexes.get(table)
+        if index is None:
+            import numpy as np
+            entries = [(col, hit) for col, keyword in enumerate(self.keywords)
+                       for name, hit in self._tags[keyword] if name == table]
+            table_order = {hit: rank for rank, hit in enumerate(sorted(hit for _, hit in entries))}
+            ranks = np.full(len(self.keywords), -1, dtype=np.int64)
+            counts = np.zeros(len(self.keywords), dtype=np.int64)
+            for col, hit in entries:
+                ranks[col] = hit[0] if ranks[col] < 0 else min(ranks[col], hit[0])
+                counts[col] += 1
+            index = self._table_indexes[table] = (
+                ranks,
+                np.cumsum(counts) - counts,
+                counts,
+                np.array([table_order[hit] for _, hit in entries], dtype=np.int64),
+                [hit[3] for _, hit in entries]
+            )
+        return index
+
+    def scan_batch(self, queries):
+        """
+        Returns the KeywordMatrix of a list of queries.
+
+        The lowercased queries are joined into one UTF-8 buffer and each keyword is
+        checked, with array comparisons rather than a per-character Python loop, only
+        at the positions of its rarest byte pair. Exact-case hits are the lowercase hits whose bytes
+        also match in the original queries; when lowercasing changed byte lengths
+        (non-ASCII text), changed queries are checked with `in` instead.
+        """
+        import numpy as np
+        # Keywords never contain NUL, so no match can span two queries.
+        original = '\0'.join(queries)
+        aligned = original.isascii()
+        if aligned:
+            # ASCII lowercasing keeps every length, so the whole buffer is lowercased at once.
+            joined = original.lower()
+            lengths = np.fromiter(map(len, queries), dtype=np.int64, count=len(queries)) + 1
+        else:
+            lowered = [query.lower() for query in queries]
+            joined = '\0'.join(lowered)
+            lengths = np.fromiter((len(query.encode('utf-8')) + 1 for query in lowered), dtype=np.int64, count=len(lowered))
+            changed = np.fromiter(map(str.__ne__, lowered, queries), dtype=bool, count=len(queries))
+        starts = np.cumsum(lengths) - lengths
+
+        encoded = self._encoded
+        longest = max((len(keyword) for keyword in encoded), default=1)
+        # Zero padding lets candidates near the end be compared without bounds checks.
+        text = np.frombuffer(joined.encode('utf-8') + bytes(longest), dtype=np.uint8)
+        if aligned:
+            original_text = np.frombuffer(original.encode('ascii') + bytes(longest), dtype=np.uint8)
+        pairs = (text[:-1].astype(np.uint16) << 8) | text[1:]
+        # Pair frequencies from the first MiB only pick the lookup pairs, which are a
+        # heuristic: a poor pick costs time, never matches.
+        sample_counts = np.bincount(pairs[:_PAIR_SAMPLE], minlength=1 << 16)
+
+        # Each keyword is looked up by its rarest byte pair; only those pairs get indexed.
+        lookups = []
+        for keyword_bytes in encoded:
+            if len(keyword_bytes) == 1:
+                lookups.append((None, 0))
+                continue
+            codes = [(keyword_bytes[i] << 8) | keyword_bytes[i + 1] for i in range(len(keyword_bytes) - 1)]
+            offset = min(range(len(codes)), key=lambda i: sample_counts[codes[i]])
+            lookups.append((codes[offset], offset))
+        wanted = np.array(sorted({code for code, _ in lookups if code is not None}), dtype=np.uint16)
+        is_wanted = np.zeros(1 << 16, dtype=bool)
+        is_wanted[wanted] = True
+        candidates = np.flatnonzero(is_wanted[pairs])
+        candidate_pairs = pairs[candidates]
+        candidates = candidates[np.argsort(candidate_pairs, kind='stable')]
+        pair_counts = np.bincount(candidate_pairs, minlength=1 << 16)
+        pair_starts = np.zeros(1 << 16, dtype=np.int64)
+        pair_starts[wanted] = np.cumsum(pair_counts[wanted]) - pair_counts[wanted]
+
+        rows, cols, exact_rows, exact_cols = [], [], [], []
+        for col, (keyword, keyword_bytes, (code, offset)) in enumerate(zip(self.keywords, encoded, lookups)):
+            if code is None:
+                positions = np.flatnonzero(text[:-longest] == keyword_bytes[0])
+            else:
+                start = pair_starts[code]
+                positions = candidates[start:start + pair_counts[code]] - offset
+                positions = positions[positions >= 0]
+                for i, byte in enumerate(keyword_bytes):
+                    if i != offset and i != offset + 1 and len(positions):
+                        positions = positions[text[positions + i] == byte]
+            if not len(positions):
+                continue
+            all_rows = np.searchsorted(starts, positions, side='right') - 1
+            hit_rows = _distinct(all_rows)
+            rows.append(hit_rows)
+            cols.append(np.full(len(hit_rows), col, dtype=np.int64))
+            if aligned:
+                same = np.ones(len(positions), dtype=bool)
+                for i, byte in enumerate(keyword_bytes):
+                    same &= original_text[positions + i] == byte
+                exact = _distinct(all_rows[same])
+            else:
+                recheck = changed[hit_rows]
+                exact = hit_rows[~recheck]
+                if recheck.any():
+                    exact = np.sort(np.concatenate((exact, [row for row in hit_rows[recheck].tolist() if keyword in queries[row]])).astype(np.int64))
+            exact_rows.append(exact)
+            exact_cols.append(np.full(len(exact), col, dtype=np.int64))
+
+        def stack(parts):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        return KeywordMatrix(self, len(queries), stack(rows), stack(cols), stack(exact_rows), stack(exact_cols))
@@ -0,0 +1,222 @@
+"""
+Per-stage timing and storage counters for the pilot, exported in Prometheus text format.
+
+Only one request in every `1 / sample_rate` is timed; the others get a no-op timer,
+so instrumentation costs a counter increment per request plus a few no-op calls.
+Request and storage operation counters are exact. With debug logging on, each request
+also gets a RequestLog counting its own reads and writes, logged when it finishes.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+STAGES = ('profile_fetch', 'triage', 'intent', 'task_generation', 'rewards', 'personalization', 'task_publish')
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class RequestTimer:
+    """Lap timer for one sampled request: each mark() records the time since the previous one."""
+    __slots__ = ('started', 'stages', '_last')
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+# The RequestLog of the request being processed in this thread or asyncio task.
+_current_request = contextvars.ContextVar('pilot_request_log', default=None)
+
+
+class RequestLog:
+    """
+    Latency, reads and writes of one request, for a structured log entry. It is the
+    current request of its thread or asyncio task until `close`, so `PilotMetrics.count`
+    adds the reads and writes made meanwhile to it.
+    """
+    __slots__ = ('request_id', 'customer_id', 'started', 'reads', 'writes', '_token')
+
+    def __init__(self, request_id, customer_id):
+        self.request_id = request_id
+        self.customer_id = customer_id
+        self.started = time.perf_counter()
+        self.reads = 0
+        self.writes = 0
+        self._token = _current_request.set(self)
+
+    def close(self, logger, outcome):
+        """Logs the request at debug level, with its fields in the record's `extra` for JsonFormatter."""
+        _current_request.reset(self._token)
+        latency = time.perf_counter() - self.started
+        logger.debug("request finished request_id=%s customer_id=%s outcome=%s latency=%.6f reads=%d writes=%d",
+                     self.request_id, self.customer_id, outcome, latency, self.reads, self.writes,
+                     extra={'request_id': self.request_id, 'customer_id': self.customer_id, 'outcome': outcome,
+                            'latency': latency, 'reads': self.reads, 'writes': self.writes})
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class PilotMetrics:
+    """Collects stage latencies, request counts and storage operation counts for a Pilot."""
+
+    def __init__(self, sample_rate=0.01):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, got {sample_rate}")
+        self.sample_rate = sample_rate
+        self._sample_every = round(1 / sample_rate) if sample_rate else 0
+        self._lock = threading.Lock()
+        # Counters are bumped by every request; a lock of their own keeps them off the histogram lock.
+        self._counter_lock = threading.Lock()
+        self._histograms = {stage: _Histogram() for stage in STAGES + ('total',)}
+        self._collectors = []
+        self.requests = 0
+        self.sampled_requests = 0
+        self.failed_requests = 0
+        self.reads = 0
+        self.writes = 0
+
+    def start_request(self):
+        """Counts a request and returns a RequestTimer if it is sampled, otherwise a no-op timer."""
+        with self._counter_lock:
+            self.requests += 1
+            sampled = self._sample_every and self.requests % self._sample_every == 0
+        return RequestTimer() if sampled else NULL_TIMER
+
+    def count(self, counter, amount=1):
+        """
+        Adds `amount` to one of the counters ('failed_requests', 'reads' or 'writes'); safe
+        across threads. Reads and writes also count towards the current RequestLog.
+        """
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+        if counter != 'failed_requests':
+            request_log = _current_request.get()
+            if request_log is not None:
+                setattr(request_log, counter, getattr(request_log, counter) + amount)
+
+    def finish_request(self, timer):
+        """Records the stage timings of a sampled request."""
+        if timer is NULL_TIMER:
+            return
+        total = time.perf_counter() - timer.started
+        with self._lock:
+            self.sampled_requests += 1
+            for stage, seconds in timer.stages.items():
+                histogram = self._histograms.get(stage)
+                if histogram is None:
+                    histogram = self._histograms[stage] = _Histogram()
+                histogram.observe(seconds)
+            self._histograms['total'].observe(total)
+
+    def add_collector(self, collect):
+        """Registers a callable returning {metric_name: (type, help, value)} to include in exports."""
+        self._collectors.append(collect)
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = [
+            '# HELP pilot_stage_seconds Time spent in each process_request stage (sampled requests).',
+            '# TYPE pilot_stage_seconds histogram'
+        ]
+        with self._lock:
+            for stage, histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'pilot_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'pilot_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'pilot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        metrics = {
+            'pilot_requests_total': ('counter', 'Requests passed to process_request.', self.requests),
+            'pilot_sampled_requests_total': ('counter', 'Requests whose stages were timed.', self.sampled_requests),
+            'pilot_failed_requests_total': ('counter', 'Requests rejected, e.g. for an unknown hotel.', self.failed_requests),
+            'pilot_storage_reads_total': ('counter', 'Document reads issued by the engine.', self.reads),
+            'pilot_storage_writes_total': ('counter', 'Document writes issued outside the write batcher.', self.writes)
+        }
+        for collect in self._collectors:
+            metrics.update(collect())
+        for name, (metric_type, help_text, value) in metrics.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically writes the Prometheus export to `path` (e.g. for node_exporter's textfile collector)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def start_file_sink(self, path, interval=15):
+        """Rewrites the textfile export every `interval` seconds from a background thread."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.write_textfile(path)
+                except OSError as e:
+                    logging.getLogger(__name__).warning("metrics export failed path=%s error=%s", path, e)
+
+        thread = threading.Thread(target=run, name='pilot-metrics-sink', daemon=True)
+        thread.start()
+        return stop
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line, including any `extra` fields."""
+
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self._RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=logging.INFO, json_format=False):
+    """Sets up root logging for the engine scripts, optionally as JSON lines."""
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
@@ -0,0 +1,215 @@
+"""
+Typed models for the objects that move through the engine.
+
+Guest requests, staff tasks and customer profiles are slotted dataclasses instead
+of dicts: an instance holds its fields in fixed slots rather than a per-object
+hash table, and defaults for fields missing from stored documents are filled in
+once, when the document is decoded. Roles, priorities, categories and intents are
+`StrEnum`s, so every object shares the same interned member, and members still
+compare equal to (and serialize as) their plain string values.
+"""
+from dataclasses import dataclass, field, fields
+from enum import StrEnum
+
+from backend.storage import ArrayUnion, Increment, SERVER_TIMESTAMP
+
+
+class Category(StrEnum):
+    SERVICE_REQUEST = 'service_request'
+    ECO_REQUEST = 'eco_request'
+    REVIEW = 'review'
+    MEDICAL_ALERT = 'medical_alert'
+    UNKNOWN = 'unknown'
+
+
+class Intent(StrEnum):
+    GENERAL_INQUIRY = 'general_inquiry'
+    TECH_SUPPORT = 'tech_support'
+    HOUSEKEEPING_REQUEST = 'housekeeping_request'
+    MAINTENANCE_ISSUE = 'maintenance_issue'
+    FOOD_ORDER = 'food_order'
+    REALTIME_SERVICE = 'realtime_service'
+    ECO_HOUSEKEEPING = 'eco_housekeeping'
+    ECO_TRANSPORT = 'eco_transport'
+    ECO_FOOD = 'eco_food'
+    ECO_DONATION = 'eco_donation'
+    DIABETIC_CARE = 'diabetic_care'
+    ASTHMA_CARE = 'asthma_care'
+
+
+class Role(StrEnum):
+    HOUSEKEEPING = 'Housekeeping'
+    FRONT_DESK = 'Front Desk'
+    MAINTENANCE = 'Maintenance'
+    CONCIERGE = 'Concierge'
+    IT_SUPPORT = 'IT Support'
+    MANAGER = 'Manager'
+    ACCOUNTANT = 'Accountant'
+    PROCUREMENT_OFFICE = 'Procurement Office'
+    KITCHEN_STAFF = 'Kitchen Staff'
+    CHEF = 'Chef'
+    GUIDE_CONCIERGE = 'Guide/Concierge'
+    OWNER_MANAGER = 'Owner/Manager'
+    PERSONAL_BUTLER = 'Personal Butler'
+    WELLNESS_COORDINATOR = 'Wellness Coordinator'
+
+
+class Priority(StrEnum):
+    CRITICAL = 'Critical'
+    HIGH = 'High'
+    MEDIUM = 'Medium'
+    LOW = 'Low'
+
+
+class TaskStatus(StrEnum):
+    PENDING = 'pending'
+    CLAIMED = 'claimed'
+    COMPLETED = 'completed'
+
+
+def _extra(data, known_fields):
+    """Returns the fields of `data` without a slot of their own, or None when there are none."""
+    if data.keys() <= known_fields:
+        return None
+    return {key: value for key, value in data.items() if key not in known_fields}
+
+
+def _member(enum, value):
+    """Returns the enum member for `value`, or `value` itself for values written by other clients."""
+    try:
+        return enum(value)
+    except ValueError:
+        return value
+
+
+@dataclass(slots=True)
+class GuestRequest:
+    """
+    A guest request as passed to `Pilot.process_request`; unknown fields are kept in
+    `extra`. Deliveries of a request with the same `idempotency_key` are processed once.
+    """
+    hotel_id: str = None
+    query: str = ''
+    type: str = None
+    duration_days: int = 1
+    idempotency_key: str = None
+    extra: dict = None
+
+    @classmethod
+    def from_dict(cls, data):
+        get = data.get
+        return cls(get('hotel_id'), get('query', ''), get('type'), get('duration_days', 1), get('idempotency_key'),
+                   _extra(data, _REQUEST_FIELDS))
+
+    def to_dict(self):
+        data = {'hotel_id': self.hotel_id, 'query': self.query, 'type': self.type, 'duration_days': self.duration_days}
+        if self.idempotency_key is not None:
+            data['idempotency_key'] = self.idempotency_key
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+@dataclass(slots=True)
+class StaffTask:
+    """
+    A task for the staff app; `extra` holds additional fields from the task rule.
+    `id` is the document ID once stored. Tasks without a `status` are pending.
+    """
+    role: Role
+    description: str
+    priority: Priority
+    hotel_id: str = None
+    timestamp: object = None
+    id: str = None
+    status: TaskStatus = None
+    assigned_to: str = None
+    extra: dict = None
+
+    def to_firestore(self, hotel_id=None):
+        """Returns the document for the 'tasks' collection, stamped with the server time."""
+        data = {'role': self.role, 'description': self.description, 'priority': self.priority}
+        if self.extra:
+            data.update(self.extra)
+        data['timestamp'] = SERVER_TIMESTAMP
+        data['hotel_id'] = hotel_id or self.hotel_id
+        if self.status is not None:
+            data['status'] = self.status
+        if self.assigned_to is not None:
+            data['assigned_to'] = self.assigned_to
+        return data
+
+    @classmethod
+    def from_firestore(cls, data, task_id=None):
+        get = data.get
+        return cls(_member(Role, get('role')), get('description', ''), _member(Priority, get('priority')), get('hotel_id'),
+                   get('timestamp'), task_id, _member(TaskStatus, get('status', TaskStatus.PENDING)), get('assigned_to'),
+                   _extra(data, _TASK_FIELDS))
+
+
+@dataclass(slots=True)
+class CustomerProfile:
+    """
+    A guest's profile document. `name`, `room_number` and `rewards` stay None until
+    set; fields the engine does not know about are kept in `extra`.
+    """
+    id: str
+    tokens: int = 0
+    negative_reviews_count: int = 0
+    positive_reviews_count: int = 0
+    is_diabetic: bool = False
+    is_asthmatic: bool = False
+    history: list = field(default_factory=list)
+    preferences: dict = field(default_factory=dict)
+    staff_feedback: dict = field(default_factory=dict)
+    name: str = None
+    room_number: object = None
+    rewards: list = None
+    extra: dict = None
+
+    @classmethod
+    def from_firestore(cls, data, customer_id=None):
+        """Decodes a stored profile, filling in fields missing from profiles written by older versions."""
+        get = data.get
+        return cls(get('id', customer_id), get('tokens', 0), get('negative_reviews_count', 0), get('positive_reviews_count', 0),
+                   get('is_diabetic', False), get('is_asthmatic', False), get('history', []), get('preferences', {}),
+                   get('staff_feedback', {}), get('name'), get('room_number'), get('rewards'), _extra(data, _PROFILE_FIELDS))
+
+    def to_firestore(self):
+        data = {'id': self.id, 'history': self.history, 'preferences': self.preferences, 'tokens': self.tokens,
+                'negative_reviews_count': self.negative_reviews_count, 'positive_reviews_count': self.positive_reviews_count,
+                'staff_feedback': self.staff_feedback, 'is_diabetic': self.is_diabetic, 'is_asthmatic': self.is_asthmatic}
+        for name in ('name', 'room_number', 'rewards'):
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def get(self, name, default=None):
+        """Returns a field by name, looking in `extra` for fields without a slot."""
+        if name in _PROFILE_FIELDS:
+            value = getattr(self, name)
+            return default if value is None else value
+        return self.extra.get(name, default) if self.extra else default
+
+    def apply_update(self, updates):
+        """Applies a Firestore update dict, including Increment/ArrayUnion transforms."""
+        for name, value in updates.items():
+            if isinstance(value, Increment):
+                value = self.get(name, 0) + value.value
+            elif isinstance(value, ArrayUnion):
+                current = self.get(name) or []
+                value = current + [item for item in value.values if item not in current]
+            if name in _PROFILE_FIELDS:
+                setattr(self, name, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+
+
+_REQUEST_FIELDS = frozenset(f.name for f in fields(GuestRequest)) - {'extra'}
+_TASK_FIELDS = frozenset(f.name for f in fields(StaffTask)) - {'extra', 'id'}
+_PROFILE_FIELDS = frozenset(f.name for f in fields(CustomerProfile)) - {'extra'}
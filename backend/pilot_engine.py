@@ -1,20 +1,62 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore import Client
-import json
-import re
-import time
-
-# Initialize Firebase (replace with your service account key file)
-cred = credentials.Certificate(r"C:\Users\user\OneDrive\Documents\Hackathon_project\Eco-Pilot-Platform\backend\eco-pilot-realtime-firebase-adminsdk.json")
-firebase_admin.initialize_app(cred)
-db: Client = firestore.client()
+import itertools
+import logging
+
+from backend.hotel_catalog import HotelCatalog
+from backend.idempotency import IdempotencyIndex
+from backend.keyword_matcher import KeywordMatcher
+from backend.metrics import PilotMetrics, RequestLog, configure_logging
+from backend.models import Category, CustomerProfile, GuestRequest, Intent
+from backend.profile_cache import ProfileCache
+from backend.storage import ArrayUnion, Increment, firestore_storage
+from backend.task_rules import TaskRules
+from backend.write_batcher import WriteBatcher
+
+logger = logging.getLogger(__name__)
+
+# The I/O steps yielded by Pilot._pipeline.
+_LOAD_PROFILE = 'load_profile'
+_PROFILE = 'profile'
+_READ = 'read'
+_COMMIT = 'commit'
+
 
 class Pilot:
-    def __init__(self):
-        # Cache hotel data to reduce Firestore reads.
-        self.hotels = self._fetch_hotel_data()
+    def __init__(self, storage=None, write_batcher=None, profile_cache=None, hotel_catalog=None, metrics=None, task_rules=None,
+                 idempotency=None, dispatcher=None, ledger=None, preferences=None, preload_hotels=False):
+        # Any backend from backend.storage; defaults to the Firebase project's Firestore, connected on first use.
+        self.db = storage or firestore_storage()
+        self.profiles = profile_cache or ProfileCache()
+        # Hotels are loaded on first use (or, with `preload_hotels`, in the background
+        # from now on) and kept current by the catalog.
+        self.hotels = hotel_catalog or HotelCatalog(self.db)
+        if preload_hotels:
+            self.hotels.preload()
+        # All writes of a request are committed together in one WriteBatch.
+        self.writes = write_batcher or WriteBatcher(self.db)
+        self.metrics = metrics or PilotMetrics()
+        self.metrics.add_collector(self._collect_metrics)
+        self._request_numbers = itertools.count(1)
+        # Staff tasks come from backend/task_rules.json, reloaded when the file changes.
+        self.task_rules = task_rules or TaskRules()
+        # Requests carrying an idempotency key are processed once, however often they are delivered.
+        self.idempotency = idempotency or IdempotencyIndex(self.db)
         self.staff_roles = ['Housekeeping', 'Front Desk', 'Maintenance', 'Concierge', 'IT Support', 'Manager', 'Accountant', 'Procurement Office', 'Kitchen Staff', 'Guide/Concierge', 'Owner/Manager', 'Personal Butler', 'Wellness Coordinator']
+        # Optional DispatchScheduler assigning new tasks to staff once the request's writes are committed.
+        self.dispatcher = dispatcher
+        if dispatcher is not None:
+            if dispatcher.roles is None:
+                dispatcher.roles = self.staff_roles
+            self.metrics.add_collector(dispatcher.collect_metrics)
+        # Optional TokenLedger; token and review counter updates then go through its log and periodic flushes.
+        self.ledger = ledger
+        if ledger is not None:
+            if ledger.profiles is None:
+                ledger.profiles = self.profiles
+            self.metrics.add_collector(ledger.collect_metrics)
+        # Optional PreferenceLearner recording guests' preferred locations and amenities on their user profiles.
+        self.preferences = preferences
+        if preferences is not None:
+            self.metrics.add_collector(preferences.collect_metrics)
         self.reward_values = {
             'eco-action-light': 100,
             'eco-action-water': 200,
@@ -37,215 +79,371 @@ class Pilot:
             'room': ['room', 'bed', 'bathroom'],
             'food': ['meal', 'food', 'breakfast', 'dinner']
         }
+        self.sentiment_keywords = {
+            'negative': ['poor', 'slow', 'bad', 'unhappy', 'dirty', 'broken', 'disappointing', 'rude', 'unresolved'],
+            'positive': ['excellent', 'great', 'fast', 'happy', 'clean', 'wonderful', 'professional', 'helpful']
+        }
+        # Intent rules per category, checked in order; the first rule with a hit wins.
+        self.intent_rules = {
+            'service_request': {
+                'tech_support': ['wi-fi', 'internet'],
+                'housekeeping_request': ['clean', 'housekeeping'],
+                'maintenance_issue': ['maintenance', 'broken'],
+                'food_order': ['meal', 'dining', 'menu'],
+                'realtime_service': ['buzzer', 'towels']
+            },
+            'eco_request': {
+                'eco_housekeeping': ['opt out', 'reuse'],
+                'eco_transport': ['transport', 'bike'],
+                'eco_food': ['vegan', 'local food', 'sustainable'],
+                'eco_donation': ['donation']
+            },
+            'medical_alert': {
+                'diabetic_care': ['diabetic', 'therapeutic nutrition'],
+                'asthma_care': ['asthmatic']
+            }
+        }
+        self.intent_entities = {
+            'tech_support': 'Wi-Fi',
+            'housekeeping_request': 'cleaning',
+            'maintenance_issue': 'maintenance',
+            'food_order': 'food'
+        }
+        self.reward_keywords = {
+            'eco-action-water': ['opt out of', 'no linen', 'reuse towels'],
+            'eco-action-light': ['turn off lights', 'ac down', 'natural light'],
+            'eco-action-transport': ['bike rental', 'bus pass', 'car-sharing'],
+            'eco-action-food': ['vegan', 'local food', 'no-meat', 'sustainable'],
+            'eco-action-zero-waste': ['digital receipt', 'no paper', 'zero-waste'],
+            'eco-action-major': ['park clean-up', 'coral reef planting', 'tree planting']
+        }
+        self.politeness_keywords = ['please', 'thank you']
+        # Compile every keyword table into one matcher so a request is scanned only once.
+        self.keyword_matcher = self._build_keyword_matcher()
 
-    def _fetch_hotel_data(self):
-        """Fetches and caches all hotel data from Firestore."""
-        try:
-            hotels_ref = db.collection('hotels')
-            hotels_data = {doc.id: doc.to_dict() for doc in hotels_ref.stream()}
-            return hotels_data
-        except Exception as e:
-            print(f"Error fetching hotel data: {e}")
-            return {}
+    def _build_keyword_matcher(self):
+        """Compiles all keyword tables into a single KeywordMatcher."""
+        # Category and intent labels are interned as enum members, so matches return them directly.
+        tables = {
+            'sentiment': list(self.sentiment_keywords.items()),
+            'category': [(Category(label), keywords) for label, keywords in self.request_categories.items()],
+            'entity': list(self.entity_keywords.items()),
+            'reward': list(self.reward_keywords.items()),
+            'politeness': [('politeness', self.politeness_keywords)]
+        }
+        # Intent table name per category, looked up once per request.
+        self._intent_tables = {}
+        for category, rules in self.intent_rules.items():
+            tables[f'intent:{category}'] = [(Intent(label), keywords) for label, keywords in rules.items()]
+            self._intent_tables[Category(category)] = f'intent:{category}'
+        return KeywordMatcher(tables)
+
+    def _match_keywords(self, query):
+        """Finds every known keyword in the query in a single scan."""
+        return self.keyword_matcher.scan(query)
+
+    def triage_batch(self, queries, chunk_size=100000):
+        """
+        Triages many queries at once, e.g. to backfill historical reviews.
+
+        Returns a dict of NumPy columns aligned with `queries`: 'category', 'sentiment',
+        'intent', 'entities' (lists), 'reward_type' (None without an eco-action) and
+        'polite', each equal to what the single-request path computes. Repeated queries
+        are triaged once, and rules are applied to the query x keyword matrix as array
+        operations; `chunk_size` bounds how many distinct queries are scanned at a time.
+        """
+        import numpy as np
+        unique = list(dict.fromkeys(queries))
+        parts = [self._triage_unique(unique[start:start + chunk_size]) for start in range(0, len(unique), chunk_size)]
+        parts = parts or [self._triage_unique([])]
+        result = {name: np.concatenate([part[name] for part in parts])
+                  for name in ('category', 'sentiment', 'intent', 'entities', 'reward_type', 'polite')}
+        if len(unique) < len(queries):
+            positions = dict(zip(unique, range(len(unique))))
+            inverse = np.fromiter(map(positions.__getitem__, queries), dtype=np.int64, count=len(queries))
+            result = {name: column[inverse] for name, column in result.items()}
+        # Each row gets its own entities list, as from _recognize_intent.
+        result['entities'] = np.fromiter(map(list, result['entities'].tolist()), dtype=object, count=len(queries))
+        return result
+
+    def _triage_unique(self, queries):
+        """Applies triage, intent and reward rules to a list of distinct queries."""
+        import numpy as np
+        matrix = self.keyword_matcher.scan_batch(queries)
+
+        def labels(table, ranks, default):
+            return np.array(self.keyword_matcher.labels(table) + [default], dtype=object)[ranks]
+
+        category = labels('category', matrix.first('category'), Category.UNKNOWN)
+        sentiment = labels('sentiment', matrix.first('sentiment'), 'neutral')
+        reward_type = labels('reward', matrix.first('reward'), None)
+        polite = matrix.has('politeness')
+
+        intent = np.full(len(queries), Intent.GENERAL_INQUIRY, dtype=object)
+        intent_entity = np.full(len(queries), None, dtype=object)
+        for rule_category in self.intent_rules:
+            table = f'intent:{rule_category}'
+            ranks = matrix.first(table, exact=True)
+            in_category = (category == rule_category) & (ranks >= 0)
+            intent[in_category] = labels(table, ranks[in_category], None)
+            entity_labels = [self.intent_entities.get(label) for label in self.keyword_matcher.labels(table)]
+            intent_entity[in_category] = np.array(entity_labels + [None], dtype=object)[ranks[in_category]]
+
+        # Entities are shared tuples here; triage_batch turns every row into a fresh list.
+        entity_keywords = matrix.keywords('entity', exact=True)
+        entities = np.empty(len(queries), dtype=object)
+        entities.fill(())
+        if entity_keywords:
+            rows = np.fromiter(entity_keywords, dtype=np.int64, count=len(entity_keywords))
+            entities[rows] = np.fromiter(map(tuple, entity_keywords.values()), dtype=object, count=len(rows))
+        rows = np.flatnonzero(intent_entity.astype(bool))
+        entities[rows] = np.fromiter(((entity,) + keywords for entity, keywords in zip(intent_entity[rows].tolist(), entities[rows].tolist())),
+                                     dtype=object, count=len(rows))
+        return {'category': category, 'sentiment': sentiment, 'intent': intent, 'entities': entities,
+                'reward_type': reward_type, 'polite': polite}
+
+    def _collect_metrics(self):
+        """Adds write batcher and profile cache counters to the metrics export."""
+        cache = self.profiles.stats()
+        return {
+            'pilot_duplicate_requests_total': ('counter', 'Repeated deliveries skipped by idempotency key.', self.idempotency.duplicates),
+            'pilot_batched_writes_total': ('counter', 'Document writes committed through the write batcher.', self.writes.writes),
+            'pilot_batch_commits_total': ('counter', 'WriteBatch commits.', self.writes.commits),
+            'pilot_profile_cache_hits_total': ('counter', 'Profile cache hits.', cache['hits']),
+            'pilot_profile_cache_misses_total': ('counter', 'Profile cache misses.', cache['misses']),
+            'pilot_profile_cache_evictions_total': ('counter', 'Profiles evicted from the cache.', cache['evictions']),
+            'pilot_profile_cache_size': ('gauge', 'Profiles currently cached.', cache['size'])
+        }
 
     def process_request(self, customer_id, request_details):
         """
         Main function to process a customer's request and trigger task allocation.
-        This is the core entry point for the pilot.
+        This is the core entry point for the pilot. `request_details` is a request
+        dict or a GuestRequest.
         """
-        print(f"Processing request for customer {customer_id}")
-        
-        customer_profile = self._get_customer_profile(customer_id)
-        current_hotel_id = request_details.get('hotel_id')
+        timer = self.metrics.start_request()
+        request_log = self._start_request_log(customer_id, request_details)
+        steps = self._pipeline(timer, customer_id, request_details)
+        send, value = steps.send, None
+        outcome = 'error'
+        try:
+            while True:
+                try:
+                    step, arg = send(value)
+                except StopIteration:
+                    outcome = 'ok'
+                    return
+                try:
+                    if step is _LOAD_PROFILE:
+                        value = self._get_customer_profile(arg)
+                        timer.mark('profile_fetch')
+                    elif step is _PROFILE:
+                        value = arg
+                    elif step is _READ:
+                        value = arg()
+                        self.metrics.count('reads')
+                    else:
+                        if request_log is not None:
+                            request_log.writes += arg.size
+                        value = arg.commit()
+                    send = steps.send
+                except Exception as error:
+                    send, value = steps.throw, error
+        finally:
+            if request_log is not None:
+                request_log.close(logger, outcome)
+
+    def _start_request_log(self, customer_id, request_details):
+        """
+        Returns a RequestLog for a request, identified by its idempotency key or else by
+        its number in this process, if debug logging is on; otherwise None.
+        """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return None
+        number = next(self._request_numbers)
+        key = request_details.idempotency_key if isinstance(request_details, GuestRequest) else request_details.get('idempotency_key')
+        return RequestLog(key or f'{customer_id}#{number}', customer_id)
+
+    def _pipeline(self, timer, customer_id, request_details):
+        """
+        The stages of processing a request, shared by Pilot and AsyncPilot.
+
+        A generator yielding its I/O as (step, arg) pairs for the caller to run:
+        _LOAD_PROFILE starts loading a customer's profile and returns a handle, which
+        _PROFILE turns into the profile; _READ calls a storage read; _COMMIT commits a
+        request batch. Errors raised by a step are thrown back into the generator.
+        """
+        logger.debug("processing request customer_id=%s", customer_id)
+        request = request_details if isinstance(request_details, GuestRequest) else GuestRequest.from_dict(request_details)
+        key = request.idempotency_key
+        if key is not None and (yield from self._is_duplicate(key)):
+            logger.debug("duplicate request skipped customer_id=%s idempotency_key=%s", customer_id, key)
+            return
+
+        profile_fetch = yield _LOAD_PROFILE, customer_id
+        current_hotel_id = request.hotel_id
         current_hotel = self.hotels.get(current_hotel_id)
 
         if not current_hotel:
-            print(f"Error: Hotel ID {current_hotel_id} not found.")
+            yield _PROFILE, profile_fetch
+            self.metrics.count('failed_requests')
+            logger.warning("hotel not found hotel_id=%s customer_id=%s", current_hotel_id, customer_id)
             return
 
+        query = request.query
+        matches = self._match_keywords(query)
+
         # Tier 1: Triage and Sentiment Analysis
-        request_category, sentiment = self._triage_request(request_details)
-        print(f"Request categorized as: {request_category} with sentiment: {sentiment}")
+        request_category, sentiment = self._triage_request(request, matches)
+        timer.mark('triage')
+        logger.debug("request categorized category=%s sentiment=%s", request_category, sentiment)
 
         # Tier 2: Intent Recognition
-        intent, entities = self._recognize_intent(request_details.get('query', ''), request_category)
-        print(f"Recognized intent: {intent}, Entities: {entities}")
+        intent, entities = self._recognize_intent(query, request_category, matches)
+        timer.mark('intent')
+        logger.debug("intent recognized intent=%s entities=%s", intent, entities)
+
+        customer_profile = yield _PROFILE, profile_fetch
 
         # Tier 3: Automated Task Generation
         tasks = self._generate_tasks(request_category, intent, entities, customer_profile, current_hotel, sentiment)
-        
+        timer.mark('task_generation')
+
+        # This request's writes, committed together at the end.
+        writes = self.writes.begin()
         # Allocate rewards and personalization
-        self._allocate_rewards(customer_profile, request_details, tasks, sentiment)
-        self._personalize_customer_profile(customer_profile, request_details, sentiment)
+        self._allocate_rewards(customer_profile, request, tasks, sentiment, matches, writes)
+        timer.mark('rewards')
+        self._personalize_customer_profile(customer_profile, request, sentiment, matches, writes)
+        timer.mark('personalization')
+        if self.preferences is not None:
+            self.preferences.observe(customer_id, query)
+            timer.mark('preferences')
 
         # Send tasks to Firestore for staff app to retrieve
-        self._send_tasks_to_staff(tasks, current_hotel_id)
-        
-        print(f"Tasks generated and sent for customer {customer_id}")
+        self._send_tasks_to_staff(tasks, current_hotel_id, writes)
+        if key is None:
+            yield _COMMIT, writes
+        else:
+            if not writes.exclusive and not self.idempotency.hold(key):
+                # Another delivery's writes are waiting in the same window.
+                logger.info("duplicate request discarded customer_id=%s idempotency_key=%s", customer_id, key)
+                return
+            # Windowed batches also hold other requests' writes, which a conflicting marker must not fail.
+            self.idempotency.queue_marker(writes, key, customer_id, current_hotel_id, exclusive=writes.exclusive)
+            # Remembered once the writes are in storage, so a retry after a failed flush is not skipped.
+            writes.after_commit(lambda: self.idempotency.remember(key))
+            try:
+                yield _COMMIT, writes
+            except self.db.AlreadyExists:
+                self._drop_duplicate(customer_id, key)
+                return
+        timer.mark('task_publish')
+        self.metrics.finish_request(timer)
 
-    def _triage_request(self, request_details):
+        logger.debug("tasks sent customer_id=%s tasks=%d", customer_id, len(tasks))
+
+    def _is_duplicate(self, key):
+        """Returns True if a request with this idempotency key was already processed; a pipeline sub-step."""
+        if self.idempotency.seen(key):
+            return True
+        if self.writes.flush_interval is None:
+            return False
+        # With windowed writes the marker is not exclusive, so check storage up front.
+        snapshot = yield _READ, self.idempotency.marker(key).get
+        return self.idempotency.stored(key, snapshot)
+
+    def _drop_duplicate(self, customer_id, key):
+        """Handles a batch rejected because another delivery of the request was committed first."""
+        self.idempotency.remember(key, duplicate=True)
+        logger.info("duplicate request discarded customer_id=%s idempotency_key=%s", customer_id, key)
+
+    def _triage_request(self, request, matches=None):
         """Categorizes request type and analyzes sentiment."""
-        query = request_details.get('query', '').lower()
-        request_type = 'unknown'
-        sentiment = 'neutral'
+        if matches is None:
+            matches = self._match_keywords(request.query)
 
-        # Sentiment Analysis
-        negative_keywords = ['poor', 'slow', 'bad', 'unhappy', 'dirty', 'broken', 'disappointing', 'rude', 'unresolved']
-        positive_keywords = ['excellent', 'great', 'fast', 'happy', 'clean', 'wonderful', 'professional', 'helpful']
-        
-        if any(keyword in query for keyword in negative_keywords):
-            sentiment = 'negative'
-        elif any(keyword in query for keyword in positive_keywords):
-            sentiment = 'positive'
+        # Sentiment Analysis: negative keywords take precedence over positive ones.
+        sentiment = matches.first('sentiment') or 'neutral'
 
         # Category Triage
-        for category, keywords in self.request_categories.items():
-            if any(keyword in query for keyword in keywords):
-                request_type = category
-                break
-        
+        request_type = matches.first('category') or Category.UNKNOWN
+
         return request_type, sentiment
 
-    def _recognize_intent(self, query, category):
+    def _recognize_intent(self, query, category, matches=None):
         """Extracts specific intent and entities from the query."""
-        intent = 'general_inquiry'
+        if matches is None:
+            matches = self._match_keywords(query)
+        intent = Intent.GENERAL_INQUIRY
         entities = []
 
-        if category == 'service_request':
-            if 'wi-fi' in query or 'internet' in query:
-                intent = 'tech_support'
-                entities.append('Wi-Fi')
-            elif 'clean' in query or 'housekeeping' in query:
-                intent = 'housekeeping_request'
-                entities.append('cleaning')
-            elif 'maintenance' in query or 'broken' in query:
-                intent = 'maintenance_issue'
-                entities.append('maintenance')
-            elif 'meal' in query or 'dining' in query or 'menu' in query:
-                intent = 'food_order'
-                entities.append('food')
-            elif 'buzzer' in query or 'towels' in query:
-                intent = 'realtime_service'
-
-        elif category == 'eco_request':
-            if 'opt out' in query or 'reuse' in query:
-                intent = 'eco_housekeeping'
-            elif 'transport' in query or 'bike' in query:
-                intent = 'eco_transport'
-            elif 'vegan' in query or 'local food' in query or 'sustainable' in query:
-                intent = 'eco_food'
-            elif 'donation' in query:
-                intent = 'eco_donation'
-        
-        elif category == 'medical_alert':
-            if 'diabetic' in query or 'therapeutic nutrition' in query:
-                intent = 'diabetic_care'
-            elif 'asthmatic' in query:
-                intent = 'asthma_care'
-        
+        # Intent keywords are matched against the query as written, not lowercased.
+        intent_table = self._intent_tables.get(category)
+        if intent_table is not None:
+            intent = matches.first(intent_table, exact=True) or intent
+            intent_entity = self.intent_entities.get(intent)
+            if intent_entity is not None:
+                entities.append(intent_entity)
+
         # Entity extraction
-        for entity_type, keywords in self.entity_keywords.items():
-            for keyword in keywords:
-                if keyword in query:
-                    entities.append(keyword)
-        
+        entities.extend(matches.keywords('entity', exact=True))
+
         return intent, entities
 
     def _generate_tasks(self, category, intent, entities, customer_profile, hotel_data, sentiment):
         """Generates contextual tasks for staff based on recognized intent."""
-        tasks_list = []
-        customer_name = customer_profile.get('name', 'Guest')
-        room_number = customer_profile.get('room_number', 'unknown')
-
-        # Proactive Alerts
-        if customer_profile.get('negative_reviews_count', 0) > 3:
-            tasks_list.append({
-                'role': 'Manager',
-                'description': f'Proactive Alert: {customer_name} has a history of negative reviews. Ensure high-quality service.',
-                'priority': 'Critical'
-            })
-
-        if category == 'medical_alert':
-            if intent == 'diabetic_care':
-                tasks_list.append({
-                    'role': 'Kitchen Staff',
-                    'description': f'URGENT: {customer_name} in room {room_number} requires therapeutic nutrition for diabetic condition. Coordinate with chef on duty on suggested meal changes.',
-                    'priority': 'Critical'
-                })
-                tasks_list.append({
-                    'role': 'Chef',
-                    'description': f'URGENT: {customer_name} in room {room_number} requires diabetic-friendly meal. Suggested changes: avoid added sugars, reduce carbs, and focus on fresh vegetables and lean proteins.',
-                    'priority': 'Critical'
-                })
-            elif intent == 'asthma_care':
-                tasks_list.append({
-                    'role': 'Front Desk',
-                    'description': f'URGENT: {customer_name} in room {room_number} has asthma. Re-allocate room to a lower floor away from potential triggers. Ensure air purifier is installed.',
-                    'priority': 'Critical'
-                })
-        
-        elif category == 'review':
-            if 'positive' in sentiment:
-                tasks_list.append({'role': 'Manager', 'description': f'Acknowledge and praise staff member mentioned in positive review from {customer_name}.', 'priority': 'Low'})
-            else:
-                tasks_list.append({
-                    'role': 'Manager',
-                    'description': f'Investigate and resolve negative review from {customer_name} in room {room_number}: {entities}.',
-                    'priority': 'Critical'
-                })
-                tasks_list.append({'role': 'Front Desk', 'description': f'Offer a remedy to {customer_name} for their negative review.', 'priority': 'High'})
-
-        elif category == 'service_request':
-            if intent == 'tech_support':
-                tasks_list.append({'role': 'IT Support', 'description': f'Troubleshoot Wi-Fi for {customer_name} in room {room_number}.', 'priority': 'Critical'})
-            elif intent == 'housekeeping_request':
-                tasks_list.append({'role': 'Housekeeping', 'description': f'Attend to a cleaning or laundry request for {customer_name} in room {room_number}.', 'priority': 'High'})
-            elif intent == 'realtime_service':
-                tasks_list.append({'role': 'Front Desk', 'description': f'URGENT: Buzzer request from {customer_name} in room {room_number}. Respond immediately.', 'priority': 'Critical'})
-            elif intent == 'food_order':
-                tasks_list.append({'role': 'Kitchen Staff', 'description': f'New meal order for {customer_name} in room {room_number}. Check for eco-friendly suggestions: use locally sourced ingredients and minimal packaging.', 'priority': 'High'})
-        
-        elif category == 'eco_request':
-            tasks_list.append({'role': 'Housekeeping', 'description': f'Guest {customer_name} opted for eco-friendly housekeeping. Update schedule.', 'priority': 'Low'})
-        
-        return tasks_list
+        return self.task_rules.tasks_for(category, intent, sentiment, customer_profile, hotel_data, entities)
 
     def _get_customer_profile(self, customer_id):
+        """Retrieves a customer profile from the profile cache, loading it from Firestore on a miss."""
+        return self.profiles.get_or_load(customer_id, self._load_customer_profile)
+
+    def _load_customer_profile(self, customer_id):
         """Retrieves or creates a customer profile from Firestore."""
-        doc_ref = db.collection('customers').document(customer_id)
+        doc_ref = self.db.collection('customers').document(customer_id)
         doc = doc_ref.get()
+        self.metrics.count('reads')
         if doc.exists:
-            profile = doc.to_dict()
-            if 'tokens' not in profile: profile['tokens'] = 0
-            if 'negative_reviews_count' not in profile: profile['negative_reviews_count'] = 0
-            if 'positive_reviews_count' not in profile: profile['positive_reviews_count'] = 0
-            if 'staff_feedback' not in profile: profile['staff_feedback'] = {}
-            if 'is_diabetic' not in profile: profile['is_diabetic'] = False
-            if 'is_asthmatic' not in profile: profile['is_asthmatic'] = False
-            return profile
-        else:
-            new_profile = {'id': customer_id, 'history': [], 'preferences': {}, 'tokens': 0, 'negative_reviews_count': 0, 'positive_reviews_count': 0, 'staff_feedback': {}, 'is_diabetic': False, 'is_asthmatic': False}
-            doc_ref.set(new_profile)
-            return new_profile
+            return self._with_pending_tokens(CustomerProfile.from_firestore(doc.to_dict(), customer_id))
+        new_profile = self._new_customer_profile(customer_id)
+        try:
+            # create() fails instead of overwriting if another worker created the profile first.
+            self.metrics.count('writes')
+            doc_ref.create(new_profile.to_firestore())
+        except self.db.AlreadyExists:
+            self.metrics.count('reads')
+            return self._with_pending_tokens(CustomerProfile.from_firestore(doc_ref.get().to_dict(), customer_id))
+        return self._with_pending_tokens(new_profile)
+
+    def _with_pending_tokens(self, profile):
+        """Applies the ledger's unflushed updates to a profile read from storage."""
+        if self.ledger is not None:
+            profile.apply_update(self.ledger.pending_updates(profile.id))
+        return profile
 
-    def _personalize_customer_profile(self, customer_profile, request_details, sentiment):
+    def _new_customer_profile(self, customer_id):
+        """Returns the profile stored for a customer seen for the first time."""
+        return CustomerProfile(customer_id)
+
+    def _personalize_customer_profile(self, customer_profile, request, sentiment, matches=None, writes=None):
         """Updates the customer's profile based on their behavior."""
-        customer_doc_ref = db.collection('customers').document(customer_profile['id'])
         updates = {}
-        query = request_details.get('query', '').lower()
+        if matches is None:
+            matches = self._match_keywords(request.query)
         
-        if 'please' in query or 'thank you' in query:
-            updates['tokens'] = firestore.Increment(self.reward_values['politeness'])
+        if matches.has('politeness'):
+            updates['tokens'] = Increment(self.reward_values['politeness'])
             
         if sentiment == 'positive':
-            updates['positive_reviews_count'] = firestore.Increment(1)
-            updates['tokens'] = firestore.Increment(self.reward_values['positive-review'])
+            updates['positive_reviews_count'] = Increment(1)
+            updates['tokens'] = Increment(self.reward_values['positive-review'])
         elif sentiment == 'negative':
-            updates['negative_reviews_count'] = firestore.Increment(1)
-            updates['tokens'] = firestore.Increment(-5) # Punishment for negative feedback
+            updates['negative_reviews_count'] = Increment(1)
+            updates['tokens'] = Increment(-5) # Punishment for negative feedback
         
         if updates:
-            customer_doc_ref.update(updates)
+            self._queue_profile_update(customer_profile.id, updates, request.idempotency_key, writes)
 
     def _calculate_dynamic_reward(self, eco_action, duration_days=1):
         """Calculates a dynamic reward based on action and duration."""
@@ -253,39 +451,68 @@ class Pilot:
         multiplier = 1 + (duration_days - 1) * 0.25 # 25% bonus for each additional day
         return int(base_value * multiplier)
 
-    def _allocate_rewards(self, customer_profile, request_details, tasks, sentiment):
+    def _allocate_rewards(self, customer_profile, request, tasks, sentiment, matches=None, writes=None):
         """Determines and allocates rewards based on customer behavior and eco-friendliness."""
-        query = request_details.get('query', '').lower()
-        reward_type = None
-        duration_days = request_details.get('duration_days', 1)
-        
-        if any(keyword in query for keyword in ['opt out of', 'no linen', 'reuse towels']):
-            reward_type = 'eco-action-water'
-        elif any(keyword in query for keyword in ['turn off lights', 'ac down', 'natural light']):
-            reward_type = 'eco-action-light'
-        elif any(keyword in query for keyword in ['bike rental', 'bus pass', 'car-sharing']):
-            reward_type = 'eco-action-transport'
-        elif any(keyword in query for keyword in ['vegan', 'local food', 'no-meat', 'sustainable']):
-            reward_type = 'eco-action-food'
-        elif any(keyword in query for keyword in ['digital receipt', 'no paper', 'zero-waste']):
-            reward_type = 'eco-action-zero-waste'
-        elif any(keyword in query for keyword in ['park clean-up', 'coral reef planting', 'tree planting']):
-            reward_type = 'eco-action-major'
+        if matches is None:
+            matches = self._match_keywords(request.query)
+        reward_type = matches.first('reward')
 
         if reward_type:
-            reward_amount = self._calculate_dynamic_reward(reward_type, duration_days)
-            reward_details = f'{reward_amount} tokens for a sustainable action.'
-            db.collection('customers').document(customer_profile['id']).update({'rewards': firestore.ArrayUnion([{'type': 'Green & Sustainable Reward', 'details': reward_details}]), 'tokens': firestore.Increment(reward_amount)})
-            print(f"Reward assigned for sustainable behavior: {reward_details}")
+            self._queue_reward(customer_profile.id, reward_type, request.duration_days, request.idempotency_key, writes)
+
+    def _queue_reward(self, customer_id, reward_type, duration_days=1, key=None, writes=None):
+        """Queues the token award for an eco-action and returns the amount."""
+        reward_amount = self._calculate_dynamic_reward(reward_type, duration_days)
+        reward_details = f'{reward_amount} tokens for a sustainable action.'
+        updates = {'rewards': ArrayUnion([{'type': 'Green & Sustainable Reward', 'details': reward_details}]), 'tokens': Increment(reward_amount)}
+        self._queue_profile_update(customer_id, updates, key, writes)
+        logger.debug("reward assigned customer_id=%s reward_type=%s tokens=%d", customer_id, reward_type, reward_amount)
+        return reward_amount
+
+    def _queue_profile_update(self, customer_id, updates, key=None, writes=None):
+        """
+        Queues token and counter updates on the request's batch `writes`, or records them
+        in the ledger once the batch is committed, so a failed or duplicate request leaves
+        nothing to flush; without a batch they are committed on their own. The cached
+        profile is updated once the batch is committed.
+        """
+        batch = writes or self.writes.begin()
+        if self.ledger is None:
+            batch.update(self.db.collection('customers').document(customer_id), updates)
+        else:
+            batch.after_commit(lambda: self.ledger.record(customer_id, updates, key))
+        batch.after_commit(lambda: self.profiles.apply_update(customer_id, updates))
+        if writes is None:
+            batch.commit()
+
+    def award_eco_action(self, customer_id, reward_type, duration_days=1):
+        """
+        Rewards an eco-action detected outside a guest request (e.g. from room telemetry)
+        and returns the tokens awarded.
+        """
+        if reward_type not in self.reward_values:
+            raise ValueError(f"unknown reward type {reward_type!r}")
+        # Makes sure the profile exists before it is updated.
+        self._get_customer_profile(customer_id)
+        writes = self.writes.begin()
+        reward_amount = self._queue_reward(customer_id, reward_type, duration_days, writes=writes)
+        writes.commit()
+        return reward_amount
 
-    def _send_tasks_to_staff(self, tasks, hotel_id):
-        """Publishes the generated tasks to the 'tasks' collection in Firestore."""
+    def _send_tasks_to_staff(self, tasks, hotel_id, writes=None):
+        """Queues the generated tasks for the 'tasks' collection in Firestore."""
+        writes = writes or self.writes
+        tasks_collection = self.db.collection('tasks')
         for task in tasks:
-            task['timestamp'] = firestore.SERVER_TIMESTAMP
-            task['hotel_id'] = hotel_id
-            db.collection('tasks').add(task)
+            doc_ref = writes.add(tasks_collection, task.to_firestore(hotel_id))
+            if self.dispatcher is not None:
+                task.id = doc_ref.id
+                task.hotel_id = hotel_id
+                # Scheduled once the request's writes, and so the task document, are committed.
+                self.dispatcher.submit(task, writes=writes)
 
 if __name__ == '__main__':
+    configure_logging(logging.DEBUG)
     pilot_engine = Pilot()
     
     # Mock data demonstrating the new desired experience feature
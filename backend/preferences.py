@@ -0,0 +1,177 @@
+"""
+Learns guests' preferred locations and amenities from their messages, as the
+`updatePilotKnowledge` Cloud Function does, and records them on their
+`user_profiles` documents.
+
+Messages are scanned once by a KeywordMatcher over the location and amenity
+vocabularies, so multi-word terms ("room service", "new york") and spelling
+variants ("wifi", "rio de janeiro") are found, and a hit only counts when it is a
+whole word or phrase ("bar" is not found in "barbecue"). New terms are held per
+user and written by `flush` as one ArrayUnion update per user, 500 users per batch,
+so a guest sending many messages costs one write per flush at most.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from backend.keyword_matcher import KeywordMatcher
+from backend.storage import ArrayUnion
+from backend.write_batcher import MAX_BATCH_OPS
+
+logger = logging.getLogger(__name__)
+
+# Labels are the terms the Cloud Function stores; each is found by any of its keywords.
+LOCATIONS = [
+    ('new york', ['new york', 'nyc']),
+    ('london', ['london']),
+    ('paris', ['paris']),
+    ('tokyo', ['tokyo']),
+    ('sydney', ['sydney']),
+    ('rome', ['rome']),
+    ('dubai', ['dubai']),
+    ('rio', ['rio', 'rio de janeiro'])
+]
+AMENITIES = [
+    ('wi-fi', ['wi-fi', 'wifi', 'wi fi']),
+    ('pool', ['pool']),
+    ('gym', ['gym']),
+    ('restaurant', ['restaurant']),
+    ('bar', ['bar']),
+    ('spa', ['spa']),
+    ('lounge', ['lounge']),
+    ('conference room', ['conference room']),
+    ('room service', ['room service']),
+    ('laundry', ['laundry'])
+]
+FIELDS = {'location': 'preferred_locations', 'amenity': 'amenities_of_interest'}
+
+
+class PreferenceLearner:
+    """
+    Extracts preferences from guest messages and batches them into profile updates.
+
+    `observe` is called with every message and only touches memory; `flush` (or the
+    thread started by `start_flusher`) writes what was learned since the last flush.
+    Terms a user is already known to have are not written again; that memory covers
+    the `max_users` most recently seen users. The updates merge into the profile
+    documents, so a failed flush can simply be retried.
+    """
+
+    def __init__(self, db, app_id='default-app-id', collection=None, locations=LOCATIONS, amenities=AMENITIES, max_users=100000):
+        self.db = db
+        self.collection = collection or f'artifacts/{app_id}/public/data/user_profiles'
+        self.matcher = KeywordMatcher({'location': locations, 'amenity': amenities})
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # user_id -> {table: {label: None}}; dicts keep the order terms were seen in.
+        self._pending = {}
+        # user_id -> set of (table, label) already written, least recently seen first.
+        self._known = OrderedDict()
+        self.messages = 0
+        self.learned = 0
+        self.flushed = 0
+
+    def extract(self, message):
+        """Returns {table: [labels]} for the vocabulary terms in `message`, in order of appearance."""
+        found = {}
+        for table, label in self.matcher.iter_phrases(message.lower()):
+            labels = found.setdefault(table, [])
+            if label not in labels:
+                labels.append(label)
+        return found
+
+    def observe(self, user_id, message):
+        """Records the preferences found in a user's message; returns True if any of them are new."""
+        found = self.extract(message) if message else {}
+        with self._lock:
+            self.messages += 1
+            if not found:
+                return False
+            known = self._known.get(user_id, ())
+            new = False
+            for table, labels in found.items():
+                for label in labels:
+                    if (table, label) not in known:
+                        pending = self._pending.setdefault(user_id, {}).setdefault(table, {})
+                        if label not in pending:
+                            pending[label] = None
+                            self.learned += 1
+                            new = True
+            return new
+
+    def flush(self):
+        """Writes the pending preferences, one update per user; returns the number of users updated."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            collection = self.db.collection(self.collection)
+            users = list(pending.items())
+            updated = 0
+            for start in range(0, len(users), MAX_BATCH_OPS):
+                chunk = users[start:start + MAX_BATCH_OPS]
+                batch = self.db.batch()
+                for user_id, tables in chunk:
+                    preferences = {FIELDS[table]: ArrayUnion(list(labels)) for table, labels in tables.items()}
+                    # A merge creates the preferences map if the profile does not have one yet.
+                    batch.set(collection.document(user_id), {'preferences': preferences}, merge=True)
+                try:
+                    batch.commit()
+                except Exception:
+                    self._requeue(users[start:])
+                    raise
+                self._remember(chunk)
+                updated += len(chunk)
+            self.flushed += updated
+            logger.debug("preferences flushed users=%d", updated)
+            return updated
+
+    def _requeue(self, users):
+        # Merge back in front of anything observed since; ArrayUnion makes rewriting harmless.
+        with self._lock:
+            for user_id, tables in users:
+                current = self._pending.setdefault(user_id, {})
+                for table, labels in tables.items():
+                    current[table] = {**labels, **current.get(table, {})}
+
+    def _remember(self, users):
+        with self._lock:
+            for user_id, tables in users:
+                known = self._known.get(user_id)
+                if known is None:
+                    known = self._known[user_id] = set()
+                    if len(self._known) > self.max_users:
+                        self._known.popitem(last=False)
+                else:
+                    self._known.move_to_end(user_id)
+                known.update((table, label) for table, labels in tables.items() for label in labels)
+
+    def start_flusher(self, interval=10):
+        """Flushes every `interval` seconds from a background thread; returns an Event that stops it."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("error flushing learned preferences")
+
+        threading.Thread(target=run, name='preference-flusher', daemon=True).start()
+        return stop
+
+    def stats(self):
+        with self._lock:
+            return {'pending_users': len(self._pending), 'messages': self.messages, 'learned': self.learned, 'flushed': self.flushed}
+
+    def collect_metrics(self):
+        """Metrics for PilotMetrics.add_collector."""
+        stats = self.stats()
+        return {
+            'pilot_preferences_pending_users': ('gauge', 'Users with learned preferences not yet written.', stats['pending_users']),
+            'pilot_preferences_messages_total': ('counter', 'Messages scanned for preferences.', stats['messages']),
+            'pilot_preferences_learned_total': ('counter', 'New preference terms learned.', stats['learned']),
+            'pilot_preferences_flushed_users_total': ('counter', 'Profile documents updated by preference flushes.', stats['flushed'])
+        }
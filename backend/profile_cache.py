@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ProfileCache:
+    """
+    In-process LRU cache of customer profiles with a per-entry TTL.
+
+    Concurrent misses for the same customer share a single load. The pilot applies
+    its own `Increment`/`ArrayUnion` updates to the cached profile once they are
+    committed (write-through), so a cached profile stays consistent with this process' writes;
+    writes made by other processes become visible once the entry expires.
+    Cached profiles are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.monotonic):
+        if max_size <= 0:
+            raise ValueError(f"max_size must be positive, got {max_size}")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._async_loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, customer_id):
+        """Returns the cached profile, or None if it is missing or expired."""
+        with self._lock:
+            return self._lookup(customer_id)
+
+    def _lookup(self, customer_id):
+        entry = self._entries.get(customer_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, profile = entry
+        if expires_at <= self._clock():
+            del self._entries[customer_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(customer_id)
+        self.hits += 1
+        return profile
+
+    def put(self, customer_id, profile):
+        """Caches a profile, evicting the least recently used entries beyond `max_size`."""
+        with self._lock:
+            self._store(customer_id, profile)
+
+    def _store(self, customer_id, profile):
+        self._entries[customer_id] = (self._clock() + self.ttl, profile)
+        self._entries.move_to_end(customer_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, customer_id):
+        """Drops a customer's cached profile."""
+        with self._lock:
+            self._entries.pop(customer_id, None)
+
+    def clear(self):
+        """Drops every cached profile, e.g. when this process starts serving different customers."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, customer_id, loader):
+        """Returns the cached profile, calling `loader(customer_id)` once for concurrent misses."""
+        with self._lock:
+            profile = self._lookup(customer_id)
+            if profile is not None:
+                return profile
+            pending = self._loading.get(customer_id)
+            if pending is None:
+                pending = self._loading[customer_id] = Future()
+                is_loader = True
+            else:
+                is_loader = False
+        if not is_loader:
+            return pending.result()
+        try:
+            profile = loader(customer_id)
+        except Exception as e:
+            with self._lock:
+                del self._loading[customer_id]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            self._store(customer_id, profile)
+            del self._loading[customer_id]
+        pending.set_result(profile)
+        return profile
+
+    async def get_or_load_async(self, customer_id, loader):
+        """Async variant of get_or_load; `loader(customer_id)` must return an awaitable."""
+        # Imported here so that sync-only processes do not load asyncio.
+        import asyncio
+        with self._lock:
+            profile = self._lookup(customer_id)
+        if profile is not None:
+            return profile
+        pending = self._async_loading.get(customer_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = self._async_loading[customer_id] = asyncio.get_running_loop().create_future()
+        try:
+            profile = await loader(customer_id)
+        except Exception as e:
+            pending.set_exception(e)
+            # Waiters re-raise the error; mark it retrieved so it is not reported again.
+            pending.exception()
+            raise
+        else:
+            self.put(customer_id, profile)
+            pending.set_result(profile)
+            return profile
+        finally:
+            del self._async_loading[customer_id]
+
+    def apply_update(self, customer_id, updates):
+        """Applies a Firestore update dict (including Increment/ArrayUnion transforms) to the cached CustomerProfile."""
+        with self._lock:
+            entry = self._entries.get(customer_id)
+            if entry is None:
+                return
+            entry[1].apply_update(updates)
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,208 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import replace
+
+from backend.models import GuestRequest
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by RequestQueue.submit when the queue stays at `max_depth` for the whole timeout."""
+
+
+class RequestQueue:
+    """
+    Durable queue of guest requests in front of `Pilot.process_request`.
+
+    `submit` appends the request to a SQLite log and returns its sequence number as
+    soon as the row is committed, so a slow Firestore no longer blocks the guest-facing
+    path. A pool of `workers` threads drains the queue into the engine. Requests of one
+    customer are processed one at a time in submission order, so their token updates
+    are applied in order; different customers are processed in parallel.
+
+    At most `max_depth` requests may be queued or in flight; beyond that `submit`
+    waits up to `timeout` seconds for room and then raises QueueFull. A request is
+    deleted from the log once `process_request` returns. Requests that raise are
+    retried up to `max_attempts` times and then kept in the log as failed. On start,
+    requests left pending or in flight by a previous run are replayed, so delivery is
+    at least once. Every request is given an idempotency key when submitted (unless
+    it has one), so the engine skips a replayed request whose writes were already
+    committed.
+    """
+
+    def __init__(self, pilot, path='request_queue.db', workers=4, max_depth=10000, max_attempts=3, retry_delay=1.0):
+        self.pilot = pilot
+        self.path = path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.processed = 0
+        self.failed = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                error TEXT
+            )""")
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # customer_id -> deque of (seq, GuestRequest, attempts), in submission order.
+        self._pending = {}
+        # Customers with pending requests and none in flight, oldest first.
+        self._ready = deque()
+        self._in_flight = set()
+        self._depth = 0
+        self._stopping = False
+        self._threads = []
+        self._replay()
+
+    # --- Submitting ---
+
+    def submit(self, customer_id, request_details, timeout=None):
+        """Durably queues a request (a dict or GuestRequest) and returns its sequence number."""
+        request = request_details if isinstance(request_details, GuestRequest) else GuestRequest.from_dict(request_details)
+        if request.idempotency_key is None:
+            # Replays and retries then reach the engine with the same key and are applied once.
+            request = replace(request, idempotency_key=uuid.uuid4().hex)
+        payload = json.dumps(request.to_dict())
+        with self._changed:
+            if not self._changed.wait_for(lambda: self._depth < self.max_depth or self._stopping, timeout):
+                raise QueueFull(f"request queue is full ({self.max_depth} requests)")
+            seq = self._db.execute(
+                'INSERT INTO requests (customer_id, payload, enqueued_at) VALUES (?, ?, ?)',
+                (customer_id, payload, time.time())
+            ).lastrowid
+            self._push(customer_id, seq, request, 0)
+            self._changed.notify_all()
+        return seq
+
+    def _push(self, customer_id, seq, request, attempts):
+        queue = self._pending.get(customer_id)
+        if queue is None:
+            queue = self._pending[customer_id] = deque()
+            if customer_id not in self._in_flight:
+                self._ready.append(customer_id)
+        queue.append((seq, request, attempts))
+        self._depth += 1
+
+    def _replay(self):
+        rows = self._db.execute(
+            "SELECT seq, customer_id, payload, attempts FROM requests WHERE state IN ('pending', 'processing') ORDER BY seq"
+        ).fetchall()
+        if rows:
+            self._db.execute("UPDATE requests SET state = 'pending' WHERE state = 'processing'")
+            logger.info("replaying queued requests count=%d path=%s", len(rows), self.path)
+        for seq, customer_id, payload, attempts in rows:
+            self._push(customer_id, seq, GuestRequest.from_dict(json.loads(payload)), attempts)
+
+    # --- Workers ---
+
+    def start(self):
+        """Starts the worker threads."""
+        self._stopping = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'request-queue-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _claim(self):
+        with self._changed:
+            self._changed.wait_for(lambda: self._ready or self._stopping)
+            if self._stopping:
+                return None
+            customer_id = self._ready.popleft()
+            seq, request, attempts = self._pending[customer_id].popleft()
+            self._in_flight.add(customer_id)
+            self._db.execute("UPDATE requests SET state = 'processing', attempts = ? WHERE seq = ?", (attempts + 1, seq))
+            return customer_id, seq, request, attempts + 1
+
+    def _release(self, customer_id):
+        # Called with the lock held: lets the customer's next request be claimed.
+        self._in_flight.discard(customer_id)
+        if self._pending.get(customer_id):
+            self._ready.append(customer_id)
+        else:
+            self._pending.pop(customer_id, None)
+        self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return
+            customer_id, seq, request, attempts = claimed
+            try:
+                # The engine does not modify a GuestRequest, so a retry can reuse it.
+                self.pilot.process_request(customer_id, request)
+            except Exception as e:
+                self._on_failure(customer_id, seq, request, attempts, e)
+                continue
+            with self._changed:
+                self._db.execute('DELETE FROM requests WHERE seq = ?', (seq,))
+                self.processed += 1
+                self._depth -= 1
+                self._release(customer_id)
+
+    def _on_failure(self, customer_id, seq, request, attempts, error):
+        if attempts < self.max_attempts:
+            logger.warning("request failed, retrying seq=%d customer_id=%s attempt=%d error=%s", seq, customer_id, attempts, error)
+            # Keep the customer blocked while waiting, so later requests cannot overtake this one.
+            time.sleep(self.retry_delay * attempts)
+            with self._changed:
+                self._db.execute("UPDATE requests SET state = 'pending' WHERE seq = ?", (seq,))
+                self._pending.setdefault(customer_id, deque()).appendleft((seq, request, attempts))
+                self._release(customer_id)
+            return
+        logger.error("request failed permanently seq=%d customer_id=%s attempts=%d error=%s", seq, customer_id, attempts, error)
+        with self._changed:
+            self._db.execute("UPDATE requests SET state = 'failed', error = ? WHERE seq = ?", (f"{type(error).__name__}: {error}", seq))
+            self.failed += 1
+            self._depth -= 1
+            self._release(customer_id)
+
+    def join(self, timeout=None):
+        """Waits until every queued request has been processed or has failed; returns False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._depth == 0, timeout)
+
+    def stop(self, drain=True, timeout=None):
+        """Stops the workers, after processing the queued requests when `drain` is set."""
+        if drain:
+            self.join(timeout)
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def close(self):
+        self.stop(drain=False)
+        self._db.close()
+
+    # --- Inspection ---
+
+    def stats(self):
+        with self._lock:
+            return {'depth': self._depth, 'in_flight': len(self._in_flight), 'customers_waiting': len(self._ready),
+                    'processed': self.processed, 'failed': self.failed}
+
+    def failed_requests(self):
+        """Returns the requests that used up their attempts, as (seq, customer_id, request_details, error)."""
+        with self._lock:
+            rows = self._db.execute("SELECT seq, customer_id, payload, error FROM requests WHERE state = 'failed' ORDER BY seq").fetchall()
+        return [(seq, customer_id, json.loads(payload), error) for seq, customer_id, payload, error in rows]
@@ -0,0 +1,288 @@
+"""
+Sharded deployment of the pilot across worker processes.
+
+Requests are routed by `hotel_id` on a consistent-hash ring, so each worker process
+runs its own Pilot on one core and holds only its hotels' slice of the catalog and
+the profiles of the guests it serves. A busy hotel can be split into several
+partitions by `customer_id`; a guest always lands on the same partition, so their
+requests are processed in order. Adding or removing a worker moves only the hotels
+whose ring segment changed hands; every worker then drops its cached profiles, since
+the guests it had cached may have been served elsewhere in the meantime.
+
+    python -m backend.sharding --workers 4 --requests 200000
+"""
+import argparse
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import time
+import zlib
+
+from backend.models import GuestRequest
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` virtual points per node."""
+
+    def __init__(self, nodes=(), vnodes=64):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        self.nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.vnodes):
+            point = _hash(f'{node}#{replica}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key):
+        """Returns the node owning `key`: the first ring point at or after the key's hash."""
+        if not self._points:
+            raise LookupError("hash ring has no nodes")
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class ShardRouter:
+    """Maps requests to shards: by hotel, and by customer inside hotels with several partitions."""
+
+    def __init__(self, ring, hotel_partitions=None):
+        self.ring = ring
+        self.hotel_partitions = hotel_partitions or {}
+
+    def route_key(self, hotel_id, customer_id):
+        partitions = self.hotel_partitions.get(hotel_id, 1)
+        if partitions == 1:
+            return str(hotel_id)
+        return f'{hotel_id}/{zlib.crc32(str(customer_id).encode()) % partitions}'
+
+    def shard_for(self, hotel_id, customer_id):
+        return self.ring.node_for(self.route_key(hotel_id, customer_id))
+
+    def owns(self, shard, hotel_id):
+        """Returns True if any partition of `hotel_id` is routed to `shard`."""
+        partitions = self.hotel_partitions.get(hotel_id, 1)
+        if partitions == 1:
+            return self.ring.node_for(str(hotel_id)) == shard
+        return any(self.ring.node_for(f'{hotel_id}/{partition}') == shard for partition in range(partitions))
+
+
+def _run_shard(shard, storage_factory, nodes, vnodes, hotel_partitions, inbox, outbox):
+    """Worker process: processes the requests routed to `shard` with its own Pilot."""
+    from backend.hotel_catalog import HotelCatalog
+    from backend.pilot_engine import Pilot
+
+    router = ShardRouter(HashRing(nodes, vnodes), hotel_partitions)
+    storage = storage_factory()
+    catalog = HotelCatalog(storage, hotel_filter=lambda hotel_id: router.owns(shard, hotel_id))
+    pilot = Pilot(storage=storage, hotel_catalog=catalog)
+    processed = failed = 0
+    while True:
+        message = inbox.get()
+        kind = message[0]
+        if kind == 'requests':
+            for customer_id, request_details in message[1]:
+                try:
+                    pilot.process_request(customer_id, request_details)
+                    processed += 1
+                except Exception as e:
+                    failed += 1
+                    logger.error("request failed shard=%s customer_id=%s error=%s", shard, customer_id, e)
+        elif kind == 'assign':
+            router.ring = HashRing(message[1], vnodes)
+            catalog.set_filter(lambda hotel_id: router.owns(shard, hotel_id))
+            # Guests moved to another shard may come back with profiles changed there.
+            pilot.profiles.clear()
+            outbox.put(('assigned', shard, len(catalog)))
+        elif kind == 'sync':
+            outbox.put(('synced', shard, processed, failed))
+        elif kind == 'stop':
+            pilot.writes.close()
+            outbox.put(('stopped', shard, processed, failed))
+            return
+
+
+class ShardedPilot:
+    """
+    Routes requests to a pool of worker processes, each running its own Pilot.
+
+    `storage_factory` is called in every worker to open its storage, so it must be
+    picklable (e.g. `functools.partial(SQLiteStorage, path)`). `hotel_partitions`
+    maps busy hotels to the number of shards their guests are spread over. Requests
+    are sent in batches of `batch_size` to keep IPC overhead low; `flush` sends the
+    partial batches. Workers can be added or removed while running; the pool is
+    drained first, so a guest's requests are never processed by two shards at once.
+    """
+
+    def __init__(self, storage_factory, workers=4, hotel_partitions=None, vnodes=64, batch_size=64, queue_size=1000):
+        self.storage_factory = storage_factory
+        self.vnodes = vnodes
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.router = ShardRouter(HashRing(vnodes=vnodes), hotel_partitions)
+        self._context = multiprocessing.get_context('spawn')
+        self._outbox = self._context.Queue()
+        self._shards = {}
+        self._buffers = {}
+        self._next_index = 0
+        for _ in range(workers):
+            self.router.ring.add_node(self._new_shard_name())
+
+    def _new_shard_name(self):
+        name = f'shard-{self._next_index}'
+        self._next_index += 1
+        return name
+
+    def _spawn(self, shard):
+        inbox = self._context.Queue(self.queue_size)
+        process = self._context.Process(
+            target=_run_shard, name=shard, daemon=True,
+            args=(shard, self.storage_factory, list(self.router.ring.nodes), self.vnodes,
+                  self.router.hotel_partitions, inbox, self._outbox)
+        )
+        process.start()
+        self._shards[shard] = (process, inbox)
+        self._buffers[shard] = []
+
+    def start(self):
+        for shard in self.router.ring.nodes:
+            self._spawn(shard)
+
+    def process_request(self, customer_id, request_details):
+        """Queues a request (a dict or GuestRequest) on its shard; blocks while that shard's queue is full."""
+        hotel_id = request_details.hotel_id if isinstance(request_details, GuestRequest) else request_details.get('hotel_id')
+        shard = self.router.shard_for(hotel_id, customer_id)
+        buffer = self._buffers[shard]
+        buffer.append((customer_id, request_details))
+        if len(buffer) >= self.batch_size:
+            self._send(shard)
+
+    def _send(self, shard):
+        buffer = self._buffers[shard]
+        if buffer:
+            self._shards[shard][1].put(('requests', buffer))
+            self._buffers[shard] = []
+
+    def flush(self):
+        for shard in self._shards:
+            self._send(shard)
+
+    def _collect(self, kind, count):
+        replies = {}
+        while len(replies) < count:
+            message = self._outbox.get()
+            if message[0] == kind:
+                replies[message[1]] = message[2:]
+        return replies
+
+    def drain(self):
+        """Waits until every request sent so far has been processed; returns {shard: (processed, failed)}."""
+        self.flush()
+        for _, inbox in self._shards.values():
+            inbox.put(('sync',))
+        return self._collect('synced', len(self._shards))
+
+    def _reassign(self):
+        nodes = list(self.router.ring.nodes)
+        for shard, (_, inbox) in self._shards.items():
+            inbox.put(('assign', nodes))
+        return self._collect('assigned', len(self._shards))
+
+    def add_worker(self):
+        """Starts one more worker and moves the hotels it now owns onto it."""
+        self.drain()
+        shard = self._new_shard_name()
+        self.router.ring.add_node(shard)
+        self._spawn(shard)
+        hotels = self._reassign()
+        logger.info("shard added shard=%s hotels_per_shard=%s", shard, hotels)
+        return shard
+
+    def remove_worker(self, shard=None):
+        """Stops a worker (the newest by default) and hands its hotels to the others."""
+        shard = shard or self.router.ring.nodes[-1]
+        self.drain()
+        self.router.ring.remove_node(shard)
+        process, inbox = self._shards.pop(shard)
+        self._buffers.pop(shard)
+        inbox.put(('stop',))
+        self._collect('stopped', 1)
+        process.join()
+        hotels = self._reassign()
+        logger.info("shard removed shard=%s hotels_per_shard=%s", shard, hotels)
+
+    def stop(self):
+        """Processes the remaining requests and stops all workers; returns {shard: (processed, failed)}."""
+        self.flush()
+        for _, inbox in self._shards.values():
+            inbox.put(('stop',))
+        totals = self._collect('stopped', len(self._shards))
+        for process, _ in self._shards.values():
+            process.join()
+        self._shards = {}
+        return totals
+
+
+def _benchmark_storage(num_hotels):
+    """Per-worker in-memory storage with the benchmark hotels (CPU-bound scaling runs)."""
+    from backend.storage import MemoryStorage
+    storage = MemoryStorage()
+    for i in range(1, num_hotels + 1):
+        storage.collection('hotels').document(f'hotel_{i}').set({'hotel_id': f'hotel_{i}', 'name': f'Hotel #{i}', 'class': 'mid'})
+    return storage
+
+
+def main():
+    import functools
+    import random
+
+    from backend.metrics import configure_logging
+    from backend.simulator.simulate_clients import REQUEST_TEMPLATES
+
+    parser = argparse.ArgumentParser(description='Measure sharded pilot throughput.')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--hotels', type=int, default=64)
+    parser.add_argument('--customers', type=int, default=20000)
+    args = parser.parse_args()
+    configure_logging()
+
+    rng = random.Random(42)
+    workload = [(f'guest_{rng.randrange(args.customers)}', dict(rng.choice(REQUEST_TEMPLATES), hotel_id=f'hotel_{rng.randint(1, args.hotels)}'))
+                for _ in range(args.requests)]
+    pilot = ShardedPilot(functools.partial(_benchmark_storage, args.hotels), workers=args.workers)
+    pilot.start()
+    pilot.drain()
+    started = time.perf_counter()
+    for customer_id, request_details in workload:
+        pilot.process_request(customer_id, request_details)
+    pilot.drain()
+    elapsed = time.perf_counter() - started
+    totals = pilot.stop()
+    print(f"{args.workers} workers: {args.requests / elapsed:.0f} req/s, per shard {sorted(processed for processed, _ in totals.values())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,222 @@
+"""
+Open-loop load generator for the Pilot engine.
+
+Simulated guests send requests on a Poisson arrival schedule (or a replayed trace)
+that does not wait for earlier requests to finish, so a slow engine shows up as
+queueing latency instead of a slower offered load. Requests are spread over a pool
+of worker processes, each running its own Pilot against a shared storage backend;
+a guest's requests always go to the same worker. After the run, token balances in
+storage are checked against a sequential reference run of the same schedule.
+
+    python -m backend.simulator.simulate_clients --guests 5000 --rate 500 --duration 30 --processes 4
+    python -m backend.simulator.simulate_clients --trace checkin_burst.jsonl
+"""
+import argparse
+import json
+import multiprocessing
+import os
 import random
 import time
+import zlib
+
+from backend.benchmarks.pilot_benchmark import summarize
 from backend.pilot_engine import Pilot
+from backend.storage import MemoryStorage, SQLiteStorage, firestore_storage
 
-pilot_engine = Pilot()
-
-clients = [
-    {
-        'id': f'client_{i:03d}',
-        'name': f'Client {chr(65 + i)}',
-        'hotel_id': f'hotel_{random.randint(1, 15)}',
-        'is_diabetic': random.choice([True, False]),
-        'is_asthmatic': random.choice([True, False]),
-        'requests': [
-            {'type': 'query', 'query': 'Could you please help with a wifi issue?'},
-            {'type': 'review', 'query': 'The housekeeping service was excellent, thank you!'},
-            {'type': 'query', 'query': 'I need a diabetic-friendly meal plan for my stay.'},
-            {'type': 'query', 'query': 'I would like to opt out of daily linen changes for 3 days.', 'duration_days': 3},
-            {'type': 'query', 'query': 'I am an asthmatic. I need a room away from allergens.'},
-            {'type': 'buzzer_request', 'query': 'Can I get some fresh towels?'},
-            {'type': 'review', 'query': 'The service was terribly slow.'}
-        ]
-    } for i in range(100)
+GENERAL_TEMPLATES = [
+    {'type': 'query', 'query': 'Could you please help with a wifi issue?'},
+    {'type': 'review', 'query': 'The housekeeping service was excellent, thank you!'},
+    {'type': 'query', 'query': 'I would like to opt out of daily linen changes for 3 days.', 'duration_days': 3},
+    {'type': 'buzzer_request', 'query': 'Can I get some fresh towels?'},
+    {'type': 'review', 'query': 'The service was terribly slow.'}
+]
+# Requests only guests with the condition in the first field send.
+MEDICAL_TEMPLATES = [
+    ('is_diabetic', {'type': 'query', 'query': 'I need a diabetic-friendly meal plan for my stay.'}),
+    ('is_asthmatic', {'type': 'query', 'query': 'I am an asthmatic. I need a room away from allergens.'})
 ]
+REQUEST_TEMPLATES = GENERAL_TEMPLATES + [template for _, template in MEDICAL_TEMPLATES]
+
+
+def generate_guests(num_guests, num_hotels, rng, run_id):
+    """Creates the simulated guest population; about one guest in ten is diabetic, and one in ten asthmatic."""
+    return [
+        {
+            'id': f'{run_id}_client_{i:06d}',
+            'hotel_id': f'hotel_{rng.randint(1, num_hotels)}',
+            'is_diabetic': rng.random() < 0.1,
+            'is_asthmatic': rng.random() < 0.1
+        } for i in range(num_guests)
+    ]
+
+
+def guest_request(guest, rng, medical_share=0.3):
+    """
+    Picks a guest's next request: about `medical_share` of the requests of a guest with a
+    medical condition are about it, and other guests never send medical requests.
+    """
+    conditions = [template for flag, template in MEDICAL_TEMPLATES if guest[flag]]
+    if conditions and rng.random() < medical_share:
+        request = dict(rng.choice(conditions))
+    else:
+        request = dict(rng.choice(GENERAL_TEMPLATES))
+    request['hotel_id'] = guest['hotel_id']
+    return request
+
+
+def poisson_schedule(guests, rate, duration, rng):
+    """Returns [(send_at_seconds, customer_id, request_details)] with exponential inter-arrival times."""
+    schedule = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        guest = rng.choice(guests)
+        request = guest_request(guest, rng)
+        schedule.append((t, guest['id'], request))
+        t += rng.expovariate(rate)
+    return schedule
+
+
+def trace_schedule(trace_path, run_id):
+    """Reads a JSON-lines trace of {"t": seconds, "customer_id": ..., "hotel_id": ..., "query": ...} records."""
+    schedule = []
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                send_at = record.pop('t')
+                customer_id = f"{run_id}_{record.pop('customer_id')}"
+                schedule.append((send_at, customer_id, record))
+    schedule.sort(key=lambda entry: entry[0])
+    return schedule
+
+
+def open_storage(spec):
+    kind, path = spec
+    if kind == 'sqlite':
+        return SQLiteStorage(path)
+    return firestore_storage()
+
+
+def run_worker(storage_spec, start_at, schedule):
+    """Sends one worker's share of the schedule; returns per-request latencies and errors."""
+    latencies, errors = [], []
+    pilot = Pilot(storage=open_storage(storage_spec))
+    pilot.hotels.load()
+    for send_at, customer_id, request_details in schedule:
+        scheduled = start_at + send_at
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            pilot.process_request(customer_id, dict(request_details))
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        # Measured from the scheduled send time, so falling behind counts as latency.
+        latencies.append(time.time() - scheduled)
+    return latencies, errors
+
+
+def expected_tokens(schedule, hotels):
+    """Replays the schedule sequentially on in-memory storage to get each guest's expected token balance."""
+    storage = MemoryStorage()
+    for hotel_id, hotel in hotels.items():
+        storage.collection('hotels').document(hotel_id).set(hotel)
+    pilot = Pilot(storage=storage)
+    for _, customer_id, request_details in schedule:
+        pilot.process_request(customer_id, dict(request_details))
+    return {doc.id: doc.to_dict().get('tokens', 0) for doc in storage.collection('customers').stream()}
+
+
+def verify_tokens(storage, expected):
+    """Returns the guests whose stored token balance differs from the expected one."""
+    mismatches = {}
+    for customer_id, tokens in expected.items():
+        doc = storage.collection('customers').document(customer_id).get()
+        actual = doc.to_dict().get('tokens', 0) if doc.exists else None
+        if actual != tokens:
+            mismatches[customer_id] = {'expected': tokens, 'actual': actual}
+    return mismatches
+
+
+def simulate_client_interactions(guests=1000, hotels=15, rate=100.0, duration=10.0, processes=4, seed=42,
+                                 trace=None, storage='sqlite', sqlite_path='simulation.db'):
+    """Runs the simulation and returns a summary of throughput, latency, errors and token consistency."""
+    rng = random.Random(seed)
+    run_id = f"sim{int(time.time())}"
+    hotel_docs = {f'hotel_{i}': {'hotel_id': f'hotel_{i}', 'name': f'Simulated Hotel #{i}'} for i in range(1, hotels + 1)}
+
+    if storage == 'sqlite':
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+        storage_spec = ('sqlite', sqlite_path)
+    else:
+        storage_spec = ('firestore', None)
+    shared_storage = open_storage(storage_spec)
+    batch = shared_storage.batch()
+    for hotel_id, hotel in hotel_docs.items():
+        batch.set(shared_storage.collection('hotels').document(hotel_id), hotel)
+    batch.commit()
+
+    if trace:
+        schedule = trace_schedule(trace, run_id)
+    else:
+        schedule = poisson_schedule(generate_guests(guests, hotels, rng, run_id), rate, duration, rng)
+    print(f"Simulating {len(schedule)} requests over {processes} worker processes...")
+
+    # Pin each guest to one worker so their requests are applied in order.
+    shards = [[] for _ in range(processes)]
+    for entry in schedule:
+        shards[zlib.crc32(entry[1].encode()) % processes].append(entry)
+
+    start_at = time.time() + 1.0  # give the workers time to start
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(run_worker, [(storage_spec, start_at, shard) for shard in shards])
+    elapsed = time.time() - start_at
+
+    latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+    errors = [error for _, worker_errors in results for error in worker_errors]
+    mismatches = verify_tokens(shared_storage, expected_tokens(schedule, hotel_docs))
+
+    summary = summarize(latencies, elapsed)
+    summary.update({
+        'offered_rate': len(schedule) / (schedule[-1][0] if schedule else 1),
+        'errors': len(errors),
+        'error_rate': len(errors) / len(schedule) if schedule else 0.0,
+        'sample_errors': errors[:5],
+        'token_mismatches': len(mismatches),
+        'sample_token_mismatches': dict(list(mismatches.items())[:5])
+    })
+    return summary
+
 
-def simulate_client_interactions():
-    """Simulates each client making one or more requests to the pilot engine."""
-    print("Starting client interaction simulation...")
-    for client in clients:
-        customer_id = client['id']
-        hotel_id = client['hotel_id']
-        requests_to_make = random.sample(client['requests'], random.randint(1, len(client['requests'])))
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load generator for the Pilot engine.')
+    parser.add_argument('--guests', type=int, default=1000)
+    parser.add_argument('--hotels', type=int, default=15)
+    parser.add_argument('--rate', type=float, default=100.0, help='mean arrivals per second (Poisson)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of arrivals to generate')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trace', help='replay a JSON-lines arrival trace instead of Poisson arrivals')
+    parser.add_argument('--storage', choices=['sqlite', 'firestore'], default='sqlite')
+    parser.add_argument('--sqlite-path', default='simulation.db')
+    parser.add_argument('--output', help='write the summary to this JSON file')
+    args = parser.parse_args()
 
-        for request in requests_to_make:
-            request['hotel_id'] = hotel_id
-            print(f"\n--- Simulating request from {client['name']} (ID: {customer_id}) at Hotel {hotel_id} ---")
-            pilot_engine.process_request(customer_id, request)
-            time.sleep(1) # Pause to simulate a real-world delay
+    summary = simulate_client_interactions(args.guests, args.hotels, args.rate, args.duration, args.processes,
+                                           args.seed, args.trace, args.storage, args.sqlite_path)
+    print(f"Completed {summary['count']} requests: {summary['requests_per_sec']:.1f} req/s "
+          f"(offered {summary['offered_rate']:.1f}), p50 {summary['p50_ms']:.2f} ms, "
+          f"p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms")
+    print(f"Errors: {summary['errors']} ({summary['error_rate']:.2%})")
+    if summary['token_mismatches']:
+        print(f"Token check FAILED for {summary['token_mismatches']} guests, e.g. {summary['sample_token_mismatches']}")
+    else:
+        print("Token check passed: stored balances match the rewards the workload should have produced.")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
 
-    print("\nSimulation complete. All client requests have been processed.")
 
 if __name__ == '__main__':
-    simulate_client_interactions()
+    main()
@@ -0,0 +1,568 @@
+"""
+Storage backends for the pilot engine.
+
+The engine talks to storage through the small slice of the Firestore client API it
+actually uses: collection streams, document get/set/create/update/delete, `add`,
+write batches, and the `Increment`, `ArrayUnion` and `SERVER_TIMESTAMP` transforms.
+MemoryStorage and SQLiteStorage implement that slice locally with the same
+semantics (atomic batches, `update` failing on missing documents, `create` failing
+on existing ones), so the engine can be run and benchmarked without a Firebase
+project. FirestoreStorage adapts a real (sync or async) Firestore client.
+
+The Firebase Admin SDK is only imported, and the Firestore client only created, when
+a FirestoreStorage is first used, so importing the engine and constructing a Pilot
+stay cheap. Clients come from `firestore_client`, which creates one of each kind per
+process.
+"""
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+# Replace with your service account key file, or set ECO_PILOT_CREDENTIALS.
+DEFAULT_CREDENTIALS_PATH = r"C:\Users\user\OneDrive\Documents\Hackathon_project\Eco-Pilot-Platform\backend\eco-pilot-realtime-firebase-adminsdk.json"
+
+
+class AlreadyExists(Exception):
+    """Raised when creating a document that already exists."""
+
+
+class NotFound(Exception):
+    """Raised when updating a document that does not exist."""
+
+
+class Increment:
+    """Adds `value` to a numeric field (missing or non-numeric fields count as 0)."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Increment) and other.value == self.value
+
+    def __repr__(self):
+        return f"Increment({self.value!r})"
+
+
+class ArrayUnion:
+    """Appends the given values to an array field, skipping values already present."""
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayUnion) and other.values == self.values
+
+    def __repr__(self):
+        return f"ArrayUnion({self.values!r})"
+
+
+class _ServerTimestamp:
+    def __repr__(self):
+        return 'SERVER_TIMESTAMP'
+
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+def _copy(value):
+    """Copies JSON-like document data; much cheaper than copy.deepcopy."""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _resolve(value, current, now):
+    """Returns the stored value for `value` written over `current`, applying transforms."""
+    if value is SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(_copy(item))
+        return result
+    if isinstance(value, dict):
+        return {key: _resolve(item, None, now) for key, item in value.items()}
+    return _copy(value)
+
+
+def _merge(current, data, now):
+    merged = dict(current)
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value, now)
+        else:
+            merged[key] = _resolve(value, merged.get(key), now)
+    return merged
+
+
+def _apply(current, op, now):
+    """Returns the document data after applying a write op to `current` (None = no document)."""
+    kind, ref, data = op[0], op[1], op[2]
+    if kind == 'create':
+        if current is not None:
+            raise AlreadyExists(f"Document already exists: {ref.path}")
+        return _resolve(data, None, now)
+    if kind == 'set':
+        if op[3] and current is not None:
+            return _merge(current, data, now)
+        return _resolve(data, None, now)
+    if kind == 'update':
+        if current is None:
+            raise NotFound(f"No document to update: {ref.path}")
+        updated = _copy(current)
+        for field_path, value in data.items():
+            *parents, leaf = field_path.split('.')
+            target = updated
+            for part in parents:
+                if not isinstance(target.get(part), dict):
+                    target[part] = {}
+                target = target[part]
+            target[leaf] = _resolve(value, target.get(leaf), now)
+        return updated
+    return None  # delete
+
+
+class DocumentSnapshot:
+    """Result of reading a document."""
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return _copy(self._data) if self.exists else None
+
+
+class DocumentReference:
+    def __init__(self, storage, collection_path, document_id):
+        self._storage = storage
+        self._collection_path = collection_path
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    def collection(self, name):
+        return CollectionReference(self._storage, f"{self.path}/{name}")
+
+    def get(self):
+        return DocumentSnapshot(self, self._storage._read(self._collection_path, self.id))
+
+    def set(self, document_data, merge=False):
+        self._storage._commit([('set', self, document_data, merge)])
+
+    def create(self, document_data):
+        self._storage._commit([('create', self, document_data)])
+
+    def update(self, field_updates):
+        self._storage._commit([('update', self, field_updates)])
+
+    def delete(self):
+        self._storage._commit([('delete', self, None)])
+
+
+class CollectionReference:
+    def __init__(self, storage, path):
+        self._storage = storage
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._storage, self.path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        """Creates a document and returns (write_time, reference), like the Firestore client."""
+        doc_ref = self.document(document_id)
+        doc_ref.create(document_data)
+        return datetime.datetime.now(datetime.timezone.utc), doc_ref
+
+    def stream(self):
+        """Yields a snapshot per document, ordered by document ID."""
+        for document_id, data in self._storage._list(self.path):
+            yield DocumentSnapshot(self.document(document_id), data)
+
+
+class WriteBatch:
+    """Writes applied together when committed: either all of them or none."""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._ops = []
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(('set', reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._ops.append(('create', reference, document_data))
+
+    def update(self, reference, field_updates):
+        self._ops.append(('update', reference, field_updates))
+
+    def delete(self, reference):
+        self._ops.append(('delete', reference, None))
+
+    def commit(self):
+        ops, self._ops = self._ops, []
+        self._storage._commit(ops)
+
+
+class _LocalStorage:
+    """Shared implementation of the Firestore-like API over `_read`, `_list` and `_commit`."""
+
+    Increment = Increment
+    ArrayUnion = ArrayUnion
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    AlreadyExists = AlreadyExists
+    NotFound = NotFound
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def document(self, path):
+        collection_path, document_id = path.rsplit('/', 1)
+        return DocumentReference(self, collection_path, document_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def _apply_ops(self, ops, read):
+        """Applies ops in order on top of `read(collection, id)`; returns {(collection, id): data}."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        staged = {}
+        for op in ops:
+            ref = op[1]
+            key = (ref._collection_path, ref.id)
+            current = staged[key] if key in staged else read(*key)
+            staged[key] = _apply(current, op, now)
+        return staged
+
+
+class MemoryStorage(_LocalStorage):
+    """Keeps every collection in process memory."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._collections = {}
+
+    @property
+    def identity(self):
+        """Identifies the database written to, e.g. for manifests of what was loaded where."""
+        return f'memory:{id(self):x}'
+
+    # Stored documents are never modified in place (every write stores new data), so
+    # reads can hand them out directly; snapshots copy them in to_dict().
+
+    def _read(self, collection_path, document_id):
+        with self._lock:
+            self.reads += 1
+            return self._collections.get(collection_path, {}).get(document_id)
+
+    def _list(self, collection_path):
+        with self._lock:
+            documents = self._collections.get(collection_path, {})
+            self.reads += len(documents)
+            return [(document_id, documents[document_id]) for document_id in sorted(documents)]
+
+    def _commit(self, ops):
+        with self._lock:
+            staged = self._apply_ops(ops, lambda path, document_id: self._collections.get(path, {}).get(document_id))
+            for (path, document_id), data in staged.items():
+                if data is None:
+                    self._collections.get(path, {}).pop(document_id, None)
+                else:
+                    self._collections.setdefault(path, {})[document_id] = data
+            self.writes += len(ops)
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class SQLiteStorage(_LocalStorage):
+    """
+    Stores documents as JSON rows in a SQLite database.
+
+    Each commit runs in a `BEGIN IMMEDIATE` transaction, so several processes can
+    share one database file and still get atomic batches and race-free increments.
+    """
+
+    def __init__(self, path=':memory:', timeout=30):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # An in-memory database only exists on its own connection, so all threads share one.
+        self._shared = self._connect() if path == ':memory:' else None
+        self._shared_lock = threading.Lock()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS documents ('
+                ' collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL,'
+                ' PRIMARY KEY (collection, id))'
+            )
+
+    @property
+    def identity(self):
+        """Identifies the database written to, e.g. for manifests of what was loaded where."""
+        if self.path == ':memory:':
+            return f'sqlite:memory:{id(self):x}'
+        return f'sqlite:{os.path.abspath(self.path)}'
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        if self.path != ':memory:':
+            connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    @contextmanager
+    def _connection(self):
+        if self._shared is not None:
+            with self._shared_lock:
+                yield self._shared
+            return
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        yield connection
+
+    def _read(self, collection_path, document_id):
+        self.reads += 1
+        with self._connection() as connection:
+            row = connection.execute('SELECT data FROM documents WHERE collection = ? AND id = ?', (collection_path, document_id)).fetchone()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def _list(self, collection_path):
+        with self._connection() as connection:
+            rows = connection.execute('SELECT id, data FROM documents WHERE collection = ? ORDER BY id', (collection_path,)).fetchall()
+        self.reads += len(rows)
+        return [(document_id, json.loads(data, object_hook=_decode)) for document_id, data in rows]
+
+    def _commit(self, ops):
+        with self._connection() as connection:
+            self._commit_transaction(connection, ops)
+        self.writes += len(ops)
+
+    def _commit_transaction(self, connection, ops):
+        def read(path, document_id):
+            row = connection.execute('SELECT data FROM documents WHERE collection = ? AND id = ?', (path, document_id)).fetchone()
+            return json.loads(row[0], object_hook=_decode) if row else None
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            staged = self._apply_ops(ops, read)
+            for (path, document_id), data in staged.items():
+                if data is None:
+                    connection.execute('DELETE FROM documents WHERE collection = ? AND id = ?', (path, document_id))
+                else:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)',
+                        (path, document_id, json.dumps(data, default=_encode))
+                    )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+
+class FirestoreStorage:
+    """
+    Adapts a google.cloud.firestore client to the storage interface.
+
+    Works with both the sync and the async client: transforms are translated to
+    their Firestore equivalents as writes are issued, and results (or coroutines,
+    for the async client) are passed through unchanged. Given a `client_factory`
+    instead of a client, the client is created on first use.
+    """
+
+    Increment = Increment
+    ArrayUnion = ArrayUnion
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+
+    def __init__(self, client=None, client_factory=None):
+        if client is None and client_factory is None:
+            raise ValueError("FirestoreStorage needs a client or a client_factory")
+        self._client = client
+        self._client_factory = client_factory
+        self._lock = threading.Lock()
+        self._firestore = None
+        self._exceptions = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        if self._firestore is None:
+            self._load_sdk()
+        return self._client
+
+    def _load_sdk(self):
+        from google.api_core import exceptions
+        from google.cloud import firestore
+        self._exceptions = exceptions
+        self._firestore = firestore
+
+    @property
+    def AlreadyExists(self):
+        if self._exceptions is None:
+            self._load_sdk()
+        return self._exceptions.AlreadyExists
+
+    @property
+    def NotFound(self):
+        if self._exceptions is None:
+            self._load_sdk()
+        return self._exceptions.NotFound
+
+    @property
+    def identity(self):
+        """Identifies the database written to, e.g. for manifests of what was loaded where."""
+        client = self.client
+        return f'firestore:{client.project}/{client._database}'
+
+    def sync_storage(self):
+        """Returns a FirestoreStorage over a sync client to the same project and database, created on first use."""
+        def client_factory():
+            client = self.client
+            if not isinstance(client, self._firestore.AsyncClient):
+                return client
+            return self._firestore.Client(project=client.project, credentials=client._credentials, database=client._database)
+        return FirestoreStorage(client_factory=client_factory)
+
+    def collection(self, path):
+        return _FirestoreCollection(self, self.client.collection(path))
+
+    def document(self, path):
+        return _FirestoreDocument(self, self.client.document(path))
+
+    def batch(self):
+        return _FirestoreBatch(self, self.client.batch())
+
+    def _translate(self, value):
+        if value is SERVER_TIMESTAMP:
+            return self._firestore.SERVER_TIMESTAMP
+        if isinstance(value, Increment):
+            return self._firestore.Increment(value.value)
+        if isinstance(value, ArrayUnion):
+            return self._firestore.ArrayUnion(value.values)
+        if isinstance(value, dict):
+            return {key: self._translate(item) for key, item in value.items()}
+        return value
+
+
+class _FirestoreCollection:
+    def __init__(self, storage, native):
+        self._storage = storage
+        self._native = native
+
+    def document(self, document_id=None):
+        return _FirestoreDocument(self._storage, self._native.document(document_id) if document_id else self._native.document())
+
+    def add(self, document_data, document_id=None):
+        return self._native.add(self._storage._translate(document_data), document_id=document_id)
+
+    def __getattr__(self, name):
+        # stream(), on_snapshot(), queries and the rest go straight to the client.
+        return getattr(self._native, name)
+
+
+class _FirestoreDocument:
+    def __init__(self, storage, native):
+        self._storage = storage
+        self._native = native
+
+    def collection(self, name):
+        return _FirestoreCollection(self._storage, self._native.collection(name))
+
+    def set(self, document_data, merge=False):
+        return self._native.set(self._storage._translate(document_data), merge=merge)
+
+    def create(self, document_data):
+        return self._native.create(self._storage._translate(document_data))
+
+    def update(self, field_updates):
+        return self._native.update(self._storage._translate(field_updates))
+
+    def __getattr__(self, name):
+        return getattr(self._native, name)
+
+
+class _FirestoreBatch:
+    def __init__(self, storage, native):
+        self._storage = storage
+        self._native = native
+
+    def set(self, reference, document_data, merge=False):
+        self._native.set(reference._native, self._storage._translate(document_data), merge=merge)
+
+    def create(self, reference, document_data):
+        self._native.create(reference._native, self._storage._translate(document_data))
+
+    def update(self, reference, field_updates):
+        self._native.update(reference._native, self._storage._translate(field_updates))
+
+    def delete(self, reference):
+        self._native.delete(reference._native)
+
+    def commit(self):
+        return self._native.commit()
+
+
+_client_lock = threading.Lock()
+_clients = {}
+
+
+def firestore_client(credentials_path=None, use_async=False):
+    """
+    Returns this process's Firestore client (sync or async), initializing the Firebase
+    Admin SDK from `credentials_path` (default: ECO_PILOT_CREDENTIALS) on the first call.
+    """
+    client = _clients.get(use_async)
+    if client is not None:
+        return client
+    with _client_lock:
+        if use_async not in _clients:
+            import firebase_admin
+            from firebase_admin import credentials, firestore, firestore_async
+            if not firebase_admin._apps:
+                credentials_path = credentials_path or os.environ.get('ECO_PILOT_CREDENTIALS', DEFAULT_CREDENTIALS_PATH)
+                firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+            _clients[use_async] = firestore_async.client() if use_async else firestore.client()
+        return _clients[use_async]
+
+
+def firestore_storage(credentials_path=None, use_async=False):
+    """Returns a FirestoreStorage over the process's shared client, which is created on first use."""
+    return FirestoreStorage(client_factory=lambda: firestore_client(credentials_path, use_async))
@@ -0,0 +1,255 @@
+import bisect
+import logging
+import threading
+
+from backend.models import Priority, StaffTask, TaskStatus
+from backend.storage import SERVER_TIMESTAMP
+
+logger = logging.getLogger(__name__)
+
+_PRIORITY_RANKS = {priority: rank for rank, priority in enumerate(Priority)}
+
+
+def _rank(priority):
+    # Critical first; priorities written by other clients come after Low.
+    return (_PRIORITY_RANKS.get(priority, len(_PRIORITY_RANKS)), str(priority))
+
+
+def _changed(task, data):
+    """True if a stored task document differs from the board's task in a field the board indexes or returns."""
+    if task is None:
+        return data.get('status', TaskStatus.PENDING) != TaskStatus.COMPLETED
+    get = data.get
+    return (get('status', TaskStatus.PENDING) != task.status or get('priority') != task.priority or get('role') != task.role
+            or get('hotel_id') != task.hotel_id or get('timestamp') != task.timestamp
+            or get('assigned_to') != task.assigned_to or get('description', '') != task.description)
+
+
+def _order_key(task):
+    timestamp = task.timestamp
+    return (timestamp.timestamp() if hasattr(timestamp, 'timestamp') else 0.0, task.id)
+
+
+class TaskBoard:
+    """
+    In-memory index of the open tasks in the 'tasks' collection, for staff dashboards.
+
+    Pending tasks are indexed by (hotel_id, role, priority), each list ordered by
+    timestamp, so `next_tasks` returns a page in O(log n + page size) instead of
+    scanning the collection. The collection is read once on the first query; after
+    that a Firestore `on_snapshot` listener (or, when listening is unavailable, a
+    thread polling every `poll_interval` seconds) applies added, modified and
+    removed tasks as they arrive. `claim` and `complete` write the task's new status
+    and update the index right away. Claims are not transactional, so a task should
+    be claimed through one board.
+    """
+
+    def __init__(self, db, collection='tasks', live=True, poll_interval=30, load_timeout=30):
+        self.db = db
+        self.collection = collection
+        self.live = live
+        self.poll_interval = poll_interval
+        self.load_timeout = load_timeout
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._stopped = threading.Event()
+        self._watch = None
+        self._poller = None
+        # task_id -> StaffTask, for pending and claimed tasks.
+        self._tasks = {}
+        # (hotel_id, role) -> {priority: [(timestamp, task_id), ...] sorted}, pending tasks only.
+        self._pending = {}
+
+    # --- Queries ---
+
+    def next_tasks(self, hotel_id, role, limit=20, priority=None, cursor=None):
+        """
+        Returns (tasks, next_cursor): up to `limit` pending tasks for `role` at
+        `hotel_id`, most urgent priority first and oldest first within a priority.
+        Pass `next_cursor` back to get the following page; it is None after the last
+        page. The returned StaffTasks are shared and must be treated as read-only.
+        """
+        self.load()
+        page = []
+        with self._lock:
+            by_priority = self._pending.get((hotel_id, role))
+            if not by_priority:
+                return [], None
+            for level in sorted(by_priority if priority is None else [priority], key=_rank):
+                rank = _rank(level)
+                if cursor is not None and rank < cursor[0]:
+                    continue
+                entries = by_priority.get(level, ())
+                start = bisect.bisect_right(entries, cursor[1]) if cursor is not None and rank == cursor[0] else 0
+                page.extend((rank, entry) for entry in entries[start:start + limit - len(page)])
+                if len(page) >= limit:
+                    break
+            tasks = [self._tasks[task_id] for _, (_, task_id) in page]
+        return tasks, (page[-1] if len(page) >= limit else None)
+
+    def get(self, task_id):
+        """Returns the pending or claimed task with this ID, or None."""
+        self.load()
+        return self._tasks.get(task_id)
+
+    def counts(self, hotel_id):
+        """Returns {role: {priority: pending tasks}} for a hotel."""
+        self.load()
+        with self._lock:
+            return {role: {priority: len(entries) for priority, entries in by_priority.items()}
+                    for (task_hotel, role), by_priority in self._pending.items() if task_hotel == hotel_id}
+
+    # --- Transitions ---
+
+    def claim(self, task_id, staff_id):
+        """Assigns a pending task to `staff_id`; returns the task, or None if it is not pending."""
+        self.load()
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.status != TaskStatus.PENDING:
+                return None
+            self._unindex(task)
+            task.status = TaskStatus.CLAIMED
+            task.assigned_to = staff_id
+        try:
+            self._document(task_id).update({'status': TaskStatus.CLAIMED.value, 'assigned_to': staff_id, 'claimed_at': SERVER_TIMESTAMP})
+        except Exception:
+            with self._lock:
+                task.status = TaskStatus.PENDING
+                task.assigned_to = None
+                self._index(task)
+            raise
+        return task
+
+    def complete(self, task_id):
+        """Marks a pending or claimed task completed and drops it from the board; returns False if unknown."""
+        self.load()
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return False
+            if task.status == TaskStatus.PENDING:
+                self._unindex(task)
+        try:
+            self._document(task_id).update({'status': TaskStatus.COMPLETED.value, 'completed_at': SERVER_TIMESTAMP})
+        except Exception:
+            with self._lock:
+                self._tasks[task_id] = task
+                if task.status == TaskStatus.PENDING:
+                    self._index(task)
+            raise
+        task.status = TaskStatus.COMPLETED
+        return True
+
+    def _document(self, task_id):
+        return self.db.collection(self.collection).document(task_id)
+
+    # --- Index maintenance ---
+
+    def _index(self, task):
+        by_priority = self._pending.setdefault((task.hotel_id, task.role), {})
+        bisect.insort(by_priority.setdefault(task.priority, []), _order_key(task))
+
+    def _unindex(self, task):
+        key = (task.hotel_id, task.role)
+        entries = self._pending[key][task.priority]
+        del entries[bisect.bisect_left(entries, _order_key(task))]
+        if not entries:
+            del self._pending[key][task.priority]
+            if not self._pending[key]:
+                del self._pending[key]
+
+    def apply_changes(self, upserts=None, removed=()):
+        """Applies added or modified task documents ({task_id: data}) and removed task IDs."""
+        with self._lock:
+            for task_id in removed:
+                self._drop(task_id)
+            for task_id, data in (upserts or {}).items():
+                self._drop(task_id)
+                if data.get('status') == TaskStatus.COMPLETED:
+                    continue
+                task = self._tasks[task_id] = StaffTask.from_firestore(data, task_id)
+                if task.status == TaskStatus.PENDING:
+                    self._index(task)
+
+    def _drop(self, task_id):
+        task = self._tasks.pop(task_id, None)
+        if task is not None and task.status == TaskStatus.PENDING:
+            self._unindex(task)
+
+    # --- Loading and synchronization ---
+
+    def load(self):
+        """Reads the open tasks if they have not been read yet, then starts following changes."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            if not (self.live and self._start_listener()):
+                self.refresh()
+                if self.live:
+                    self._start_poller()
+            self._loaded = True
+
+    def refresh(self):
+        """Re-reads the whole collection and applies the differences to the board."""
+        try:
+            latest = {doc.id: doc.to_dict() for doc in self.db.collection(self.collection).stream()}
+        except Exception as e:
+            logger.error("error fetching tasks: %s", e)
+            return
+        with self._lock:
+            removed = [task_id for task_id in self._tasks if task_id not in latest]
+            # Only new and changed tasks are decoded and re-indexed.
+            upserts = {task_id: data for task_id, data in latest.items() if _changed(self._tasks.get(task_id), data)}
+        self.apply_changes(upserts, removed)
+
+    def _start_listener(self):
+        collection = self.db.collection(self.collection)
+        if not hasattr(collection, 'on_snapshot'):
+            return False
+        synced = threading.Event()
+
+        def on_snapshot(docs, changes, read_time):
+            upserts, removed = {}, []
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    removed.append(change.document.id)
+                else:
+                    upserts[change.document.id] = change.document.to_dict()
+            self.apply_changes(upserts, removed)
+            synced.set()
+
+        try:
+            self._watch = collection.on_snapshot(on_snapshot)
+        except Exception as e:
+            logger.warning("task listener unavailable, falling back to polling: %s", e)
+            self._watch = None
+            return False
+        # The first callback carries every task as added.
+        if not synced.wait(self.load_timeout):
+            logger.warning("task listener has not synced after %ss", self.load_timeout)
+        return True
+
+    def _start_poller(self):
+        if self._poller is None and self.poll_interval:
+            self._poller = threading.Thread(target=self._poll, name='task-board-poller', daemon=True)
+            self._poller.start()
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            self.refresh()
+
+    def close(self):
+        """Stops following changes."""
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def stats(self):
+        with self._lock:
+            pending = sum(len(entries) for by_priority in self._pending.values() for entries in by_priority.values())
+            return {'open': len(self._tasks), 'pending': pending, 'claimed': len(self._tasks) - pending}
@@ -0,0 +1,209 @@
+import json
+import logging
+import operator
+import os
+import string
+import threading
+import time
+
+from backend.models import CustomerProfile, Priority, Role, StaffTask
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), 'task_rules.json')
+WILDCARD = '*'
+# Fields a task description template may use, each read from the template context
+# (profile, hotel, entities, category, intent, sentiment).
+TEMPLATE_FIELDS = {
+    'customer_name': lambda context: 'Guest' if context[0].name is None else context[0].name,
+    'room_number': lambda context: 'unknown' if context[0].room_number is None else context[0].room_number,
+    'entities': operator.itemgetter(2),
+    'hotel_name': lambda context: context[1].get('name', ''),
+    'category': operator.itemgetter(3),
+    'intent': operator.itemgetter(4),
+    'sentiment': operator.itemgetter(5)
+}
+_CONVERSIONS = {'r': repr, 's': str, 'a': ascii}
+# The context of a request with nothing known about the guest or hotel, which every template must render.
+_SAMPLE_CONTEXT = (CustomerProfile(id=''), {}, [], '', '', '')
+
+
+def compile_template(template):
+    """
+    Parses a description template into a function rendering it from a template
+    context. Raises ValueError for a template that cannot be rendered: a malformed or
+    nested replacement field, an unknown field or conversion, or a format spec the
+    field's value does not accept.
+    """
+    pieces = []
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise ValueError(f"invalid template {template!r}: {e}") from None
+    for literal, field, format_spec, conversion in parsed:
+        if literal:
+            pieces.append(literal)
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS:
+            raise ValueError(f"unknown template field {{{field}}} in {template!r}")
+        if conversion is not None and conversion not in _CONVERSIONS:
+            raise ValueError(f"unknown conversion !{conversion} in {template!r}")
+        if '{' in format_spec:
+            raise ValueError(f"nested replacement fields are not supported in {template!r}")
+        pieces.append((TEMPLATE_FIELDS[field], _CONVERSIONS.get(conversion), format_spec))
+
+    def render(context):
+        parts = []
+        for piece in pieces:
+            if isinstance(piece, str):
+                parts.append(piece)
+                continue
+            value_of, convert, format_spec = piece
+            value = value_of(context)
+            parts.append(format(value if convert is None else convert(value), format_spec))
+        return ''.join(parts)
+
+    try:
+        render(_SAMPLE_CONTEXT)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid format spec in {template!r}: {e}") from None
+    return render
+
+
+def compile_tasks(specs):
+    """
+    Compiles task specs ({'role', 'description', 'priority', ...extra fields}) into one
+    function building the StaffTasks, called as
+    build(profile, hotel, entities, category, intent, sentiment).
+    Raises ValueError for a role or priority that is not a Role or Priority, or a
+    description template that cannot be rendered.
+    """
+    tasks = []
+    for spec in specs:
+        extra = {key: value for key, value in spec.items() if key not in ('role', 'description', 'priority')}
+        tasks.append((Role(spec['role']), compile_template(spec['description']), Priority(spec['priority']), extra or None))
+    if not tasks:
+        return _no_tasks
+
+    def build(*context):
+        return [StaffTask(role, render(context), priority, extra=extra) for role, render, priority, extra in tasks]
+    return build
+
+
+class _RuleSet:
+    """Compiled rules for one hotel class: a dispatch table plus profile alerts."""
+
+    def __init__(self, rules, alerts):
+        self.table = {}
+        for rule in rules:
+            key = (rule.get('category', WILDCARD), rule.get('intent', WILDCARD), rule.get('sentiment', WILDCARD))
+            self.table[key] = compile_tasks(rule.get('tasks', ()))
+        self.alerts = tuple((_profile_field(alert['field']), alert['above'], compile_tasks(alert['tasks'])) for alert in alerts)
+        self._resolved = {}
+
+    def lookup(self, category, intent, sentiment):
+        key = (category, intent, sentiment)
+        build = self._resolved.get(key)
+        if build is None:
+            build = self._resolved[key] = self._resolve(category, intent, sentiment)
+        return build
+
+    def _resolve(self, category, intent, sentiment):
+        # Most specific first; the category outranks the intent, which outranks the sentiment.
+        for c in (category, WILDCARD):
+            for i in (intent, WILDCARD):
+                for s in (sentiment, WILDCARD):
+                    build = self.table.get((c, i, s))
+                    if build is not None:
+                        return build
+        return _no_tasks
+
+
+def _profile_field(name):
+    """Returns a getter for a CustomerProfile counter, read from a slot when the profile has one."""
+    if name in CustomerProfile.__slots__ and name != 'extra':
+        return operator.attrgetter(name)
+    return lambda profile: profile.get(name, 0)
+
+
+def _no_tasks(profile, hotel, entities, category, intent, sentiment):
+    return []
+
+
+class TaskRules:
+    """
+    Staff task rules loaded from a JSON (or, with PyYAML installed, YAML) file.
+
+    Each rule maps a (category, intent, sentiment) key to the tasks it creates, with
+    omitted parts matching anything; the most specific matching rule wins, and a rule
+    with no tasks stops the fallback. Alerts add tasks whenever a profile counter is
+    above a threshold. Rules under `classes` apply to hotels of that `class` and
+    replace default rules with the same key. When loaded, each rule's tasks and
+    description templates are compiled into one function, and the rule resolved for
+    every key is memoized, so a lookup is one dict read however many rules there are.
+    The file is checked for changes at most every `check_interval` seconds and
+    reloaded in place; a file that fails to load leaves the old rules active.
+    """
+
+    def __init__(self, path=DEFAULT_RULES_PATH, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._default, self._classes = self._compile(self._read())
+
+    def _read(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self._mtime = os.fstat(f.fileno()).st_mtime
+            if self.path.endswith(('.yaml', '.yml')):
+                import yaml
+                return yaml.safe_load(f)
+            return json.load(f)
+
+    def _compile(self, spec):
+        rules = spec.get('rules', [])
+        alerts = spec.get('alerts', [])
+        default = _RuleSet(rules, alerts)
+        classes = {}
+        for hotel_class, overrides in (spec.get('classes') or {}).items():
+            # Class rules come last so they replace default rules with the same key.
+            classes[hotel_class] = _RuleSet(rules + overrides.get('rules', []), overrides.get('alerts', alerts))
+        return default, classes
+
+    def reload(self):
+        """Re-reads and recompiles the rules file, keeping the current rules if it is invalid."""
+        with self._lock:
+            try:
+                compiled = self._compile(self._read())
+            except Exception as e:
+                logger.error("error loading task rules path=%s: %s", self.path, e)
+                return False
+            self._default, self._classes = compiled
+        logger.info("task rules reloaded path=%s", self.path)
+        return True
+
+    def _check_for_changes(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def tasks_for(self, category, intent, sentiment, customer_profile, hotel_data, entities):
+        """Returns the staff tasks for a triaged request."""
+        if self.check_interval is not None:
+            self._check_for_changes()
+        rule_set = self._classes.get(hotel_data.get('class'), self._default) if self._classes else self._default
+        tasks_list = rule_set.lookup(category, intent, sentiment)(customer_profile, hotel_data, entities, category, intent, sentiment)
+        for value_of, threshold, build in reversed(rule_set.alerts):
+            # Alert tasks come first, in the order the alerts are listed.
+            if value_of(customer_profile) > threshold:
+                tasks_list[:0] = build(customer_profile, hotel_data, entities, category, intent, sentiment)
+        return tasks_list
@@ -0,0 +1,253 @@
+"""
+Streaming aggregation of realtime room usage.
+
+Rooms report readings like the `realtime_data` documents of
+backend/firebase_connector.py: the water, electricity and Wi-Fi usage since their
+previous reading. Instead of one document write per reading, readings are summed
+into fixed-size ring buffers of time buckets per room, floor and hotel. Sliding
+window totals are read from those buffers, and only tumbling-window rollups are
+written to storage, once per flush interval. A sustained drop in a room's
+electricity use can be turned into an eco-action reward for the guest staying there.
+"""
+import logging
+import threading
+import time
+from array import array
+from urllib.parse import quote
+
+from backend.write_batcher import WriteBatcher
+
+logger = logging.getLogger(__name__)
+
+USAGE_METRICS = ('water_liters', 'electricity_kwh', 'wifi_data_mb')
+
+
+class UsageSeries:
+    """
+    Ring buffer of `slots` time buckets of `resolution` seconds, each holding the
+    summed usage per metric and the number of readings, in flat `array`s.
+    """
+    __slots__ = ('resolution', 'slots', '_sums', '_counts', '_epochs')
+
+    def __init__(self, resolution, slots):
+        self.resolution = resolution
+        self.slots = slots
+        self._sums = array('d', bytes(8 * slots * len(USAGE_METRICS)))
+        self._counts = array('q', bytes(8 * slots))
+        # Bucket number held by each slot; -1 for a slot never written.
+        self._epochs = array('q', [-1]) * slots
+
+    def add(self, timestamp, values):
+        epoch = int(timestamp // self.resolution)
+        slot = epoch % self.slots
+        base = slot * len(USAGE_METRICS)
+        sums = self._sums
+        if self._epochs[slot] != epoch:
+            if self._epochs[slot] > epoch:
+                return False  # The slot already holds a newer bucket.
+            self._epochs[slot] = epoch
+            self._counts[slot] = 0
+            for i in range(len(USAGE_METRICS)):
+                sums[base + i] = 0.0
+        self._counts[slot] += 1
+        for i, value in enumerate(values):
+            sums[base + i] += value
+        return True
+
+    def total(self, first_epoch, last_epoch):
+        """Returns ({metric: sum}, readings) over buckets first_epoch..last_epoch inclusive."""
+        totals = [0.0] * len(USAGE_METRICS)
+        count = 0
+        first_epoch = max(first_epoch, last_epoch - self.slots + 1)
+        for epoch in range(first_epoch, last_epoch + 1):
+            slot = epoch % self.slots
+            if self._epochs[slot] != epoch:
+                continue
+            count += self._counts[slot]
+            base = slot * len(USAGE_METRICS)
+            for i in range(len(USAGE_METRICS)):
+                totals[i] += self._sums[base + i]
+        return dict(zip(USAGE_METRICS, totals)), count
+
+
+class TelemetryAggregator:
+    """
+    Keeps per-room, per-floor and per-hotel usage windows and writes their rollups.
+
+    `ingest` takes a reading {'hotel_id', 'room_id', 'realtime_usage': {...}} with an
+    optional 'timestamp' (seconds), 'floor' (derived from a numeric room number
+    otherwise, e.g. room 1204 is on floor 12) and 'customer_id' of the guest in the
+    room. The buffers cover `retention` seconds in buckets of `resolution` seconds.
+    Readings older than that, or for a bucket that has already been flushed, are
+    counted in `dropped` instead.
+
+    `flush` writes one document per room, floor and hotel to `rollup_collection`
+    summarizing the buckets closed since the previous flush (tumbling windows), in
+    batched writes. Document IDs are the percent-encoded key parts and window start
+    joined by ':', e.g. 'room:hotel_1:101:1767225600'. It also checks each occupied room for a sustained electricity
+    drop: usage over the last `drop_window` seconds at least `drop_ratio` below the
+    rate of the preceding `baseline_window`. Each drop calls
+    `on_eco_action(customer_id, 'eco-action-light')` (e.g. `Pilot.award_eco_action`),
+    at most once per room per `reward_cooldown` seconds. If the rollups cannot be
+    written, the flush raises and the next one covers the same buckets again.
+    """
+
+    def __init__(self, db, resolution=60, retention=6 * 3600, rollup_collection='realtime_rollups',
+                 on_eco_action=None, drop_window=3600, baseline_window=4 * 3600, drop_ratio=0.3,
+                 min_readings=10, reward_cooldown=24 * 3600, clock=time.time):
+        if drop_window + baseline_window > retention:
+            raise ValueError("drop_window + baseline_window must fit in the retention period")
+        self.db = db
+        self.resolution = resolution
+        self.slots = -(-retention // resolution)
+        self.rollup_collection = rollup_collection
+        self.on_eco_action = on_eco_action
+        self.drop_window = drop_window
+        self.baseline_window = baseline_window
+        self.drop_ratio = drop_ratio
+        self.min_readings = min_readings
+        self.reward_cooldown = reward_cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._series = {}
+        self._occupants = {}
+        self._last_reward = {}
+        self._flushed_epoch = None
+        self.readings = 0
+        self.dropped = 0
+        self.writes = WriteBatcher(db)
+
+    # --- Ingestion ---
+
+    def ingest(self, reading):
+        """Adds one room reading to the room, floor and hotel windows."""
+        hotel_id = reading['hotel_id']
+        room_id = str(reading['room_id'])
+        usage = reading.get('realtime_usage', reading)
+        values = [float(usage.get(metric, 0) or 0) for metric in USAGE_METRICS]
+        timestamp = reading.get('timestamp') or self._clock()
+        epoch = int(timestamp // self.resolution)
+        floor = reading.get('floor')
+        if floor is None and room_id.isdigit() and len(room_id) > 2:
+            floor = int(room_id) // 100
+        keys = [('room', hotel_id, room_id), ('hotel', hotel_id)]
+        if floor is not None:
+            keys.append(('floor', hotel_id, str(floor)))
+        with self._lock:
+            expired = timestamp <= self._clock() - self.slots * self.resolution
+            # A bucket before the last flush already has its rollup written.
+            late = self._flushed_epoch is not None and epoch < self._flushed_epoch
+            if expired or late:
+                self.dropped += 1
+                return
+            self.readings += 1
+            for key in keys:
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = UsageSeries(self.resolution, self.slots)
+                series.add(timestamp, values)
+            if reading.get('customer_id'):
+                self._occupants[(hotel_id, room_id)] = reading['customer_id']
+
+    def ingest_many(self, readings):
+        for reading in readings:
+            self.ingest(reading)
+
+    # --- Queries ---
+
+    def window(self, key, seconds, now=None):
+        """
+        Returns the sliding-window totals for `key` over the last `seconds`, e.g.
+        window(('room', 'hotel_1', '101'), 900) -> {'water_liters': ..., 'readings': ...}.
+        """
+        last_epoch = int((now or self._clock()) // self.resolution)
+        first_epoch = last_epoch - max(1, -(-seconds // self.resolution)) + 1
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return dict.fromkeys(USAGE_METRICS, 0.0) | {'readings': 0}
+            totals, count = series.total(first_epoch, last_epoch)
+        totals['readings'] = count
+        return totals
+
+    # --- Rollups and reward events ---
+
+    def flush(self, now=None):
+        """Writes rollups of the buckets closed since the last flush and emits eco-action events."""
+        with self._flush_lock:
+            return self._flush(now or self._clock())
+
+    def _flush(self, now):
+        current_epoch = int(now // self.resolution)
+        with self._lock:
+            first_epoch = self._flushed_epoch if self._flushed_epoch is not None else current_epoch - self.slots
+            last_epoch = current_epoch - 1
+            rollups = []
+            if last_epoch >= first_epoch:
+                for key, series in self._series.items():
+                    totals, count = series.total(first_epoch, last_epoch)
+                    if count:
+                        rollups.append((key, totals, count))
+            events = self._detect_drops(now)
+        window_start = max(first_epoch, current_epoch - self.slots) * self.resolution
+        collection = self.db.collection(self.rollup_collection)
+        for key, totals, count in rollups:
+            doc_id = ':'.join(quote(part, safe='') for part in key + (str(int(window_start)),))
+            self.writes.set(collection.document(doc_id), {
+                'level': key[0],
+                'hotel_id': key[1],
+                'entity_id': key[-1],
+                'window_start': window_start,
+                'window_end': current_epoch * self.resolution,
+                'readings': count,
+                'usage': totals
+            })
+        self.writes.flush()
+        with self._lock:
+            # Only now are the buckets closed, so readings for them are late.
+            self._flushed_epoch = current_epoch
+            for _, room in events:
+                self._last_reward[room] = now
+        for customer_id, room in events:
+            try:
+                self.on_eco_action(customer_id, 'eco-action-light')
+                logger.info("electricity drop rewarded customer_id=%s hotel_id=%s room_id=%s", customer_id, *room)
+            except Exception as e:
+                logger.error("eco-action reward failed customer_id=%s error=%s", customer_id, e)
+        return len(rollups)
+
+    def _detect_drops(self, now):
+        if self.on_eco_action is None:
+            return []
+        events = []
+        last_epoch = int(now // self.resolution) - 1
+        recent_buckets = -(-self.drop_window // self.resolution)
+        baseline_buckets = -(-self.baseline_window // self.resolution)
+        for room, customer_id in self._occupants.items():
+            if now - self._last_reward.get(room, float('-inf')) < self.reward_cooldown:
+                continue
+            series = self._series.get(('room',) + room)
+            recent, recent_count = series.total(last_epoch - recent_buckets + 1, last_epoch)
+            baseline, baseline_count = series.total(last_epoch - recent_buckets - baseline_buckets + 1, last_epoch - recent_buckets)
+            if recent_count < self.min_readings or baseline_count < self.min_readings:
+                continue
+            recent_rate = recent['electricity_kwh'] / recent_buckets
+            baseline_rate = baseline['electricity_kwh'] / baseline_buckets
+            if baseline_rate > 0 and recent_rate <= baseline_rate * (1 - self.drop_ratio):
+                events.append((customer_id, room))
+        return events
+
+    def start_flusher(self, interval=60):
+        """Flushes every `interval` seconds from a background thread; returns an Event that stops it."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("error flushing telemetry rollups")
+
+        threading.Thread(target=run, name='telemetry-flusher', daemon=True).start()
+        return stop
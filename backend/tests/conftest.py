@@ -0,0 +1,138 @@
+import threading
+import zlib
+
+import pytest
+
+from backend.storage import MemoryStorage
+
+
+class FlakyStorage(MemoryStorage):
+    """
+    MemoryStorage that fails chosen batch commits with ConnectionError before applying anything.
+
+    `failures` fails that many of the next commits. `fail_once(identity)` picks commits
+    to fail once each, by the document paths they write (task documents, whose IDs are
+    generated, are left out), so a retry of the same writes goes through and which
+    commits fail does not depend on thread timing.
+    """
+
+    def __init__(self, fail_once=None):
+        super().__init__()
+        self.failures = 0
+        self.fail_once = fail_once
+        self.injected = 0
+        self._failed = set()
+        self._failure_lock = threading.Lock()
+
+    def _commit(self, ops):
+        with self._failure_lock:
+            fail = self.failures > 0
+            if fail:
+                self.failures -= 1
+            elif self.fail_once is not None:
+                identity = tuple(sorted(f'{op[0]}:{op[1].path}' for op in ops if not op[1].path.startswith('tasks/')))
+                fail = identity not in self._failed and self.fail_once(identity)
+                if fail:
+                    self._failed.add(identity)
+            self.injected += fail
+        if fail:
+            raise ConnectionError("injected commit failure")
+        super()._commit(ops)
+
+
+class AsyncStorage:
+    """
+    Wraps a local storage backend the way the Firestore async client looks to AsyncPilot:
+    document `get`/`create` and batch `commit` are coroutines, everything else is unchanged.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def collection(self, path):
+        return _AsyncCollection(self._storage.collection(path))
+
+    def batch(self):
+        return _AsyncBatch(self._storage.batch())
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+
+class _AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def document(self, document_id=None):
+        return _AsyncDocument(self._collection.document(document_id))
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class _AsyncDocument:
+    def __init__(self, document):
+        self._document = document
+
+    async def get(self):
+        return self._document.get()
+
+    async def create(self, document_data):
+        self._document.create(document_data)
+
+    def __getattr__(self, name):
+        return getattr(self._document, name)
+
+
+class _AsyncBatch:
+    def __init__(self, batch):
+        self._batch = batch
+
+    async def commit(self):
+        self._batch.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._batch, name)
+
+
+def one_in(n):
+    """A `fail_once` choosing about one commit in `n`, the same ones on every run."""
+    return lambda identity: zlib.crc32(repr(identity).encode('utf-8')) % n == 0
+
+
+@pytest.fixture
+def storage():
+    """Creates a FlakyStorage with one hotel, 'hotel_1': storage(fail_one_in=3) fails about one commit in three once."""
+    def create(fail_one_in=0):
+        db = FlakyStorage(one_in(fail_one_in) if fail_one_in else None)
+        db.collection('hotels').document('hotel_1').set({'hotel_id': 'hotel_1', 'name': 'H1'})
+        return db
+    return create
+
+
+@pytest.fixture
+def db(storage):
+    """A FlakyStorage (failing nothing until told to) with one hotel, 'hotel_1'."""
+    return storage()
+
+
+@pytest.fixture
+def customer(db):
+    """Stores a customer document and returns its reference: customer('c1', tokens=5)."""
+    def create(customer_id='c1', **fields):
+        doc_ref = db.collection('customers').document(customer_id)
+        doc_ref.set({'tokens': 0, 'rewards': [], **fields})
+        return doc_ref
+    return create
+
+
+@pytest.fixture
+def tokens(db):
+    """Returns a customer's stored token balance: tokens('c1')."""
+    return lambda customer_id='c1': db.collection('customers').document(customer_id).get().to_dict()['tokens']
+
+
+@pytest.fixture
+def async_db(db):
+    """`db` as seen through an async client; both see the same documents and injected failures."""
+    return AsyncStorage(db)
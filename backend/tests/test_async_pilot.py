@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from backend.async_pilot import AsyncPilot
+from backend.write_batcher import WriteBatcher
+
+REQUEST = {'type': 'query', 'query': 'I will reuse towels', 'hotel_id': 'hotel_1'}
+
+
+def test_concurrent_requests_are_all_applied(async_db, tokens):
+    pilot = AsyncPilot(storage=async_db, max_in_flight=4)
+    asyncio.run(pilot.process_requests([(f'c{i % 3}', dict(REQUEST)) for i in range(12)]))
+    assert [tokens(f'c{i}') for i in range(3)] == [800, 800, 800]
+    assert pilot.metrics.failed_requests == 0
+
+
+def test_repeated_delivery_is_processed_once(async_db, tokens):
+    pilot = AsyncPilot(storage=async_db)
+    request = dict(REQUEST, idempotency_key='delivery-1')
+    asyncio.run(pilot.process_requests([('c1', dict(request)), ('c1', dict(request))]))
+    assert tokens() == 200
+    assert pilot.idempotency.duplicates == 1
+
+
+def test_unknown_hotel_is_counted_as_failed(async_db, db):
+    pilot = AsyncPilot(storage=async_db)
+    asyncio.run(pilot.process_request('c1', dict(REQUEST, hotel_id='nope')))
+    assert pilot.metrics.failed_requests == 1
+    assert not list(db.collection('tasks').stream())
+
+
+def test_failed_commit_raises_and_a_retry_goes_through(async_db, db, customer, tokens):
+    customer()
+    pilot = AsyncPilot(storage=async_db)
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        asyncio.run(pilot.process_request('c1', dict(REQUEST)))
+    assert tokens() == 0
+    asyncio.run(pilot.process_request('c1', dict(REQUEST)))
+    assert tokens() == 200
+
+
+def test_windowed_writes_are_committed_on_flush(async_db, db, tokens):
+    writes = WriteBatcher(db, flush_interval=60)
+    pilot = AsyncPilot(storage=async_db, write_batcher=writes)
+    asyncio.run(pilot.process_requests([('c1', dict(REQUEST)), ('c1', dict(REQUEST))]))
+    assert tokens() == 0
+    writes.flush()
+    assert tokens() == 400
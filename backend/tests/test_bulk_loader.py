@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from backend.bulk_loader import BulkLoader, load_file
+from backend.storage import MemoryStorage, SQLiteStorage
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'hotels.json'
+    path.write_text(json.dumps([{'hotel_id': f'hotel_{i}', 'name': f'H{i}'} for i in range(5)]))
+    return str(path)
+
+
+def hotel_ids(db):
+    return sorted(doc.id for doc in db.collection('hotels').stream())
+
+
+def test_rerun_writes_only_changed_records(source):
+    db = MemoryStorage()
+    assert load_file(db, source, 'hotels', 'hotel_id')['written'] == 5
+    assert load_file(db, source, 'hotels', 'hotel_id')['written'] == 0
+    with open(source, 'w') as f:
+        json.dump([{'hotel_id': f'hotel_{i}', 'name': 'renamed' if i == 2 else f'H{i}'} for i in range(5)], f)
+    stats = load_file(db, source, 'hotels', 'hotel_id')
+    assert (stats['written'], stats['unchanged']) == (1, 4)
+
+
+def test_loading_into_another_database_writes_every_record(source, tmp_path):
+    load_file(MemoryStorage(), source, 'hotels', 'hotel_id')
+    other = SQLiteStorage(str(tmp_path / 'pilot.db'))
+    assert load_file(other, source, 'hotels', 'hotel_id')['written'] == 5
+    assert hotel_ids(other) == [f'hotel_{i}' for i in range(5)]
+
+
+def test_emptied_collection_is_reloaded_despite_an_unchanged_source(source):
+    db = MemoryStorage()
+    load_file(db, source, 'hotels', 'hotel_id')
+    for hotel_id in hotel_ids(db):
+        db.collection('hotels').document(hotel_id).delete()
+    assert load_file(db, source, 'hotels', 'hotel_id')['written'] == 5
+    assert len(hotel_ids(db)) == 5
+
+
+def names(db, collection='catalog'):
+    return {doc.id: doc.to_dict()['name'] for doc in db.collection(collection).stream()}
+
+
+def test_resume_after_the_source_was_edited_reloads_committed_batches(source, db):
+    # `db` holds a 'hotels' collection of its own, so the catalog goes elsewhere.
+    db.fail_once = lambda identity: 'set:catalog/hotel_2' in identity
+    with pytest.raises(ConnectionError):
+        load_file(db, source, 'catalog', 'hotel_id', batch_size=2, max_concurrent=1, max_retries=0)
+    assert sorted(names(db)) == ['hotel_0', 'hotel_1']
+    with open(source, 'w') as f:
+        json.dump([{'hotel_id': f'hotel_{i}', 'name': 'renamed' if i == 0 else f'H{i}'} for i in range(5)], f)
+    stats = load_file(db, source, 'catalog', 'hotel_id', batch_size=2, max_concurrent=1)
+    assert (stats['written'], stats['resumed']) == (5, 0)
+    assert names(db)['hotel_0'] == 'renamed'
+    assert load_file(db, source, 'catalog', 'hotel_id', batch_size=2)['written'] == 0
+
+
+def test_resume_of_an_unmodified_source_skips_committed_batches(source, db):
+    db.fail_once = lambda identity: 'set:catalog/hotel_2' in identity
+    with pytest.raises(ConnectionError):
+        load_file(db, source, 'catalog', 'hotel_id', batch_size=2, max_concurrent=1, max_retries=0)
+    stats = load_file(db, source, 'catalog', 'hotel_id', batch_size=2, max_concurrent=1)
+    assert (stats['written'], stats['resumed']) == (3, 2)
+    assert len(names(db)) == 5
+
+
+def test_manifest_only_records_documents_known_to_be_loaded(db, tmp_path):
+    def loader():
+        return BulkLoader(db, 'catalog', 'hotel_id', batch_size=2, max_concurrent=1, max_retries=0,
+                          checkpoint_path=str(tmp_path / 'checkpoint'), manifest_path=str(tmp_path / 'manifest'))
+    records = [{'hotel_id': f'hotel_{i}', 'name': f'H{i}'} for i in range(5)]
+    db.fail_once = lambda identity: 'set:catalog/hotel_2' in identity
+    with pytest.raises(ConnectionError):
+        loader().load(records, source='feed')
+    # Without a source stat the resume cannot tell that the first batch's records have changed since.
+    records[0]['name'] = 'renamed'
+    stats = loader().load(records, source='feed')
+    assert (stats['written'], stats['resumed']) == (3, 2)
+    assert names(db)['hotel_0'] == 'H0'
+    # So the manifest leaves them out, and the next load writes them.
+    stats = loader().load(records, source='feed')
+    assert (stats['written'], stats['unchanged']) == (2, 3)
+    assert names(db)['hotel_0'] == 'renamed'
@@ -0,0 +1,68 @@
+import pytest
+
+from backend.dispatch import DEFAULT_SLA, DispatchScheduler
+from backend.models import Priority, Role, StaffTask, TaskStatus
+from backend.pilot_engine import Pilot
+
+START = 1767225600.0
+REQUEST = {'type': 'query', 'query': 'The wi-fi is broken', 'hotel_id': 'hotel_1'}
+
+
+def task(db, task_id, priority, role=Role.HOUSEKEEPING):
+    db.collection('tasks').document(task_id).set({'role': role, 'priority': priority, 'hotel_id': 'hotel_1'})
+    return StaffTask(role, f'task {task_id}', priority, hotel_id='hotel_1', id=task_id)
+
+
+def stored(db, task_id):
+    return db.collection('tasks').document(task_id).get().to_dict()
+
+
+def test_most_urgent_task_goes_to_the_next_free_staff_member(db):
+    scheduler = DispatchScheduler(db, clock=lambda: START)
+    scheduler.submit(task(db, 'low', Priority.LOW))
+    scheduler.submit(task(db, 'critical', Priority.CRITICAL))
+    scheduler.add_staff('hotel_1', Role.HOUSEKEEPING, 'anna')
+    assert stored(db, 'critical')['assigned_to'] == 'anna'
+    assert stored(db, 'low').get('status') is None
+    assert scheduler.complete('critical')
+    assert stored(db, 'critical')['status'] == TaskStatus.COMPLETED.value
+    assert stored(db, 'low')['assigned_to'] == 'anna'
+    assert not scheduler.complete('critical')
+
+
+def test_tick_escalates_waiting_tasks_and_reports_assigned_ones_once(db):
+    escalated = []
+    scheduler = DispatchScheduler(db, clock=lambda: START, on_escalate=lambda task, staff_id: escalated.append((task.id, staff_id)))
+    scheduler.add_staff('hotel_1', Role.HOUSEKEEPING, 'anna')
+    scheduler.submit(task(db, 'assigned', Priority.HIGH))
+    scheduler.submit(task(db, 'waiting', Priority.HIGH))
+    assert scheduler.tick(START + DEFAULT_SLA[Priority.HIGH]) == 2
+    assert stored(db, 'assigned')['overdue'] is True
+    assert stored(db, 'waiting')['priority'] == Priority.CRITICAL.value
+    assert sorted(escalated) == [('assigned', 'anna'), ('waiting', None)]
+    assert scheduler.tick(START + DEFAULT_SLA[Priority.HIGH] + 1) == 0
+    assert scheduler.stats()['escalated'] == 2
+
+
+def test_failed_request_leaves_no_task_holding_staff(db, customer):
+    customer()
+    scheduler = DispatchScheduler(db, staff_per_role=1)
+    pilot = Pilot(storage=db, dispatcher=scheduler)
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        pilot.process_request('c1', dict(REQUEST))
+    assert scheduler.stats()['open'] == 0
+    pilot.process_request('c1', dict(REQUEST))
+    [doc] = db.collection('tasks').stream()
+    assert doc.to_dict()['assigned_to'] == 'IT Support #1'
+    assert scheduler.tick(START * 2) == 1
+    assert doc.reference.get().to_dict()['overdue'] is True
+
+
+def test_duplicate_request_leaves_no_task_holding_staff(db):
+    Pilot(storage=db).process_request('c1', dict(REQUEST, idempotency_key='k1'))
+    scheduler = DispatchScheduler(db, staff_per_role=1)
+    # A fresh process only learns of the first delivery when its marker create fails.
+    Pilot(storage=db, dispatcher=scheduler).process_request('c1', dict(REQUEST, idempotency_key='k1'))
+    assert scheduler.stats()['open'] == 0
+    assert scheduler.tick(START * 2) == 0
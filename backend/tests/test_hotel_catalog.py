@@ -0,0 +1,69 @@
+import json
+import threading
+
+from backend.hotel_catalog import HotelCatalog
+
+
+def hotel(db, hotel_id, **fields):
+    db.collection('hotels').document(hotel_id).set({'hotel_id': hotel_id, **fields})
+
+
+def test_first_lookup_loads_from_storage_and_writes_the_snapshot(db, tmp_path):
+    path = tmp_path / 'hotels.json'
+    catalog = HotelCatalog(db, snapshot_path=str(path), live=False)
+    assert catalog.get('hotel_1')['name'] == 'H1'
+    assert json.loads(path.read_text()) == {'hotel_1': {'hotel_id': 'hotel_1', 'name': 'H1'}}
+
+
+def test_snapshot_is_served_without_reading_storage(db, tmp_path):
+    path = tmp_path / 'hotels.json'
+    path.write_text(json.dumps([{'hotel_id': 'hotel_9', 'name': 'From disk'}, {'name': 'no id'}]))
+    reads = db.reads
+    catalog = HotelCatalog(db, snapshot_path=str(path), live=False)
+    assert dict(catalog.items()) == {'hotel_9': {'hotel_id': 'hotel_9', 'name': 'From disk'}}
+    assert db.reads == reads
+
+
+def test_unreadable_snapshot_falls_back_to_storage(db, tmp_path):
+    path = tmp_path / 'hotels.json'
+    path.write_text('{not json')
+    catalog = HotelCatalog(db, snapshot_path=str(path), live=False)
+    assert list(catalog) == ['hotel_1']
+    assert json.loads(path.read_text()) == {'hotel_1': {'hotel_id': 'hotel_1', 'name': 'H1'}}
+
+
+def test_refresh_applies_only_the_differences(db):
+    catalog = HotelCatalog(db, live=False)
+    catalog.load()
+    changes = []
+    catalog.add_listener(lambda upserts, removed: changes.append((upserts, list(removed))))
+    hotel(db, 'hotel_2', name='H2')
+    db.collection('hotels').document('hotel_1').delete()
+    catalog.refresh()
+    assert changes == [({'hotel_2': {'hotel_id': 'hotel_2', 'name': 'H2'}}, ['hotel_1'])]
+    assert 'hotel_1' not in catalog and len(catalog) == 1
+
+
+def test_poller_picks_up_changes(db):
+    catalog = HotelCatalog(db, poll_interval=0.01)
+    catalog.load()
+    changed = threading.Event()
+    catalog.add_listener(lambda upserts, removed: 'hotel_1' in upserts and changed.set())
+    hotel(db, 'hotel_1', name='Renamed')
+    try:
+        assert changed.wait(5)
+        assert catalog['hotel_1']['name'] == 'Renamed'
+    finally:
+        catalog.close()
+
+
+def test_filter_change_drops_and_adds_hotels(db):
+    for i in range(2, 5):
+        hotel(db, f'hotel_{i}')
+    catalog = HotelCatalog(db, live=False, hotel_filter=lambda hotel_id: hotel_id in ('hotel_1', 'hotel_2'))
+    assert sorted(catalog) == ['hotel_1', 'hotel_2']
+    catalog.set_filter(lambda hotel_id: hotel_id != 'hotel_1')
+    assert sorted(catalog) == ['hotel_2', 'hotel_3', 'hotel_4']
+    # Diffs from a listener or poller are filtered too.
+    catalog.apply_diff({'hotel_1': {}, 'hotel_5': {}})
+    assert sorted(catalog) == ['hotel_2', 'hotel_3', 'hotel_4', 'hotel_5']
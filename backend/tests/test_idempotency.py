@@ -0,0 +1,83 @@
+import pytest
+
+from backend.idempotency import IdempotencyIndex
+from backend.pilot_engine import Pilot
+from backend.write_batcher import WriteBatcher
+
+REQUEST = {'type': 'query', 'query': 'I will reuse towels', 'hotel_id': 'hotel_1', 'idempotency_key': 'delivery-1'}
+
+
+def test_repeated_delivery_is_skipped_in_process(db, tokens):
+    pilot = Pilot(storage=db)
+    pilot.process_request('c1', dict(REQUEST))
+    reads = db.reads
+    pilot.process_request('c1', dict(REQUEST))
+    assert db.reads == reads
+    assert tokens() == 200
+    assert pilot.idempotency.duplicates == 1
+
+
+def test_key_processed_by_another_process_fails_the_whole_batch(db, tokens):
+    Pilot(storage=db).process_request('c1', dict(REQUEST))
+    tasks = len(list(db.collection('tasks').stream()))
+    # A fresh process has an empty in-process index, so only the marker's create stops it.
+    pilot = Pilot(storage=db)
+    pilot.process_request('c1', dict(REQUEST))
+    assert tokens() == 200
+    assert len(list(db.collection('tasks').stream())) == tasks
+    assert pilot.idempotency.duplicates == 1
+    assert pilot.profiles.get('c1').tokens == 200
+    pilot.process_request('c1', dict(REQUEST))
+    assert pilot.idempotency.duplicates == 2
+
+
+def test_windowed_writes_check_stored_markers_up_front(db, tokens):
+    Pilot(storage=db).process_request('c1', dict(REQUEST))
+    writes = WriteBatcher(db, flush_interval=60)
+    pilot = Pilot(storage=db, write_batcher=writes)
+    pilot.process_request('c1', dict(REQUEST))
+    pilot.process_request('c1', dict(REQUEST, idempotency_key='delivery-2'))
+    writes.flush()
+    assert tokens() == 400
+    assert pilot.idempotency.duplicates == 1
+
+
+def test_windowed_markers_are_written_on_flush(db):
+    writes = WriteBatcher(db, flush_interval=60)
+    Pilot(storage=db, write_batcher=writes).process_request('c1', dict(REQUEST))
+    index = IdempotencyIndex(db)
+    assert not index.stored('delivery-1')
+    writes.flush()
+    assert index.stored('delivery-1')
+    assert index.seen('delivery-1')
+
+
+def test_marker_ids_are_hashed_keys(db):
+    index = IdempotencyIndex(db)
+    marker = index.marker('customer/1?retry=2')
+    assert marker.id == index.marker('customer/1?retry=2').id
+    assert '/' not in marker.id and len(marker.id) == 32
+
+
+def test_windowed_key_is_remembered_only_once_the_window_commits(db, tokens):
+    writes = WriteBatcher(db, flush_interval=60)
+    pilot = Pilot(storage=db, write_batcher=writes)
+    pilot.process_request('c1', dict(REQUEST))
+    assert not pilot.idempotency.seen('delivery-1')
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        writes.flush()
+    assert not pilot.idempotency.seen('delivery-1')
+    writes.flush()
+    assert tokens() == 200
+    assert pilot.idempotency.seen('delivery-1')
+
+
+def test_second_delivery_in_the_same_window_is_a_duplicate(db, tokens):
+    writes = WriteBatcher(db, flush_interval=60)
+    pilot = Pilot(storage=db, write_batcher=writes)
+    pilot.process_request('c1', dict(REQUEST))
+    pilot.process_request('c1', dict(REQUEST))
+    writes.flush()
+    assert tokens() == 200
+    assert pilot.idempotency.duplicates == 1
@@ -0,0 +1,110 @@
+"""
+Checks the keyword matcher against the substring rules the engine started from: the
+first version of backend/pilot_engine.py tested every keyword with `keyword in query`.
+"""
+import random
+
+import pytest
+
+from backend.benchmarks.pilot_benchmark import DEFAULT_MIX
+from backend.models import GuestRequest
+from backend.pilot_engine import Pilot
+from backend.storage import MemoryStorage
+
+NEGATIVE = ['poor', 'slow', 'bad', 'unhappy', 'dirty', 'broken', 'disappointing', 'rude', 'unresolved']
+POSITIVE = ['excellent', 'great', 'fast', 'happy', 'clean', 'wonderful', 'professional', 'helpful']
+CATEGORIES = {
+    'service_request': ['wi-fi', 'internet', 'clean', 'housekeeping', 'laundry', 'maintenance', 'broken', 'leak', 'booking', 'check-in',
+                        'check-out', 'room service', 'dining', 'meal', 'buzzer', 'towels', 'menu'],
+    'eco_request': ['opt out', 'reuse towels', 'no linen', 'turn off lights', 'ac down', 'natural light', 'bike rental', 'bus pass',
+                    'car-sharing', 'vegan', 'local food', 'no-meat', 'digital receipt', 'no paper', 'zero-waste', 'park clean-up',
+                    'coral reef planting', 'tree planting', 'sustainable'],
+    'review': ['review', 'feedback', 'happy', 'unhappy', 'disappointed', 'excellent', 'great', 'poor'],
+    'medical_alert': ['diabetic', 'asthmatic', 'medical condition', 'therapeutic nutrition']
+}
+INTENTS = {
+    'service_request': [('tech_support', ['wi-fi', 'internet'], 'Wi-Fi'), ('housekeeping_request', ['clean', 'housekeeping'], 'cleaning'),
+                        ('maintenance_issue', ['maintenance', 'broken'], 'maintenance'), ('food_order', ['meal', 'dining', 'menu'], 'food'),
+                        ('realtime_service', ['buzzer', 'towels'], None)],
+    'eco_request': [('eco_housekeeping', ['opt out', 'reuse'], None), ('eco_transport', ['transport', 'bike'], None),
+                    ('eco_food', ['vegan', 'local food', 'sustainable'], None), ('eco_donation', ['donation'], None)],
+    'medical_alert': [('diabetic_care', ['diabetic', 'therapeutic nutrition'], None), ('asthma_care', ['asthmatic'], None)]
+}
+ENTITIES = ['front desk staff', 'housekeeping', 'chef', 'concierge', 'attendant', 'wi-fi', 'internet', 'pool', 'gym', 'room', 'bed',
+            'bathroom', 'meal', 'food', 'breakfast', 'dinner']
+REWARDS = [
+    ('eco-action-water', ['opt out of', 'no linen', 'reuse towels']),
+    ('eco-action-light', ['turn off lights', 'ac down', 'natural light']),
+    ('eco-action-transport', ['bike rental', 'bus pass', 'car-sharing']),
+    ('eco-action-food', ['vegan', 'local food', 'no-meat', 'sustainable']),
+    ('eco-action-zero-waste', ['digital receipt', 'no paper', 'zero-waste']),
+    ('eco-action-major', ['park clean-up', 'coral reef planting', 'tree planting'])
+]
+
+
+def baseline(query):
+    """(category, sentiment, intent, entities, reward_type, polite) by the original substring rules."""
+    lowered = query.lower()
+    sentiment = 'negative' if any(k in lowered for k in NEGATIVE) else 'positive' if any(k in lowered for k in POSITIVE) else 'neutral'
+    category = next((name for name, keywords in CATEGORIES.items() if any(k in lowered for k in keywords)), 'unknown')
+    # Intents and entities were matched against the query as written.
+    intent, entities = 'general_inquiry', []
+    for name, keywords, entity in INTENTS.get(category, ()):
+        if any(k in query for k in keywords):
+            intent = name
+            if entity:
+                entities.append(entity)
+            break
+    entities += [k for k in ENTITIES if k in query]
+    reward_type = next((name for name, keywords in REWARDS if any(k in lowered for k in keywords)), None)
+    polite = 'please' in lowered or 'thank you' in lowered
+    return category, sentiment, intent, entities, reward_type, polite
+
+
+def corpus(size=2000, seed=3):
+    keywords = sorted({k for group in [NEGATIVE, POSITIVE, ENTITIES, ['please', 'thank you', 'reuse', 'bike', 'donation', 'transport']]
+                       for k in group} | {k for keywords in CATEGORIES.values() for k in keywords}
+                      | {k for _, keywords in REWARDS for k in keywords})
+    filler = ['the', 'my', 'is', 'a', 'could', 'you', 'help', 'room', 'service', 'X', 'unclean', 'Wi-Fi', 'Please']
+    rng = random.Random(seed)
+    queries = [request['query'] for _, request in DEFAULT_MIX] + ['', 'WI-FI BROKEN', 'Thank You', 'menus and mealtimes']
+    for _ in range(size):
+        words = rng.sample(keywords, rng.randint(0, 4)) + rng.sample(filler, rng.randint(0, 4))
+        rng.shuffle(words)
+        words = [word.upper() if rng.random() < 0.1 else word.capitalize() if rng.random() < 0.1 else word for word in words]
+        queries.append(rng.choice([' ', ', ', '']).join(words) + rng.choice(['', '.', '!', '?']))
+    return queries
+
+
+@pytest.fixture(scope='module')
+def pilot():
+    return Pilot(storage=MemoryStorage())
+
+
+def single(pilot, query):
+    request = GuestRequest.from_dict({'query': query})
+    matches = pilot._match_keywords(query)
+    category, sentiment = pilot._triage_request(request, matches)
+    intent, entities = pilot._recognize_intent(query, category, matches)
+    return category, sentiment, intent, entities, matches.first('reward'), matches.has('politeness')
+
+
+def test_single_request_triage_matches_the_substring_rules(pilot):
+    for query in corpus():
+        assert single(pilot, query) == baseline(query), query
+
+
+def test_triage_batch_matches_the_substring_rules(pilot):
+    queries = corpus()
+    queries += queries[:100]
+    result = pilot.triage_batch(queries, chunk_size=300)
+    for row, query in enumerate(queries):
+        batch = tuple(result[name][row] for name in ('category', 'sentiment', 'intent', 'entities', 'reward_type', 'polite'))
+        assert batch == baseline(query), query
+
+
+def test_triage_batch_rows_have_their_own_entity_lists(pilot):
+    result = pilot.triage_batch(['wi-fi in my room', 'wi-fi in my room', 'nothing'])
+    result['entities'][0].append('changed')
+    assert result['entities'][1] == ['Wi-Fi', 'wi-fi', 'room']
+    assert result['entities'][2] == []
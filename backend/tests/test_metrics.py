@@ -0,0 +1,45 @@
+import json
+import logging
+import threading
+
+from backend.metrics import NULL_TIMER, JsonFormatter, PilotMetrics
+from backend.pilot_engine import Pilot
+
+
+def test_counters_are_exact_across_threads():
+    metrics = PilotMetrics(sample_rate=0.5)
+
+    def work():
+        for _ in range(2000):
+            metrics.start_request()
+            metrics.count('reads')
+            metrics.count('writes', 2)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (metrics.requests, metrics.reads, metrics.writes) == (16000, 16000, 32000)
+    assert 'pilot_storage_reads_total 16000' in metrics.render_prometheus()
+
+
+def test_only_sampled_requests_get_a_timer():
+    metrics = PilotMetrics(sample_rate=0.25)
+    timers = [metrics.start_request() for _ in range(8)]
+    assert [timer is not NULL_TIMER for timer in timers] == [False, False, False, True] * 2
+
+
+def test_each_request_logs_its_own_reads_and_writes(db, caplog):
+    pilot = Pilot(storage=db)
+    request = {'type': 'query', 'query': 'I will reuse towels', 'hotel_id': 'hotel_1'}
+    with caplog.at_level(logging.DEBUG, logger='backend.pilot_engine'):
+        pilot.process_request('c1', dict(request, idempotency_key='k1'))
+        pilot.process_request('c1', dict(request))
+    first, second = [record for record in caplog.records if record.getMessage().startswith('request finished')]
+    # The first request reads and creates the profile, then commits the reward, its marker and a task.
+    assert (first.request_id, first.outcome, first.reads, first.writes) == ('k1', 'ok', 1, 4)
+    assert (second.request_id, second.reads, second.writes) == ('c1#2', 0, 2)
+    assert first.latency > 0
+    entry = json.loads(JsonFormatter().format(second))
+    assert (entry['request_id'], entry['customer_id'], entry['reads'], entry['writes']) == ('c1#2', 'c1', 0, 2)
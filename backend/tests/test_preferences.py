@@ -0,0 +1,48 @@
+import pytest
+
+from backend.preferences import PreferenceLearner
+
+
+def preferences(db, user_id='u1'):
+    data = db.collection('user_profiles').document(user_id).get().to_dict()
+    return data and data.get('preferences')
+
+
+def test_only_whole_words_and_phrases_are_found():
+    learner = PreferenceLearner(None)
+    assert learner.extract('Barbecue in Rio de Janeiro, then WiFi and a bar near the spa') == \
+        {'location': ['rio'], 'amenity': ['wi-fi', 'bar', 'spa']}
+    assert learner.extract('Spanish spaghetti at the barn') == {}
+
+
+def test_flush_merges_new_terms_into_the_profile(db):
+    db.collection('user_profiles').document('u1').set({'name': 'Ada', 'preferences': {'amenities_of_interest': ['gym']}})
+    learner = PreferenceLearner(db, collection='user_profiles')
+    assert learner.observe('u1', 'Is there a pool or a gym? We fly in from London.')
+    assert learner.observe('u2', 'Room service please')
+    assert learner.flush() == 2
+    assert preferences(db) == {'amenities_of_interest': ['gym', 'pool'], 'preferred_locations': ['london']}
+    assert preferences(db, 'u2') == {'amenities_of_interest': ['room service']}
+    assert db.collection('user_profiles').document('u1').get().to_dict()['name'] == 'Ada'
+
+
+def test_terms_already_written_are_not_written_again(db):
+    learner = PreferenceLearner(db, collection='user_profiles')
+    learner.observe('u1', 'pool')
+    learner.flush()
+    writes = db.writes
+    assert not learner.observe('u1', 'The pool again')
+    assert learner.flush() == 0
+    assert db.writes == writes
+    assert learner.stats() == {'pending_users': 0, 'messages': 2, 'learned': 1, 'flushed': 1}
+
+
+def test_failed_flush_keeps_the_terms_for_the_next_one(db):
+    learner = PreferenceLearner(db, collection='user_profiles')
+    learner.observe('u1', 'pool')
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        learner.flush()
+    learner.observe('u1', 'and the spa')
+    assert learner.flush() == 1
+    assert preferences(db) == {'amenities_of_interest': ['pool', 'spa']}
@@ -0,0 +1,46 @@
+import pytest
+
+from backend.pilot_engine import Pilot
+from backend.request_queue import RequestQueue
+from backend.token_ledger import TokenLedger
+
+QUERIES = ['I will reuse towels', 'Thank you, the room is great', 'The shower is broken and the staff were rude']
+
+
+def workload():
+    return [(f'customer_{i:03d}', {'type': 'query', 'query': query, 'hotel_id': 'hotel_1'})
+            for query in QUERIES for i in range(200)]
+
+
+def customers(db):
+    return {doc.id: (doc.to_dict()['tokens'], len(doc.to_dict()['rewards'])) for doc in db.collection('customers').stream()}
+
+
+@pytest.mark.parametrize('with_ledger', [False, True])
+def test_token_totals_are_exact_under_injected_commit_failures(storage, tmp_path, with_ledger):
+    expected_db = storage()
+    expected = Pilot(storage=expected_db)
+    for customer_id, request in workload():
+        expected.process_request(customer_id, dict(request))
+
+    # About one request commit in three fails once, the same ones on every run, so the retries
+    # do not depend on how the workers interleave.
+    db = storage(fail_one_in=3)
+    ledger = TokenLedger(db, path=str(tmp_path / 'ledger.log')) if with_ledger else None
+    pilot = Pilot(storage=db, ledger=ledger)
+    queue = RequestQueue(pilot, path=str(tmp_path / 'queue.db'), workers=4, max_attempts=20, retry_delay=0)
+    queue.start()
+    for customer_id, request in workload():
+        queue.submit(customer_id, request)
+    assert queue.join(timeout=60)
+    queue.close()
+    db.fail_once = None
+    if ledger is not None:
+        ledger.close()
+
+    assert db.injected > 0
+    assert queue.stats()['failed'] == 0
+    assert queue.stats()['processed'] == len(workload())
+    assert customers(db) == customers(expected_db)
+    for customer_id, (tokens, _) in customers(db).items():
+        assert pilot.profiles.get(customer_id).tokens == tokens
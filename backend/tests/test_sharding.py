@@ -0,0 +1,71 @@
+import functools
+import queue
+import threading
+
+from backend.models import GuestRequest
+from backend.sharding import HashRing, ShardedPilot, ShardRouter, _run_shard
+from backend.storage import SQLiteStorage
+
+REQUEST = {'type': 'query', 'query': 'The shower is broken', 'hotel_id': 'hotel_1'}
+
+
+def test_removing_a_node_only_moves_the_keys_it_owned():
+    ring = HashRing(['a', 'b', 'c'])
+    before = {f'hotel_{i}': ring.node_for(f'hotel_{i}') for i in range(500)}
+    ring.remove_node('b')
+    after = {key: ring.node_for(key) for key in before}
+    assert {key for key in before if before[key] != after[key]} == {key for key, node in before.items() if node == 'b'}
+    assert set(after.values()) == {'a', 'c'}
+
+
+def test_partitioned_hotels_keep_each_guest_on_one_shard():
+    router = ShardRouter(HashRing(['a', 'b', 'c', 'd']), hotel_partitions={'busy': 8})
+    shards = {router.shard_for('busy', f'guest_{i}') for i in range(200)}
+    assert len(shards) > 1
+    assert all(router.owns(shard, 'busy') for shard in shards)
+    assert router.shard_for('busy', 'guest_7') == router.shard_for('busy', 'guest_7')
+    assert router.route_key('quiet', 'guest_7') == 'quiet'
+
+
+def manager_tasks(db):
+    return [doc for doc in db.collection('tasks').stream() if doc.to_dict()['role'] == 'Manager']
+
+
+def test_shard_reloads_profiles_after_a_rebalance(db, customer):
+    customer('c1', negative_reviews_count=0)
+    inbox, outbox = queue.Queue(), queue.Queue()
+    worker = threading.Thread(target=_run_shard, args=('shard-0', lambda: db, ['shard-0'], 64, {}, inbox, outbox))
+    worker.start()
+    inbox.put(('requests', [('c1', dict(REQUEST))]))
+    # Meanwhile another shard served the guest, who now has a history of negative reviews.
+    inbox.put(('sync',))
+    outbox.get()
+    db.collection('customers').document('c1').update({'negative_reviews_count': 5})
+    inbox.put(('assign', ['shard-0']))
+    assert outbox.get()[0] == 'assigned'
+    inbox.put(('requests', [('c1', dict(REQUEST))]))
+    inbox.put(('stop',))
+    assert outbox.get() == ('stopped', 'shard-0', 2, 0)
+    worker.join()
+    assert len(manager_tasks(db)) == 1
+
+
+def test_sharded_pilot_accepts_dicts_and_guest_requests(tmp_path):
+    path = str(tmp_path / 'pilot.db')
+    db = SQLiteStorage(path)
+    for i in range(4):
+        db.collection('hotels').document(f'hotel_{i}').set({'hotel_id': f'hotel_{i}', 'name': f'H{i}'})
+    pilot = ShardedPilot(functools.partial(SQLiteStorage, path), workers=2, batch_size=4)
+    pilot.start()
+    try:
+        for i in range(20):
+            request = dict(REQUEST, query='I will reuse towels', hotel_id=f'hotel_{i % 4}')
+            pilot.process_request(f'guest_{i}', GuestRequest.from_dict(request) if i % 2 else request)
+        pilot.add_worker()
+        for i in range(20):
+            pilot.process_request(f'guest_{i}', GuestRequest.from_dict(dict(REQUEST, query='I will reuse towels', hotel_id=f'hotel_{i % 4}')))
+    finally:
+        totals = pilot.stop()
+    assert sum(processed for processed, _ in totals.values()) == 40
+    assert sum(failed for _, failed in totals.values()) == 0
+    assert {doc.id: doc.to_dict()['tokens'] for doc in db.collection('customers').stream()} == {f'guest_{i}': 400 for i in range(20)}
@@ -0,0 +1,21 @@
+import random
+
+from backend.simulator.simulate_clients import MEDICAL_TEMPLATES, generate_guests, poisson_schedule
+
+MEDICAL_QUERIES = {flag: template['query'] for flag, template in MEDICAL_TEMPLATES}
+
+
+def test_only_guests_with_a_condition_send_requests_about_it():
+    rng = random.Random(5)
+    guests = generate_guests(300, 3, rng, 'run')
+    by_id = {guest['id']: guest for guest in guests}
+    schedule = poisson_schedule(guests, rate=1000, duration=5, rng=rng)
+    sent = {flag: set() for flag in MEDICAL_QUERIES}
+    for _, customer_id, request in schedule:
+        assert request['hotel_id'] == by_id[customer_id]['hotel_id']
+        for flag, query in MEDICAL_QUERIES.items():
+            if request['query'] == query:
+                assert by_id[customer_id][flag], (customer_id, query)
+                sent[flag].add(customer_id)
+    for flag in MEDICAL_QUERIES:
+        assert sent[flag], flag
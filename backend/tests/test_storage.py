@@ -0,0 +1,100 @@
+import datetime
+import threading
+
+import pytest
+
+from backend.storage import SERVER_TIMESTAMP, AlreadyExists, ArrayUnion, Increment, MemoryStorage, NotFound, SQLiteStorage
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def local(request, tmp_path):
+    """Each local backend in turn, empty."""
+    if request.param == 'memory':
+        return MemoryStorage()
+    return SQLiteStorage(str(tmp_path / 'pilot.db'))
+
+
+def doc(storage, document_id='c1'):
+    return storage.collection('customers').document(document_id)
+
+
+def test_create_fails_on_an_existing_document(local):
+    doc(local).create({'tokens': 1})
+    with pytest.raises(AlreadyExists):
+        doc(local).create({'tokens': 2})
+    assert doc(local).get().to_dict() == {'tokens': 1}
+
+
+def test_update_fails_on_a_missing_document(local):
+    with pytest.raises(NotFound):
+        doc(local).update({'tokens': 1})
+    assert not doc(local).get().exists
+
+
+def test_transforms_apply_to_stored_values(local):
+    doc(local).set({'tokens': 5, 'rewards': [{'type': 'a'}], 'name': 'Ada'})
+    doc(local).update({'tokens': Increment(10), 'name': Increment(1), 'visits': Increment(2),
+                       'rewards': ArrayUnion([{'type': 'a'}, {'type': 'b'}]), 'preferences.tags': ArrayUnion(['gym']),
+                       'seen_at': SERVER_TIMESTAMP})
+    data = doc(local).get().to_dict()
+    assert data.pop('seen_at').tzinfo is datetime.timezone.utc
+    # Fields that are missing or not numbers count as 0 for an increment.
+    assert data == {'tokens': 15, 'name': 1, 'visits': 2, 'rewards': [{'type': 'a'}, {'type': 'b'}],
+                    'preferences': {'tags': ['gym']}}
+
+
+def test_merge_set_keeps_fields_it_does_not_name(local):
+    doc(local).set({'tokens': 5, 'preferences': {'amenities': ['spa'], 'locations': ['rome']}})
+    doc(local).set({'preferences': {'amenities': ArrayUnion(['gym'])}, 'tokens': Increment(1)}, merge=True)
+    assert doc(local).get().to_dict() == {'tokens': 6, 'preferences': {'amenities': ['spa', 'gym'], 'locations': ['rome']}}
+    doc(local).set({'name': 'Ada'})
+    assert doc(local).get().to_dict() == {'name': 'Ada'}
+
+
+def test_batch_is_applied_entirely_or_not_at_all(local):
+    doc(local, 'c1').set({'tokens': 0})
+    batch = local.batch()
+    batch.update(doc(local, 'c1'), {'tokens': Increment(1)})
+    batch.set(doc(local, 'c2'), {'tokens': 5})
+    batch.update(doc(local, 'missing'), {'tokens': 1})
+    with pytest.raises(NotFound):
+        batch.commit()
+    assert doc(local, 'c1').get().to_dict() == {'tokens': 0}
+    assert not doc(local, 'c2').get().exists
+
+    batch = local.batch()
+    batch.update(doc(local, 'c1'), {'tokens': Increment(1)})
+    batch.update(doc(local, 'c1'), {'tokens': Increment(1)})
+    batch.delete(doc(local, 'c1'))
+    batch.create(doc(local, 'c1'), {'tokens': 7})
+    batch.commit()
+    assert doc(local, 'c1').get().to_dict() == {'tokens': 7}
+
+
+def test_snapshots_are_copies_and_streams_are_ordered_by_id(local):
+    for document_id in ('b', 'a', 'c'):
+        doc(local, document_id).set({'rewards': []})
+    data = doc(local, 'a').get().to_dict()
+    data['rewards'].append('mutated')
+    assert doc(local, 'a').get().to_dict() == {'rewards': []}
+    assert [snapshot.id for snapshot in local.collection('customers').stream()] == ['a', 'b', 'c']
+    doc(local, 'b').delete()
+    assert [snapshot.id for snapshot in local.collection('customers').stream()] == ['a', 'c']
+
+
+def test_sqlite_increments_from_many_connections_are_not_lost(tmp_path):
+    path = str(tmp_path / 'pilot.db')
+    doc(SQLiteStorage(path)).set({'tokens': 0})
+
+    def increment():
+        # One storage, and so one connection per thread, each like a separate process.
+        storage = SQLiteStorage(path)
+        for _ in range(25):
+            doc(storage).update({'tokens': Increment(1)})
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert doc(SQLiteStorage(path)).get().to_dict() == {'tokens': 100}
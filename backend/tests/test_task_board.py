@@ -0,0 +1,43 @@
+import datetime
+
+import pytest
+
+from backend.task_board import TaskBoard
+
+START = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def db(db):
+    for i, priority in enumerate(['High', 'Low', 'Low']):
+        db.collection('tasks').document(f't{i}').set({
+            'role': 'Housekeeping', 'description': f'task {i}', 'priority': priority, 'hotel_id': 'hotel_1',
+            'timestamp': START + datetime.timedelta(minutes=i), 'status': 'pending'
+        })
+    return db
+
+
+def ids(board, hotel_id='hotel_1', role='Housekeeping'):
+    return [task.id for task in board.next_tasks(hotel_id, role)[0]]
+
+
+def test_refresh_reindexes_tasks_whose_priority_role_or_hotel_changed(db):
+    board = TaskBoard(db, live=False)
+    assert ids(board) == ['t0', 't1', 't2']
+    tasks = db.collection('tasks')
+    tasks.document('t2').update({'priority': 'Critical'})
+    tasks.document('t1').update({'role': 'Maintenance'})
+    tasks.document('t0').update({'hotel_id': 'hotel_2'})
+    board.refresh()
+    assert ids(board) == ['t2']
+    assert ids(board, role='Maintenance') == ['t1']
+    assert ids(board, hotel_id='hotel_2') == ['t0']
+
+
+def test_refresh_drops_completed_and_removed_tasks(db):
+    board = TaskBoard(db, live=False)
+    db.collection('tasks').document('t0').update({'status': 'completed'})
+    db.collection('tasks').document('t1').delete()
+    board.refresh()
+    assert ids(board) == ['t2']
+    assert board.stats() == {'open': 1, 'pending': 1, 'claimed': 0}
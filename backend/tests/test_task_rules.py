@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from backend.models import CustomerProfile, Priority, Role
+from backend.task_rules import TaskRules, compile_template
+
+CONTEXT = (CustomerProfile('c1', name='Ada', room_number=12), {'name': 'H1'}, ['Wi-Fi'], 'service_request', 'tech_support', 'negative')
+
+
+def rules_file(tmp_path, rules, alerts=(), classes=None):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'rules': rules, 'alerts': list(alerts), 'classes': classes or {}}))
+    return str(path)
+
+
+def task(description, role='Front Desk', priority='Low'):
+    return {'role': role, 'description': description, 'priority': priority}
+
+
+def describe(rules, category, intent, sentiment, profile=CONTEXT[0], hotel=CONTEXT[1]):
+    return [(task.role, task.description) for task in rules.tasks_for(category, intent, sentiment, profile, hotel, [])]
+
+
+def test_templates_render_fields_with_conversions_and_format_specs():
+    render = compile_template('{customer_name!r:>7} in {room_number:>3}, {hotel_name} ({entities}) {{literal}}')
+    assert render(CONTEXT) == "  'Ada' in  12, H1 (['Wi-Fi']) {literal}"
+    assert compile_template('{customer_name} in room {room_number}')((CustomerProfile('c2'), {}, [], '', '', '')) == \
+        'Guest in room unknown'
+
+
+@pytest.mark.parametrize('template, error', [
+    ('{customer_name!x}', 'unknown conversion'),
+    ('{customer_name:{room_number}}', 'nested replacement fields'),
+    ('{entities:>10}', 'invalid format spec'),
+    ('{customer_name:d}', 'invalid format spec'),
+    # Guests without a room number render as 'unknown'.
+    ('{room_number:03d}', 'invalid format spec'),
+    ('{guest}', 'unknown template field'),
+    ('{customer_name.upper}', 'unknown template field'),
+    ('{customer_name', 'invalid template')
+])
+def test_templates_that_cannot_render_are_rejected_when_loaded(template, error):
+    with pytest.raises(ValueError, match=error):
+        compile_template(template)
+
+
+def test_most_specific_rule_wins_and_alerts_come_first(tmp_path):
+    path = rules_file(tmp_path, [
+        {'category': 'service_request', 'tasks': [task('any {intent}')]},
+        {'category': 'service_request', 'intent': 'tech_support', 'tasks': [task('wifi for {customer_name}', role='IT Support')]},
+        {'sentiment': 'negative', 'tasks': []}
+    ], alerts=[{'field': 'negative_reviews_count', 'above': 1, 'tasks': [task('alert', role='Manager', priority='Critical')]}])
+    rules = TaskRules(path, check_interval=None)
+    assert describe(rules, 'service_request', 'tech_support', 'neutral') == [(Role.IT_SUPPORT, 'wifi for Ada')]
+    assert describe(rules, 'service_request', 'food_order', 'neutral') == [(Role.FRONT_DESK, 'any food_order')]
+    assert describe(rules, 'review', 'general_inquiry', 'negative') == []
+    unhappy = CustomerProfile('c1', negative_reviews_count=2, name='Ada')
+    assert describe(rules, 'review', 'general_inquiry', 'negative', profile=unhappy) == [(Role.MANAGER, 'alert')]
+
+
+def test_class_rules_replace_default_rules_for_hotels_of_that_class(tmp_path):
+    path = rules_file(tmp_path, [{'category': 'review', 'tasks': [task('default')]}],
+                      classes={'lodge': {'rules': [{'category': 'review', 'tasks': [task('lodge', priority='High')]}]}})
+    rules = TaskRules(path, check_interval=None)
+    assert describe(rules, 'review', 'x', 'y') == [(Role.FRONT_DESK, 'default')]
+    [lodge] = rules.tasks_for('review', 'x', 'y', CONTEXT[0], {'class': 'lodge'}, [])
+    assert (lodge.description, lodge.priority) == ('lodge', Priority.HIGH)
+
+
+def test_invalid_rules_file_keeps_the_old_rules(tmp_path):
+    path = rules_file(tmp_path, [{'category': 'review', 'tasks': [task('old')]}])
+    rules = TaskRules(path, check_interval=None)
+    rules_file(tmp_path, [{'category': 'review', 'tasks': [task('new {customer_name!x}')]}])
+    assert not rules.reload()
+    assert describe(rules, 'review', 'x', 'y') == [(Role.FRONT_DESK, 'old')]
+    rules_file(tmp_path, [{'category': 'review', 'tasks': [task('new')]}])
+    assert rules.reload()
+    assert describe(rules, 'review', 'x', 'y') == [(Role.FRONT_DESK, 'new')]
@@ -0,0 +1,60 @@
+import pytest
+
+from backend.storage import MemoryStorage
+from backend.telemetry import TelemetryAggregator
+
+NOW = 1767225600.0
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def reading(hotel_id, room_id, timestamp, kwh=1.0):
+    return {'hotel_id': hotel_id, 'room_id': room_id, 'timestamp': timestamp, 'realtime_usage': {'electricity_kwh': kwh}}
+
+
+def test_readings_for_flushed_buckets_are_dropped():
+    db, clock = MemoryStorage(), Clock()
+    telemetry = TelemetryAggregator(db, clock=clock)
+    telemetry.ingest(reading('hotel_1', '101', NOW + 10))
+    clock.now = NOW + 60
+    telemetry.flush()
+    telemetry.ingest(reading('hotel_1', '101', NOW + 20))
+    assert (telemetry.readings, telemetry.dropped) == (1, 1)
+    telemetry.ingest(reading('hotel_1', '101', NOW + 70))
+    assert (telemetry.readings, telemetry.dropped) == (2, 1)
+
+
+def test_rollup_ids_do_not_collide_for_ids_containing_the_separator():
+    db, clock = MemoryStorage(), Clock()
+    telemetry = TelemetryAggregator(db, clock=clock)
+    telemetry.ingest(reading('a_b', 'c', NOW, kwh=1.0))
+    telemetry.ingest(reading('a', 'b_c', NOW, kwh=2.0))
+    telemetry.ingest(reading('x:y', 'z/1', NOW, kwh=4.0))
+    clock.now = NOW + 60
+    assert telemetry.flush() == 6
+    rooms = {doc.id: doc.to_dict()['usage']['electricity_kwh'] for doc in db.collection('realtime_rollups').stream()
+             if doc.to_dict()['level'] == 'room'}
+    assert rooms == {'room:a_b:c:1767204060': 1.0, 'room:a:b_c:1767204060': 2.0, 'room:x%3Ay:z%2F1:1767204060': 4.0}
+
+
+def test_failed_flush_leaves_its_buckets_open_for_the_next_flush(db):
+    clock = Clock()
+    telemetry = TelemetryAggregator(db, clock=clock)
+    telemetry.ingest(reading('hotel_1', '101', NOW + 10))
+    clock.now = NOW + 60
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        telemetry.flush()
+    telemetry.ingest(reading('hotel_1', '101', NOW + 20, kwh=2.0))
+    assert (telemetry.readings, telemetry.dropped) == (2, 0)
+    assert telemetry.flush() == 3
+    [room] = [doc.to_dict() for doc in db.collection('realtime_rollups').stream() if doc.to_dict()['level'] == 'room']
+    assert (room['readings'], room['usage']['electricity_kwh']) == (2, 3.0)
+    telemetry.ingest(reading('hotel_1', '101', NOW + 30))
+    assert telemetry.dropped == 1
@@ -0,0 +1,72 @@
+import pytest
+
+from backend.pilot_engine import Pilot
+from backend.storage import ArrayUnion, Increment
+from backend.token_ledger import TokenLedger
+
+
+def test_flush_writes_summed_deltas_and_sequence(db, customer, tmp_path):
+    doc_ref = customer()
+    ledger = TokenLedger(db, path=str(tmp_path / 'ledger.log'))
+    ledger.record('c1', {'tokens': Increment(100), 'rewards': ArrayUnion([{'type': 'a'}])})
+    ledger.record('c1', {'tokens': Increment(5)})
+    assert ledger.flush() == 1
+    assert doc_ref.get().to_dict() == {'tokens': 105, 'rewards': [{'type': 'a'}], 'ledger_seqs': {'default': 2}}
+    ledger.close()
+
+
+def test_replay_skips_events_already_applied_per_ledger_seqs(db, customer, tmp_path):
+    doc_ref = customer()
+    path = str(tmp_path / 'ledger.log')
+    ledger = TokenLedger(db, path=path)
+    for amount in (1, 10, 100):
+        ledger.record('c1', {'tokens': Increment(amount)})
+    # A flush of the first two events committed, but the process died before rewriting the log.
+    doc_ref.update({'tokens': 11, 'ledger_seqs.default': 2})
+    ledger._log.close()
+
+    replayed = TokenLedger(db, path=path)
+    assert replayed.pending_updates('c1') == {'tokens': Increment(100)}
+    replayed.close()
+    assert doc_ref.get().to_dict()['tokens'] == 111
+    assert TokenLedger(db, path=path).pending_updates('c1') == {}
+
+
+def test_discarded_events_stay_discarded_but_a_retry_under_the_same_key_is_replayed(db, customer, tmp_path):
+    customer()
+    path = str(tmp_path / 'ledger.log')
+    ledger = TokenLedger(db, path=path)
+    ledger.record('c1', {'tokens': Increment(200)}, key='k1')
+    assert ledger.discard('k1') == 1
+    ledger.record('c1', {'tokens': Increment(200)}, key='k1')
+    ledger._log.close()
+
+    assert TokenLedger(db, path=path).pending_updates('c1') == {'tokens': Increment(200)}
+
+
+@pytest.mark.parametrize('key', [None, 'k1'])
+def test_failed_commit_records_no_ledger_events(db, customer, tmp_path, key):
+    doc_ref = customer()
+    ledger = TokenLedger(db, path=str(tmp_path / 'ledger.log'))
+    pilot = Pilot(storage=db, ledger=ledger)
+    request = {'type': 'query', 'query': 'I will reuse towels', 'hotel_id': 'hotel_1', 'idempotency_key': key}
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        pilot.process_request('c1', dict(request))
+    assert ledger.pending_updates('c1') == {}
+    assert pilot.profiles.get('c1').tokens == 0
+    pilot.process_request('c1', dict(request))
+    ledger.close()
+    assert doc_ref.get().to_dict()['tokens'] == 200
+    assert pilot.profiles.get('c1').tokens == 200
+
+
+def test_duplicate_delivery_records_no_ledger_events(db, customer, tmp_path):
+    doc_ref = customer()
+    ledger = TokenLedger(db, path=str(tmp_path / 'ledger.log'))
+    request = {'type': 'query', 'query': 'I will reuse towels', 'hotel_id': 'hotel_1', 'idempotency_key': 'k1'}
+    Pilot(storage=db, ledger=ledger).process_request('c1', dict(request))
+    # A fresh process only learns of the first delivery when its marker create fails.
+    Pilot(storage=db, ledger=ledger).process_request('c1', dict(request))
+    ledger.close()
+    assert doc_ref.get().to_dict()['tokens'] == 200
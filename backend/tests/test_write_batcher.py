@@ -0,0 +1,167 @@
+import threading
+
+import pytest
+
+from backend.storage import ArrayUnion, Increment
+from backend.write_batcher import WriteBatcher
+
+
+def test_increments_and_array_unions_are_merged_into_one_write(db, customer):
+    doc_ref = customer()
+    writes = WriteBatcher(db).begin()
+    writes.update(doc_ref, {'tokens': Increment(2)})
+    writes.update(doc_ref, {'tokens': Increment(200), 'rewards': ArrayUnion([{'type': 'a'}])})
+    writes.update(doc_ref, {'rewards': ArrayUnion([{'type': 'b'}]), 'positive_reviews_count': Increment(1)})
+    assert len(writes._pending.ops) == 1
+    writes.commit()
+    assert doc_ref.get().to_dict() == {'tokens': 202, 'rewards': [{'type': 'a'}, {'type': 'b'}], 'positive_reviews_count': 1}
+
+
+def test_plain_value_after_transform_stays_a_separate_write(db, customer):
+    doc_ref = customer()
+    writes = WriteBatcher(db).begin()
+    writes.update(doc_ref, {'tokens': Increment(5)})
+    writes.update(doc_ref, {'tokens': 1})
+    writes.update(doc_ref, {'tokens': Increment(3)})
+    assert len(writes._pending.ops) == 3
+    writes.commit()
+    assert doc_ref.get().to_dict()['tokens'] == 4
+
+
+def test_set_ends_merging_into_earlier_update(db, customer):
+    doc_ref = customer()
+    writes = WriteBatcher(db).begin()
+    writes.update(doc_ref, {'tokens': Increment(5)})
+    writes.set(doc_ref, {'tokens': 10, 'rewards': []})
+    writes.update(doc_ref, {'tokens': Increment(1)})
+    writes.commit()
+    assert doc_ref.get().to_dict()['tokens'] == 11
+
+
+def test_request_batches_commit_only_their_own_writes(db, customer, tokens):
+    batcher = WriteBatcher(db)
+    first, second = batcher.begin(), batcher.begin()
+    first.update(customer('c1'), {'tokens': Increment(1)})
+    second.update(customer('c2'), {'tokens': Increment(1)})
+    first.commit()
+    assert tokens('c1') == 1
+    assert tokens('c2') == 0
+    second.commit()
+    assert tokens('c2') == 1
+    assert batcher.commits == 2
+
+
+def test_failed_commit_skips_callbacks_and_leaves_other_batches_alone(db, customer, tokens):
+    batcher = WriteBatcher(db)
+    committed = []
+    failing, other = batcher.begin(), batcher.begin()
+    failing.update(db.collection('customers').document('missing'), {'tokens': Increment(1)})
+    failing.after_commit(lambda: committed.append('failing'))
+    other.update(customer(), {'tokens': Increment(1)})
+    other.after_commit(lambda: committed.append('other'))
+    with pytest.raises(db.NotFound):
+        failing.commit()
+    other.commit()
+    assert committed == ['other']
+    assert tokens('c1') == 1
+
+
+def test_concurrent_requests_each_commit_their_own_writes(db, customer):
+    batcher = WriteBatcher(db)
+    refs = [customer(f'c{i}') for i in range(8)]
+
+    def work(doc_ref):
+        for _ in range(50):
+            writes = batcher.begin()
+            writes.update(doc_ref, {'tokens': Increment(1)})
+            writes.update(doc_ref, {'tokens': Increment(1)})
+            writes.commit()
+
+    threads = [threading.Thread(target=work, args=(doc_ref,)) for doc_ref in refs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [doc_ref.get().to_dict()['tokens'] for doc_ref in refs] == [100] * 8
+    assert batcher.commits == 400 and batcher.writes == 400
+
+
+def test_windowed_requests_are_merged_and_committed_on_flush(db, customer):
+    batcher = WriteBatcher(db, flush_interval=60)
+    doc_ref = customer()
+    for amount in (1, 2, 3):
+        writes = batcher.begin()
+        assert not writes.exclusive
+        writes.update(doc_ref, {'tokens': Increment(amount)})
+        writes.commit()
+    assert doc_ref.get().to_dict()['tokens'] == 0
+    batcher.flush()
+    assert doc_ref.get().to_dict()['tokens'] == 6
+    assert batcher.commits == 1 and batcher.writes == 1
+
+
+def test_shared_buffer_flushes_at_max_ops(db):
+    batcher = WriteBatcher(db, max_ops=3)
+    for i in range(7):
+        batcher.set(db.collection('tasks').document(f't{i}'), {'n': i})
+    assert batcher.commits == 2
+    batcher.flush()
+    assert len(list(db.collection('tasks').stream())) == 7
+
+
+def test_windowed_callbacks_run_once_the_window_is_committed(db, customer):
+    batcher = WriteBatcher(db, flush_interval=60)
+    committed = []
+    writes = batcher.begin()
+    writes.update(customer(), {'tokens': Increment(1)})
+    writes.after_commit(lambda: committed.append('c1'))
+    writes.commit()
+    assert committed == []
+    batcher.flush()
+    assert committed == ['c1']
+
+
+
+def windowed_request(batcher, db, customer_id, committed):
+    writes = batcher.begin()
+    writes.update(db.collection('customers').document(customer_id), {'tokens': Increment(1)})
+    writes.after_commit(lambda: committed.append(customer_id))
+    writes.commit()
+
+
+def test_failed_windowed_flush_keeps_the_writes_for_the_next_flush(db, customer, tokens):
+    batcher = WriteBatcher(db, flush_interval=60)
+    committed = []
+    for customer_id in ('c1', 'c2', 'c3'):
+        customer(customer_id)
+    for customer_id in ('c1', 'c2'):
+        windowed_request(batcher, db, customer_id, committed)
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        batcher.flush()
+    assert committed == []
+    windowed_request(batcher, db, 'c3', committed)
+    batcher.flush()
+    assert [tokens(customer_id) for customer_id in ('c1', 'c2', 'c3')] == [1, 1, 1]
+    assert committed == ['c1', 'c2', 'c3']
+    assert batcher.commits == 1 and batcher.writes == 3
+
+
+def test_failed_flush_of_a_full_window_requeues_only_the_uncommitted_batches(db, customer, tokens):
+    batcher = WriteBatcher(db, max_ops=2, flush_interval=60)
+    committed = []
+    for customer_id in ('c1', 'c2', 'c3'):
+        customer(customer_id)
+    db.failures = 1
+    # The window fills up with c2, and the failed flush is not raised to c2's request.
+    for customer_id in ('c1', 'c2'):
+        windowed_request(batcher, db, customer_id, committed)
+    assert tokens('c1') == 0 and batcher._timer is not None
+    db.fail_once = lambda identity: identity == ('update:customers/c3',)
+    windowed_request(batcher, db, 'c3', committed)
+    assert (tokens('c1'), tokens('c2'), tokens('c3')) == (1, 1, 0)
+    assert committed == []
+    batcher.flush()
+    assert (tokens('c1'), tokens('c2'), tokens('c3')) == (1, 1, 1)
+    assert committed == ['c1', 'c2', 'c3']
+    assert batcher._timer is None
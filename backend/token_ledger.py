@@ -0,0 +1,344 @@
+"""
+Write-behind ledger for customer token balances and reward histories.
+
+Instead of an `Increment`/`ArrayUnion` update on the customer document for every
+reward, politeness bonus or review, each event is appended to a local log file and
+folded into a per-customer delta in memory. `flush` writes one update per customer
+with the summed deltas, in batches of up to 500, and then rewrites the log with only
+the events still pending. After a crash, the events in the log are replayed on
+startup; every flushed update also records the last sequence number applied to the
+document (`ledger_seqs.<name>`), so events that were flushed before the log was
+rewritten are not applied twice.
+
+Reward histories are compacted as they are flushed: once a customer's `rewards`
+array holds more than `max_rewards` entries, the oldest are folded into a
+`reward_summary` of {'entries': ..., 'tokens': ...} and only the newest
+`max_rewards // 2` are kept.
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+from backend.storage import ArrayUnion, Increment
+from backend.write_batcher import MAX_BATCH_OPS
+
+logger = logging.getLogger(__name__)
+
+_REWARD_TOKENS = re.compile(r'-?\d+')
+
+
+def _reward_tokens(reward):
+    """Returns the tokens of a reward entry, read from its 'details' (e.g. '100 tokens for ...')."""
+    match = _REWARD_TOKENS.match(str(reward.get('details', ''))) if isinstance(reward, dict) else None
+    return int(match.group()) if match else 0
+
+
+class _Delta:
+    """The pending events of one customer and their sums."""
+    __slots__ = ('increments', 'unions', 'seq', 'events')
+
+    def __init__(self):
+        self.increments = {}
+        self.unions = {}
+        self.seq = 0
+        self.events = []
+
+    def add(self, event):
+        for name, value in event.get('increments', {}).items():
+            self.increments[name] = self.increments.get(name, 0) + value
+        for name, values in event.get('unions', {}).items():
+            self.unions.setdefault(name, []).extend(values)
+        self.seq = max(self.seq, event['seq'])
+        self.events.append(event)
+
+    def updates(self):
+        updates = {name: Increment(value) for name, value in self.increments.items() if value}
+        updates.update((name, ArrayUnion(values)) for name, values in self.unions.items())
+        return updates
+
+
+class TokenLedger:
+    """
+    Buffers customer token updates in an append-only log at `path` and flushes them
+    to `collection` in batches. Events are written to the log before they are
+    counted, so a flush can fail or the process can die without losing tokens; with
+    `sync` each event is also fsynced, which survives a machine crash at the cost of
+    a disk flush per event.
+
+    `name` identifies this ledger's sequence numbers in the customer documents; give
+    each process writing the same customers its own name and log. Compaction reads
+    the customer document, so it only runs for customers whose cached profile in
+    `profiles` (the Pilot's ProfileCache) is over `max_rewards`.
+    """
+
+    def __init__(self, db, path='token_ledger.log', name='default', collection='customers', max_rewards=50,
+                 profiles=None, sync=False):
+        if max_rewards < 2:
+            raise ValueError(f"max_rewards must be at least 2, got {max_rewards}")
+        self.db = db
+        self.path = path
+        self.name = name
+        self.collection = collection
+        self.max_rewards = max_rewards
+        self.profiles = profiles
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._seq = 0
+        self.recorded = 0
+        self.flushed = 0
+        self.compacted = 0
+        torn = self._replay()
+        self._log = open(path, 'a', encoding='utf-8')
+        if torn:
+            # Start new events on a line of their own.
+            self._append_raw('\n')
+
+    # --- Recording ---
+
+    def record(self, customer_id, updates, key=None):
+        """
+        Records a customer update of `Increment`s and `ArrayUnion`s, e.g.
+        {'tokens': Increment(100), 'rewards': ArrayUnion([...])}. `key` is the
+        idempotency key of the request it belongs to, for `discard`.
+        """
+        increments, unions = {}, {}
+        for name, value in updates.items():
+            if isinstance(value, Increment):
+                increments[name] = value.value
+            elif isinstance(value, ArrayUnion):
+                unions[name] = list(value.values)
+            else:
+                raise ValueError(f"the token ledger only records Increment and ArrayUnion updates, got {name}={value!r}")
+        with self._lock:
+            self._seq += 1
+            event = {'seq': self._seq, 'customer_id': customer_id}
+            if increments:
+                event['increments'] = increments
+            if unions:
+                event['unions'] = unions
+            if key is not None:
+                event['key'] = key
+            self._append(event)
+            self._delta(customer_id).add(event)
+            self.recorded += 1
+
+    def discard(self, key):
+        """Drops the pending events recorded for the idempotency key `key`; returns how many."""
+        with self._lock:
+            dropped = 0
+            for customer_id, delta in list(self._pending.items()):
+                kept = [event for event in delta.events if event.get('key') != key]
+                if len(kept) == len(delta.events):
+                    continue
+                dropped += len(delta.events) - len(kept)
+                self._rebuild(customer_id, kept)
+            if dropped:
+                # Bounded by the current sequence number, so a retry's events under the same key survive a replay.
+                self._append({'discard': key, 'seq': self._seq})
+            return dropped
+
+    def pending_updates(self, customer_id):
+        """Returns the unflushed updates of a customer, to apply to a profile freshly read from storage."""
+        with self._lock:
+            delta = self._pending.get(customer_id)
+            return delta.updates() if delta is not None else {}
+
+    def _delta(self, customer_id):
+        delta = self._pending.get(customer_id)
+        if delta is None:
+            delta = self._pending[customer_id] = _Delta()
+        return delta
+
+    def _rebuild(self, customer_id, events):
+        self._pending.pop(customer_id, None)
+        for event in events:
+            self._delta(customer_id).add(event)
+
+    def _append(self, entry):
+        self._append_raw(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def _append_raw(self, text):
+        self._log.write(text)
+        self._log.flush()
+        if self.sync:
+            os.fsync(self._log.fileno())
+
+    # --- Flushing ---
+
+    def flush(self):
+        """Writes the pending deltas to the customer documents; returns how many customers were updated."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+            customer_ids = list(pending)
+            failed = []
+            for start in range(0, len(customer_ids), MAX_BATCH_OPS):
+                failed.extend(self._commit(customer_ids[start:start + MAX_BATCH_OPS], pending))
+            with self._lock:
+                # Events recorded during the flush go after the ones that could not be written.
+                for customer_id in failed:
+                    newer = self._pending.pop(customer_id, None)
+                    self._rebuild(customer_id, pending[customer_id].events + (newer.events if newer else []))
+                self._rewrite_log()
+            flushed = len(customer_ids) - len(failed)
+            self.flushed += flushed
+            if flushed:
+                logger.debug("token ledger flushed customers=%d", flushed)
+            failed = set(failed)
+            self._compact([customer_id for customer_id in customer_ids if customer_id not in failed])
+            return flushed
+
+    def _commit(self, customer_ids, pending):
+        """Commits the deltas of `customer_ids` in one batch; returns the customers whose update failed."""
+        collection = self.db.collection(self.collection)
+        batch = self.db.batch()
+        for customer_id in customer_ids:
+            delta = pending[customer_id]
+            updates = delta.updates()
+            updates[f'ledger_seqs.{self.name}'] = delta.seq
+            batch.update(collection.document(customer_id), updates)
+        try:
+            batch.commit()
+        except self.db.NotFound as e:
+            if len(customer_ids) == 1:
+                logger.error("token ledger customer not found customer_id=%s error=%s", customer_ids[0], e)
+                return customer_ids
+            # One missing profile fails the whole batch; write the others one by one.
+            return [failed for customer_id in customer_ids for failed in self._commit([customer_id], pending)]
+        except Exception as e:
+            logger.error("token ledger flush failed customers=%d error=%s", len(customer_ids), e)
+            return customer_ids
+        return []
+
+    def _rewrite_log(self):
+        # The log is replaced by the still-pending events, headed by the current sequence number.
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'seq': self._seq}) + '\n')
+            for delta in self._pending.values():
+                for event in delta.events:
+                    f.write(json.dumps(event, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._log.close()
+        os.replace(tmp_path, self.path)
+        self._log = open(self.path, 'a', encoding='utf-8')
+
+    def _compact(self, customer_ids):
+        if self.profiles is None:
+            return
+        for customer_id in customer_ids:
+            profile = self.profiles.get(customer_id)
+            if profile is not None and len(profile.get('rewards') or ()) > self.max_rewards:
+                try:
+                    self.compact(customer_id)
+                except Exception as e:
+                    logger.error("reward compaction failed customer_id=%s error=%s", customer_id, e)
+
+    def compact(self, customer_id):
+        """
+        Folds all but the newest `max_rewards // 2` entries of a customer's `rewards`
+        into `reward_summary`, if the stored array is over `max_rewards`; returns the
+        number of entries folded.
+        """
+        doc_ref = self.db.collection(self.collection).document(customer_id)
+        doc = doc_ref.get()
+        data = doc.to_dict() if doc.exists else {}
+        rewards = data.get('rewards') or []
+        if len(rewards) <= self.max_rewards:
+            return 0
+        keep = self.max_rewards // 2
+        folded, kept = rewards[:-keep], rewards[-keep:]
+        summary = dict(data.get('reward_summary') or {})
+        summary['entries'] = summary.get('entries', 0) + len(folded)
+        summary['tokens'] = summary.get('tokens', 0) + sum(_reward_tokens(reward) for reward in folded)
+        # Plain writes of the whole array: rewards of this ledger's customers are only appended by its flushes.
+        updates = {'rewards': kept, 'reward_summary': summary}
+        doc_ref.update(updates)
+        if self.profiles is not None:
+            self.profiles.apply_update(customer_id, updates)
+        self.compacted += 1
+        logger.debug("rewards compacted customer_id=%s folded=%d", customer_id, len(folded))
+        return len(folded)
+
+    def start_flusher(self, interval=30):
+        """Flushes every `interval` seconds from a background thread; returns an Event that stops it."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("error flushing the token ledger")
+
+        threading.Thread(target=run, name='token-ledger-flusher', daemon=True).start()
+        return stop
+
+    def close(self):
+        """Flushes the pending deltas and closes the log."""
+        self.flush()
+        with self._lock:
+            self._log.close()
+
+    # --- Replay ---
+
+    def _replay(self):
+        """
+        Reloads the events left in the log by a previous process, skipping those already
+        flushed; returns True if the log ends in a partly written line.
+        """
+        if not os.path.exists(self.path):
+            return False
+        events, discarded = [], {}
+        line = '\n'
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be torn by a crash mid-write.
+                    logger.warning("token ledger skipped unreadable entry path=%s line=%d", self.path, line_number)
+                    continue
+                if 'discard' in entry:
+                    discarded[entry['discard']] = entry.get('seq', float('inf'))
+                elif 'customer_id' in entry:
+                    events.append(entry)
+                self._seq = max(self._seq, entry.get('seq', 0))
+        by_customer = {}
+        for event in events:
+            if event['seq'] > discarded.get(event.get('key'), 0):
+                by_customer.setdefault(event['customer_id'], []).append(event)
+        collection = self.db.collection(self.collection)
+        replayed = 0
+        for customer_id, customer_events in by_customer.items():
+            doc = collection.document(customer_id).get()
+            applied = ((doc.to_dict() or {}).get('ledger_seqs') or {}).get(self.name, 0) if doc.exists else 0
+            customer_events = [event for event in customer_events if event['seq'] > applied]
+            if customer_events:
+                self._rebuild(customer_id, customer_events)
+                replayed += len(customer_events)
+        if replayed:
+            logger.info("token ledger replayed events=%d customers=%d path=%s", replayed, len(self._pending), self.path)
+        return not line.endswith('\n')
+
+    def stats(self):
+        with self._lock:
+            return {'pending_customers': len(self._pending), 'pending_events': sum(len(delta.events) for delta in self._pending.values()),
+                    'recorded': self.recorded, 'flushed': self.flushed, 'compacted': self.compacted}
+
+    def collect_metrics(self):
+        """Metrics for PilotMetrics.add_collector."""
+        stats = self.stats()
+        return {
+            'pilot_ledger_pending_events': ('gauge', 'Token ledger events not yet flushed.', stats['pending_events']),
+            'pilot_ledger_recorded_total': ('counter', 'Token ledger events recorded.', stats['recorded']),
+            'pilot_ledger_flushed_customers_total': ('counter', 'Customer documents updated by token ledger flushes.', stats['flushed']),
+            'pilot_ledger_compactions_total': ('counter', 'Reward histories compacted.', stats['compacted'])
+        }
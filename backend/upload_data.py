@@ -1,26 +1,23 @@
 # upload_data.py
+# Uploads backend/hotels_data.json to the 'hotels' collection through the bulk loader.
+# Run from the repository root: python -m backend.upload_data
 
-import firebase_admin
-from firebase_admin import credentials, firestore
-import json
+import os
 
-# Replace with the path to your service account key file
-cred = credentials.Certificate(r"C:\Users\user\OneDrive\Documents\Hackathon_project\Eco-Pilot-Platform\backend\eco-pilot-realtime-firebase-adminsdk.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+from backend.bulk_loader import load_file
+from backend.metrics import configure_logging
+from backend.storage import firestore_storage
 
 # Path to the JSON file
-file_path = 'hotels_data.json'
+file_path = os.path.join(os.path.dirname(__file__), 'hotels_data.json')
 
-with open(file_path, 'r') as f:
-    hotels_data = json.load(f)
 
-# Upload each hotel as a new document to the 'hotels' collection
-def upload_data():
-    for hotel in hotels_data:
-        doc_ref = db.collection('hotels').document(hotel['id'])
-        doc_ref.set(hotel)
-        print(f"Successfully uploaded hotel: {hotel['name']}")
+def upload_data(db):
+    stats = load_file(db, file_path, 'hotels', 'id')
+    print(f"Successfully uploaded {stats['written']} hotels ({stats['unchanged']} unchanged, {stats['resumed']} already loaded).")
+
 
 if __name__ == '__main__':
-    upload_data()
\ No newline at end of file
+    configure_logging()
+    # Uses the service account key from ECO_PILOT_CREDENTIALS or backend/storage.py.
+    upload_data(firestore_storage())
@@ -0,0 +1,325 @@
+import logging
+import threading
+
+from backend.storage import ArrayUnion, Increment
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects a WriteBatch with more than 500 writes.
+MAX_BATCH_OPS = 500
+
+
+class _PendingWrites:
+    """Queued writes in order, with each document's latest update kept for merging, and their after-commit callbacks."""
+    __slots__ = ('ops', 'updates', 'callbacks')
+
+    def __init__(self):
+        self.ops = []
+        self.updates = {}
+        self.callbacks = []
+
+    def put(self, kind, doc_ref, data):
+        self.updates.pop(doc_ref.path, None)
+        self.ops.append([kind, doc_ref, data])
+
+    def update(self, doc_ref, updates):
+        pending = self.updates.get(doc_ref.path)
+        if pending is None or not _merge(pending[2], updates):
+            op = ['update', doc_ref, dict(updates)]
+            self.ops.append(op)
+            self.updates[doc_ref.path] = op
+
+    def extend(self, other):
+        """Queues the writes of another _PendingWrites after these, merging updates."""
+        for kind, doc_ref, data in other.ops:
+            if kind == 'update':
+                self.update(doc_ref, data)
+            else:
+                self.put(kind, doc_ref, data)
+        self.callbacks.extend(other.callbacks)
+
+
+def _merge(pending, updates):
+    """Merges `updates` into `pending` in place; returns False if the two cannot be combined."""
+    merged = {}
+    for field, value in updates.items():
+        if field not in pending:
+            merged[field] = value
+        elif isinstance(value, Increment) and isinstance(pending[field], Increment):
+            merged[field] = Increment(pending[field].value + value.value)
+        elif isinstance(value, ArrayUnion) and isinstance(pending[field], ArrayUnion):
+            merged[field] = ArrayUnion(pending[field].values + value.values)
+        else:
+            # A plain value after a transform (or vice versa) must stay a separate write.
+            return False
+    pending.update(merged)
+    return True
+
+
+def _run(callbacks):
+    for callback in callbacks:
+        callback()
+
+
+class RequestBatch:
+    """
+    The writes of one request, from WriteBatcher.begin().
+
+    Queues the same set/create/add/update calls as a WriteBatcher, with the same
+    merging, but only this request's writes: `commit` commits them as one WriteBatch,
+    or hands them to the batcher's shared window when writes are windowed across
+    requests. Callbacks registered with `after_commit` run once the writes are in
+    storage: after `commit`, or after the flush of the window holding them.
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self._pending = _PendingWrites()
+
+    @property
+    def size(self):
+        """The number of writes queued, after merging."""
+        return len(self._pending.ops)
+
+    @property
+    def exclusive(self):
+        """True if the writes are committed on their own, without other requests' writes."""
+        return self.batcher.flush_interval is None
+
+    def set(self, doc_ref, data):
+        """Queues a full document write."""
+        self._pending.put('set', doc_ref, data)
+
+    def create(self, doc_ref, data):
+        """Queues the creation of a document; the commit fails with AlreadyExists if it exists."""
+        self._pending.put('create', doc_ref, data)
+
+    def add(self, collection_ref, data):
+        """Queues the creation of a new document with a generated ID and returns its reference."""
+        doc_ref = collection_ref.document()
+        self._pending.put('set', doc_ref, data)
+        return doc_ref
+
+    def update(self, doc_ref, updates):
+        """Queues a partial update, merging it into a pending update of the same document when possible."""
+        self._pending.update(doc_ref, updates)
+
+    def after_commit(self, callback):
+        """Calls `callback()` once the writes have been committed; never if the commit fails."""
+        self._pending.callbacks.append(callback)
+
+    def _take(self):
+        pending, self._pending = self._pending, _PendingWrites()
+        return pending
+
+    def commit(self):
+        """Commits the queued writes, or hands them to the shared window."""
+        pending = self._take()
+        if not self.exclusive:
+            self.batcher._absorb(pending)
+            return
+        for batch, ops in self.batcher._batches(pending.ops):
+            batch.commit()
+            self.batcher._count(1, len(ops))
+        _run(pending.callbacks)
+
+    async def commit_async(self):
+        """Commits the queued writes through an async client, with the batches committed concurrently."""
+        import asyncio
+        pending = self._take()
+        if not self.exclusive:
+            self.batcher._absorb(pending)
+            return
+        batches = self.batcher._batches(pending.ops)
+        if batches:
+            await asyncio.gather(*(batch.commit() for batch, _ in batches))
+            self.batcher._count(len(batches), sum(len(ops) for _, ops in batches))
+        _run(pending.callbacks)
+
+
+class WriteBatcher:
+    """
+    Collects Firestore mutations and commits them together in a single WriteBatch.
+
+    Updates to a document that already has a pending update are merged into it:
+    `Increment`s on the same field are summed and `ArrayUnion`s are concatenated, so
+    several token changes to one customer become one write. The pilot queues each
+    request's writes on its own RequestBatch (from `begin`) and commits them at the
+    end of the request; with `flush_interval` set, the writes of consecutive requests
+    are instead held in a shared window for up to that many seconds (or until
+    `max_ops` is reached) and committed together. Writes queued on the batcher
+    itself go to that shared buffer and are committed by `flush`.
+
+    If a flush fails, the writes it could not commit go back to the front of the
+    buffer, with all the flushed callbacks, to be retried by the next flush; writes
+    rejected with NotFound or AlreadyExists would fail again and are dropped instead.
+    """
+
+    def __init__(self, db, max_ops=MAX_BATCH_OPS, flush_interval=None):
+        if not 0 < max_ops <= MAX_BATCH_OPS:
+            raise ValueError(f"max_ops must be between 1 and {MAX_BATCH_OPS}, got {max_ops}")
+        self.db = db
+        self.max_ops = max_ops
+        self.flush_interval = flush_interval
+        self.commits = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._pending = _PendingWrites()
+        self._timer = None
+
+    def begin(self):
+        """Returns a RequestBatch for the writes of one request."""
+        return RequestBatch(self)
+
+    def set(self, doc_ref, data):
+        """Queues a full document write."""
+        with self._lock:
+            self._pending.put('set', doc_ref, data)
+        self._after_queue()
+
+    def create(self, doc_ref, data):
+        """Queues the creation of a document; the commit fails with AlreadyExists if it exists."""
+        with self._lock:
+            self._pending.put('create', doc_ref, data)
+        self._after_queue()
+
+    def add(self, collection_ref, data):
+        """Queues the creation of a new document with a generated ID and returns its reference."""
+        doc_ref = collection_ref.document()
+        self.set(doc_ref, data)
+        return doc_ref
+
+    def update(self, doc_ref, updates):
+        """Queues a partial update, merging it into a pending update of the same document when possible."""
+        with self._lock:
+            self._pending.update(doc_ref, updates)
+        self._after_queue()
+
+    def after_commit(self, callback):
+        """Calls `callback()` once the writes queued so far have been committed by a flush."""
+        with self._lock:
+            self._pending.callbacks.append(callback)
+
+    def _absorb(self, pending):
+        # A windowed request's writes join the shared buffer.
+        with self._lock:
+            self._pending.extend(pending)
+        self._after_queue()
+
+    def _after_queue(self):
+        if len(self._pending.ops) < self.max_ops:
+            self._start_timer()
+        elif self.flush_interval is None:
+            self.flush()
+        else:
+            # The writes belong to the requests in the window, not to the one that filled it;
+            # if the flush fails they stay buffered for the timer to retry.
+            self._flush_on_timer()
+
+    def _start_timer(self):
+        if self.flush_interval is None:
+            return
+        with self._lock:
+            if self._timer is None and self._pending.ops:
+                self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("error committing batched writes")
+
+    def end_request(self):
+        """Flushes the shared buffer now unless writes are windowed across requests."""
+        if self.flush_interval is None:
+            self.flush()
+
+    def _take_batches(self):
+        """
+        Moves all writes of the shared buffer into WriteBatches of at most `max_ops` writes
+        each; returns them with the callbacks to run once they are all committed.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, _PendingWrites()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return self._batches(pending.ops), pending.callbacks
+
+    def _requeue(self, ops, callbacks, error):
+        """Puts writes a flush failed to commit back in front of the buffer, unless `error` is permanent."""
+        if isinstance(error, (self.db.NotFound, self.db.AlreadyExists)):
+            logger.error("batched writes dropped writes=%d error=%s", len(ops), error)
+            return
+        requeued = _PendingWrites()
+        for kind, doc_ref, data in ops:
+            if kind == 'update':
+                requeued.update(doc_ref, data)
+            else:
+                requeued.put(kind, doc_ref, data)
+        requeued.callbacks = callbacks
+        with self._lock:
+            requeued.extend(self._pending)
+            self._pending = requeued
+        logger.warning("batched writes requeued writes=%d error=%s", len(ops), error)
+        self._start_timer()
+
+    def _batches(self, ops):
+        """Splits `ops` into WriteBatches of at most `max_ops` writes; returns (batch, ops) pairs."""
+        batches = []
+        for start in range(0, len(ops), self.max_ops):
+            chunk = ops[start:start + self.max_ops]
+            batch = self.db.batch()
+            for kind, doc_ref, data in chunk:
+                if kind == 'set':
+                    batch.set(doc_ref, data)
+                elif kind == 'create':
+                    batch.create(doc_ref, data)
+                else:
+                    batch.update(doc_ref, data)
+            batches.append((batch, chunk))
+        return batches
+
+    def _count(self, commits, writes):
+        with self._lock:
+            self.commits += commits
+            self.writes += writes
+
+    def flush(self):
+        """Commits all writes of the shared buffer; on failure, requeues the uncommitted ones and raises."""
+        batches, callbacks = self._take_batches()
+        for i, (batch, ops) in enumerate(batches):
+            try:
+                batch.commit()
+            except Exception as e:
+                self._requeue([op for _, rest in batches[i:] for op in rest], callbacks, e)
+                raise
+            self._count(1, len(ops))
+        _run(callbacks)
+
+    async def flush_async(self):
+        """
+        Commits all writes of the shared buffer through an async client, with the batches
+        committed concurrently; on failure, requeues the uncommitted ones and raises.
+        """
+        import asyncio
+        batches, callbacks = self._take_batches()
+        if not batches:
+            _run(callbacks)
+            return
+        results = await asyncio.gather(*(batch.commit() for batch, _ in batches), return_exceptions=True)
+        failed = [(ops, result) for (_, ops), result in zip(batches, results) if isinstance(result, BaseException)]
+        committed = [ops for (_, ops), result in zip(batches, results) if not isinstance(result, BaseException)]
+        if committed:
+            self._count(len(committed), sum(len(ops) for ops in committed))
+        if failed:
+            error = failed[0][1]
+            self._requeue([op for ops, _ in failed for op in ops], callbacks, error)
+            raise error
+        _run(callbacks)
+
+    def close(self):
+        """Flushes any remaining writes."""
+        self.flush()
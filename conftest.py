@@ -0,0 +1 @@
+# Lets `pytest` import the `backend` package from the repository root, as `python -m pytest` does.
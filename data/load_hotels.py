@@ -1,60 +1,41 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import json
+# Uploads data/hotels_data.json to the 'hotels' collection in resumable 500-document batches.
+# Run from the repository root: python -m data.load_hotels
+
 import os
 
+from backend.bulk_loader import load_file
+from backend.metrics import configure_logging
+from backend.storage import firestore_storage
+
 # Ensure the path to your Firebase service account key is correct.
 # Replace this with the correct path to your JSON key file.
 # The path provided is an example based on a standard project structure.
 cred_path = os.path.join(os.path.dirname(__file__), '..', 'backend', 'eco-pilot-realtime-firebase-adminsdk.json')
 
-# Check if the credentials file exists
-if not os.path.exists(cred_path):
-    print(f"Error: Firebase credentials file not found at {cred_path}")
-    print("Please ensure your 'eco-pilot-realtime-firebase-adminsdk.json' file is in the 'backend' folder.")
-    exit()
-
-# Initialize Firebase App
-try:
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    print("Firebase initialized successfully.")
-except Exception as e:
-    print(f"Error initializing Firebase: {e}")
-    exit()
 
-def upload_hotels_data(json_file_path):
+def upload_hotels_data(db, json_file_path):
     """
-    Reads a JSON file containing hotel data and uploads it to the 'hotels' collection
-    in Firestore.
+    Streams a JSON file containing hotel data into the 'hotels' collection in Firestore.
     """
     try:
-        with open(json_file_path, 'r') as f:
-            hotels = json.load(f)
-        
-        print(f"Found {len(hotels)} hotels to upload.")
-        
-        for hotel in hotels:
-            hotel_id = hotel.get("hotel_id")
-            if not hotel_id:
-                print("Skipping a hotel entry with no 'hotel_id'.")
-                continue
-
-            doc_ref = db.collection('hotels').document(hotel_id)
-            doc_ref.set(hotel)
-            print(f"Successfully uploaded hotel: {hotel_id}")
-            
-        print("\nAll hotel data has been uploaded to Firestore.")
-    
+        stats = load_file(db, json_file_path, 'hotels', 'hotel_id')
+        print(f"\nAll hotel data has been uploaded to Firestore ({stats['written']} written, "
+              f"{stats['unchanged']} unchanged, {stats['resumed']} already loaded, {stats['skipped']} skipped).")
     except FileNotFoundError:
         print(f"Error: The file '{json_file_path}' was not found.")
-    except json.JSONDecodeError:
+    except ValueError:
         print(f"Error: The file '{json_file_path}' is not a valid JSON file.")
     except Exception as e:
         print(f"An error occurred during upload: {e}")
 
+
 if __name__ == '__main__':
+    # Check if the credentials file exists
+    if not os.path.exists(cred_path):
+        print(f"Error: Firebase credentials file not found at {cred_path}")
+        print("Please ensure your 'eco-pilot-realtime-firebase-adminsdk.json' file is in the 'backend' folder.")
+        exit()
+    configure_logging()
     # Adjust this path if your hotels_data.json file is in a different location
     json_path = os.path.join(os.path.dirname(__file__), 'hotels_data.json')
-    upload_hotels_data(json_path)
+    upload_hotels_data(firestore_storage(cred_path), json_path)
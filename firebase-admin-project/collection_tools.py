@@ -0,0 +1,117 @@
+"""
+Bulk maintenance of Firestore collections, for resetting staging data.
+
+Documents are listed with key-only queries (only document names are read), a page
+of up to 500 at a time, and each page is deleted in one batch. The batches are
+committed by a pool of worker threads while the next pages are read. With
+`recursive`, the query also returns the documents of every subcollection at any
+depth, including subcollections of documents that no longer exist. A run returns
+once every batch has been committed, and can be re-run safely if it is interrupted.
+
+    python collection_tools.py artifacts/default-app-id/public/data/user_profiles --recursive
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Firestore's limit on writes per batch.
+MAX_BATCH_SIZE = 500
+
+
+def iter_document_pages(db, collection_path, page_size=MAX_BATCH_SIZE, recursive=False):
+    """Yields the DocumentReferences of a collection in pages of `page_size`, without reading their data."""
+    from google.cloud.firestore_v1.field_path import FieldPath
+    query = db.collection(collection_path)
+    # recursive() already orders by document name, parents before their subcollections.
+    query = query.recursive() if recursive else query.order_by(FieldPath.document_id())
+    query = query.select([FieldPath.document_id()]).limit(page_size)
+    last = None
+    while True:
+        page = (query if last is None else query.start_after(last)).get()
+        if page:
+            yield [snapshot.reference for snapshot in page]
+            last = page[-1]
+        if len(page) < page_size:
+            return
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _commit_pages(db, pages, write, workers, report):
+    """
+    Commits one batch per page, calling `write(batch, item)` for each item, with up
+    to `workers` commits in flight; returns the number of items written.
+    """
+    def commit(page):
+        batch = db.batch()
+        for item in page:
+            write(batch, item)
+        batch.commit()
+        return len(page)
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+
+        def collect(done):
+            nonlocal written
+            for future in done:
+                written += future.result()
+                report(written)
+
+        for page in pages:
+            # Read ahead of the commits by at most one page per worker.
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(commit, page))
+        collect(wait(in_flight).done)
+    return written
+
+
+def delete_collection(db, collection_path, recursive=False, page_size=MAX_BATCH_SIZE, workers=8, progress=print):
+    """
+    Deletes every document of a collection, and with `recursive` every document of its
+    subcollections; returns the number of documents deleted.
+    """
+    if not 0 < page_size <= MAX_BATCH_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_BATCH_SIZE}, got {page_size}")
+    pages = iter_document_pages(db, collection_path, page_size, recursive)
+    deleted = _commit_pages(db, pages, lambda batch, ref: batch.delete(ref), workers,
+                            lambda count: progress(f"Deleted {count} documents from {collection_path}..."))
+    progress(f"Deleted {deleted} documents from {collection_path}.")
+    return deleted
+
+
+def write_documents(db, collection_path, documents, workers=8, progress=print):
+    """Adds `documents` (dicts) to a collection under generated IDs, 500 per batch; returns the number written."""
+    collection = db.collection(collection_path)
+    pages = ([(collection.document(), data) for data in chunk] for chunk in _chunks(documents, MAX_BATCH_SIZE))
+    written = _commit_pages(db, pages, lambda batch, item: batch.set(*item), workers,
+                            lambda count: progress(f"Wrote {count} documents to {collection_path}..."))
+    progress(f"Wrote {written} documents to {collection_path}.")
+    return written
+
+
+if __name__ == '__main__':
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    parser = argparse.ArgumentParser(description="Delete every document of a Firestore collection.")
+    parser.add_argument('collection', help="collection path, e.g. artifacts/default-app-id/public/data/hotels")
+    parser.add_argument('--recursive', action='store_true', help="also delete the documents of all subcollections")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent batch commits")
+    parser.add_argument('--page-size', type=int, default=MAX_BATCH_SIZE, help="documents listed and deleted per batch")
+    parser.add_argument('--credentials', default='serviceAccountKey.json', help="service account key file")
+    args = parser.parse_args()
+
+    firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+    delete_collection(firestore.client(), args.collection, recursive=args.recursive, page_size=args.page_size, workers=args.workers)
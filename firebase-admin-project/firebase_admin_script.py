@@ -1,7 +1,8 @@
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import random
-import time
+
+from collection_tools import delete_collection, write_documents
 
 # Global variables provided by the environment
 # The __app_id variable is essential for setting the correct Firestore collection path.
@@ -51,17 +52,12 @@ def add_mock_hotel_data():
     
     # Delete existing documents to avoid duplicates
     print("Clearing existing hotel data...")
-    docs = db.collection(collection_path).stream()
-    for doc in docs:
-        doc.reference.delete()
-    time.sleep(1) # Wait for a second for deletions to propagate
+    delete_collection(db, collection_path)
 
-    hotels_ref = db.collection(collection_path)
     hotels_data = generate_hotel_data()
     
     print(f"Adding {len(hotels_data)} hotel data entries to Firestore...")
-    for hotel in hotels_data:
-        hotels_ref.add(hotel)
+    write_documents(db, collection_path, hotels_data)
 
     print("Hotel data added successfully.")
     
@@ -97,9 +93,7 @@ def clear_user_profiles():
     """Clears all documents from the user_profiles collection."""
     collection_path = f"artifacts/{app_id}/public/data/user_profiles"
     print("Clearing existing user profiles...")
-    docs = db.collection(collection_path).stream()
-    for doc in docs:
-        doc.reference.delete()
+    delete_collection(db, collection_path, recursive=True)
     print("User profiles cleared.")
 
 # Run the functions